@@ -15,17 +15,24 @@ from optml import Parameter
 from optml.models import KerasModel
 
 class NNModel(KerasModel):
+    # the network is built in build_model rather than in __init__, so that trials which
+    # only change 'train_epochs' or 'batch_size' reuse the compiled network
     def __init__(self, input_dim, hidden_dim, train_epochs=100, batch_size=32): 
         self.epochs = train_epochs
         self.batch_size = batch_size
         self.input_dim = input_dim
         self.hidden_dim = hidden_dim
-        self.model = Sequential()
-        self.model.add(Dense(units=int(hidden_dim), input_dim=input_dim))
-        self.model.add(Activation('relu'))
-        self.model.add(Dense(units=1))
-        self.model.add(Activation('sigmoid'))
-        self.model.compile(loss='binary_crossentropy',
+
+    def build_model(self):
+        model = Sequential()
+        model.add(Dense(units=int(self.hidden_dim), input_dim=self.input_dim))
+        model.add(Activation('relu'))
+        model.add(Dense(units=1))
+        model.add(Activation('sigmoid'))
+        return model
+
+    def compile_model(self, model):
+        model.compile(loss='binary_crossentropy',
               optimizer='sgd',
               metrics=['accuracy'])
 
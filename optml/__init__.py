@@ -2,11 +2,15 @@ from optml import models
 from optml import genetic_optimizer
 from optml import gridsearch_optimizer
 from optml import random_search
+from optml import cmaes_optimizer
+from optml import differential_evolution_optimizer
 from optml import hyperopt_optimizer
 from optml.optimizer_base import Parameter
+from optml import parallel
 import optml.bayesian_optimizer
 
 __version__ = '0.2.3'
 
 __all__ = ['models', 'genetic_optimizer', 'gridsearch_optimizer',
-		   'random_search', 'hyperopt_optimizer', 'optimizer_base', 'bayesian_optimizer']
\ No newline at end of file
+		   'random_search', 'cmaes_optimizer', 'differential_evolution_optimizer',
+		   'hyperopt_optimizer', 'optimizer_base', 'bayesian_optimizer', 'parallel']
\ No newline at end of file
@@ -1,3 +1,6 @@
 from .bayesianoptimizer import BayesianOptimizer
+from .trust_region import TrustRegionBayesianOptimizer
+from .multi_fidelity import MultiFidelityBayesianOptimizer
 
-__all__ = ['optimizers', 'bayesian_optimizer', 'gp_categorical', 'kernels']
+__all__ = ['optimizers', 'bayesian_optimizer', 'gp_categorical', 'kernels', 'trust_region',
+           'multi_fidelity']
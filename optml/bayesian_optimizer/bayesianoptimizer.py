@@ -1,3 +1,4 @@
+import time
 import numpy as np
 import warnings
 
@@ -9,6 +10,7 @@ from optml.optimizer_base import Optimizer, MissingValueException
 from optml.bayesian_optimizer.kernels import HammingKernel, WeightedHammingKernel
 from optml.bayesian_optimizer.optimizers import MixedAnnealer, CategoricalMaximizer, cartesian_product
 from sklearn.gaussian_process.kernels import Matern
+from sklearn.base import clone
 
 from optml.bayesian_optimizer.gp_categorical import GaussianProcessRegressorWithCategorical
 
@@ -43,7 +45,15 @@ class BayesianOptimizer(Optimizer):
         bounds_arr: a Nx2 numpy array giving lower and upper bounds of all numeric 
             parameters. N = #hyperparameters to optimize
         success: Flag indicating whether acquisition function could successfully be maximized
-        acquisition_function: 
+        acquisition_function: name of the acquisition function. One of 'expected_improvement',
+            'generalized_expected_improvement', 'probability_of_improvement',
+            'upper_confidence_bound' or one of the cost-aware variants
+            'expected_improvement_per_second', 'generalized_expected_improvement_per_second'
+            and 'probability_of_improvement_per_second'
+        cost_history: a list with the training time in seconds of each entry in hyperparam_history,
+            nan for trials that were observed without a duration
+        cost_optimizer: a gaussian process regressor fitted on the log of the training times.
+            Only used by the cost-aware acquisition functions
     """
     def __init__(self, model, hyperparams, eval_func, acquisition_function='expected_improvement',
                  n_restarts_optimizer=10, exploration_control=0.01):
@@ -54,9 +64,11 @@ class BayesianOptimizer(Optimizer):
         self.eval_func = eval_func
         self.set_hyperparam_bounds()
         self.success = None
+        self.non_convergence_count = 0
         self.acquisition_function = acquisition_function
-        if acquisition_function == 'generalized_expected_improvement':
-            self.exploration_control = exploration_control
+        self.exploration_control = exploration_control
+        self.cost_history = []
+        self.cost_optimizer = None
 
     def choose_kernel(self):
         """
@@ -194,6 +206,117 @@ class BayesianOptimizer(Optimizer):
             gamma = (mu[0] - current_best)/std[0]
             return norm.cdf(gamma)
 
+    def expected_cost(self, x):
+        """
+        Predicts the training time for a set of hyperparameters from the gaussian
+        process that is fitted on the log of the measured training times. Without a
+        cost model (no trial has a measured duration) every point costs the same, so
+        the cost-aware acquisition functions reduce to the plain ones.
+
+        Args:
+            x: a numpy array with parameter values
+        Returns:
+            a float with the expected training time in seconds
+        """
+        if self.cost_optimizer is None:
+            return 1.
+        log_cost = self.cost_optimizer.predict(np.atleast_2d(x))
+        return np.exp(log_cost[0])
+
+    def expected_improvement_per_second(self, optimizer, x):
+        """
+        Calculates the expected improvement per second as an acquisition function
+        as described in 'Practical Bayesian Optimization of Machine Learning Algorithms'
+        (https://arxiv.org/abs/1206.2944). Cheap points are preferred over expensive
+        points with the same expected improvement.
+
+        Args:
+            optimizer: a fitted gaussian process regressor
+            x: a numpy array with parameter values
+        Returns:
+            a float
+        """
+        return self.expected_improvement(optimizer, x) / self.expected_cost(x)
+
+    def generalized_expected_improvement_per_second(self, optimizer, x, xi=0.01):
+        """
+        Calculates the generalized expected improvement per second of training time.
+
+        Args:
+            optimizer: a fitted gaussian process regressor
+            x: a numpy array with parameter values
+            xi: controls the trade-off between exploration and exploitation
+        Returns:
+            a float
+        """
+        return self.generalized_expected_improvement(optimizer, x, xi) / self.expected_cost(x)
+
+    def probability_of_improvement_per_second(self, optimizer, x):
+        """
+        Calculates the probability of improvement per second of training time.
+
+        Args:
+            optimizer: a fitted gaussian process regressor
+            x: a numpy array with parameter values
+        Returns:
+            a float
+        """
+        return self.probability_of_improvement(optimizer, x) / self.expected_cost(x)
+
+    def acquisition(self, optimizer, x):
+        """
+        Evaluates the acquisition function specified by self.acquisition_function.
+
+        Args:
+            optimizer: a fitted gaussian process regressor
+            x: a numpy array with parameter values
+        Returns:
+            a float
+        """
+        if self.acquisition_function == 'expected_improvement':
+            return self.expected_improvement(optimizer, x)
+        elif self.acquisition_function == 'upper_confidence_bound':
+            return self.upper_confidence_bound(optimizer, x)
+        elif self.acquisition_function == 'probability_of_improvement':
+            return self.probability_of_improvement(optimizer, x)
+        elif self.acquisition_function == 'generalized_expected_improvement':
+            return self.generalized_expected_improvement(optimizer, x, self.exploration_control)
+        elif self.acquisition_function == 'expected_improvement_per_second':
+            return self.expected_improvement_per_second(optimizer, x)
+        elif self.acquisition_function == 'generalized_expected_improvement_per_second':
+            return self.generalized_expected_improvement_per_second(optimizer, x, self.exploration_control)
+        elif self.acquisition_function == 'probability_of_improvement_per_second':
+            return self.probability_of_improvement_per_second(optimizer, x)
+        raise ValueError("Unknown acquisition function '{}'".format(self.acquisition_function))
+
+    @property
+    def is_cost_aware(self):
+        return self.acquisition_function.endswith('_per_second')
+
+    def fit_cost_model(self, xs):
+        """
+        Fits a second gaussian process on the log of the training times in
+        self.cost_history. The cost model uses the same kernel as the model of the scores.
+        Trials without a measured duration (nan) are left out; if no trial has one,
+        self.cost_optimizer is None.
+
+        Args:
+            xs: a numpy array with the parameter values of all evaluated points
+
+        Returns:
+            None
+        """
+        costs = np.asarray(self.cost_history, dtype=float)
+        measured = np.isfinite(costs)
+        if not np.any(measured):
+            self.cost_optimizer = None
+            return
+        self.cost_optimizer = GaussianProcessRegressorWithCategorical(kernel=clone(self.kernel),
+                                                alpha=1e-4,
+                                                n_restarts_optimizer=self.n_restarts_optimizer,
+                                                normalize_y=True)
+        self.cost_optimizer.fit(xs[measured], np.log(np.maximum(costs[measured], 1e-6)))
+
     def get_random_values_arr(self):
         """
         Generates a numpy array with randomly sampled values for 
@@ -241,14 +364,9 @@ class BayesianOptimizer(Optimizer):
             a dictionary with a flag indicating success of the optimization and the 
             resulting hyperparameter values
         """
-        if self.acquisition_function == 'expected_improvement':
-            minimized = minimize(lambda x: -1 * self.expected_improvement(optimizer, x), start_vals, bounds=self.bounds_arr, method='L-BFGS-B')
-        elif self.acquisition_function == 'upper_confidence_bound':
-            minimized = minimize(lambda x: -1 * self.upper_confidence_bound(optimizer, x), start_vals, bounds=self.bounds_arr, method='L-BFGS-B')
-        elif self.acquisition_function == 'probability_of_improvement':
-            minimized = minimize(lambda x: -1 * self.probability_of_improvement(optimizer, x), start_vals, bounds=self.bounds_arr, method='L-BFGS-B')
-        elif self.acquisition_function == 'generalized_expected_improvement':
-            minimized = minimize(lambda x: -1 * self.generalized_expected_improvement(optimizer, x, self.exploration_control), start_vals, bounds=self.bounds_arr, method='L-BFGS-B')
+        start_vals = np.asarray(start_vals, dtype=float).ravel()
+        minimized = minimize(lambda x: -1 * self.acquisition(optimizer, x), start_vals,
+                             bounds=self.bounds_arr, method='L-BFGS-B')
         return minimized
 
     def optimize_categorical_problem(self, optimizer, start_vals):
@@ -343,7 +461,7 @@ class BayesianOptimizer(Optimizer):
             self.success = False
             warnings.warn('optimizer did not converge! Continuing with randomly sampled data...')
             self.non_convergence_count += 1
-            return {hp.name:v for hp,v in zip(self.hyperparams, start_vals)}
+            return {hp.name:v for hp,v in zip(self.hyperparams, start_vals[0])}
 
     def _param_dict_to_arr(self, param_dict):
         """
@@ -373,6 +491,49 @@ class BayesianOptimizer(Optimizer):
         """
         return {hp.name: p for hp, p in zip(self.hyperparams, param_arr)}
 
+    def propose(self):
+        """
+        Fits the gaussian process to self.hyperparam_history and returns the maximizer
+        of the acquisition function. The first proposal is random.
+
+        Args:
+            None
+
+        Returns:
+            a dictionary with parameter names as keys and parameter values as values
+        """
+        if len(self.hyperparam_history) == 0:
+            return self.get_random_values_dict()
+        optimizer = GaussianProcessRegressorWithCategorical(kernel=self.kernel,
+                                                alpha=1e-4,
+                                                n_restarts_optimizer=self.n_restarts_optimizer,
+                                                normalize_y=True)
+        xs = [self._param_dict_to_arr(params) for score, params in self.hyperparam_history]
+        if self.optimization_type == 'numerical':
+            xs = np.array(xs, dtype=float)
+        else:
+            xs = np.array(xs, dtype=object)
+        ys = np.array([score for score, params in self.hyperparam_history])
+        optimizer.fit(xs,ys)
+        if self.is_cost_aware:
+            self.fit_cost_model(xs)
+        return self.get_next_hyperparameters(optimizer)
+
+    def observe(self, score, hyperparams, duration=None):
+        """
+        Records the result of a trial together with its duration for the cost model.
+
+        Args:
+            score: the score of the trial
+            hyperparams: a dictionary with the evaluated hyperparameters
+            duration: the time in seconds it took to evaluate the trial. default is None
+
+        Returns:
+            None
+        """
+        self.hyperparam_history.append((score, hyperparams))
+        self.cost_history.append(np.nan if duration is None else duration)
+
     def fit(self, X_train, y_train, X_test=None, y_test=None, n_iters=10, n_folds=None):
         """
         Given training data and optional validation data fit the machine learning model
@@ -400,33 +561,11 @@ class BayesianOptimizer(Optimizer):
             raise Exception("Provide either 'X_test' and 'y_test' or 'n_folds'")
 
         self.non_convergence_count = 0
-        optimizer = GaussianProcessRegressorWithCategorical(kernel=self.kernel,
-                                                alpha=1e-4,
-                                                n_restarts_optimizer=self.n_restarts_optimizer,
-                                                normalize_y=True)
-        for i in range(n_iters):            
-            if i>0:           
-                xs = [self._param_dict_to_arr(params) for score, params in self.hyperparam_history]
-                xs = np.array(xs, dtype=object)
-                ys = np.array([score for score, params in self.hyperparam_history])
-                optimizer.fit(xs,ys)
-                new_hyperparams = self.get_next_hyperparameters(optimizer)
-            else:
-                new_hyperparams = self.get_random_values_dict()
-
-            if n_folds is not None:
-                splits = self.get_kfold_split(n_folds, X_train)
-                scores = []
-                for train_idxs, test_idxs in splits:
-                    new_model = self.build_new_model(new_hyperparams)
-                    new_model.fit(X_train[train_idxs], y_train[train_idxs])
-                    scores.append(self.eval_func(y_train[test_idxs], new_model.predict(X_train[test_idxs])))
-                score = np.mean(scores)
-                del scores
-            else:
-                new_model.fit(X_train, y_train)
-                score = self.eval_func(y_test, new_model.predict(X_test))
-            self.hyperparam_history.append((score, new_hyperparams))
+        for i in range(n_iters):
+            new_hyperparams = self.propose()
+            start = time.time()
+            score = self.evaluate_hyperparams(new_hyperparams, X_train, y_train, X_test, y_test, n_folds)
+            self.observe(score, new_hyperparams, time.time() - start)
         
         best_params, best_model = self.get_best_params_and_model()
         return best_params, best_model
@@ -0,0 +1,320 @@
+import time
+import numpy as np
+
+import sklearn.gaussian_process as gp
+from scipy.stats import norm
+from sklearn.gaussian_process.kernels import Matern, ConstantKernel, WhiteKernel
+
+from optml.optimizer_base import MissingValueException
+from optml.data import take
+from optml.folds import CrossValidation
+from optml.bayesian_optimizer.bayesianoptimizer import BayesianOptimizer
+
+
+class MultiFidelityBayesianOptimizer(BayesianOptimizer):
+    """ Multi-Fidelity Bayesian Optimizer
+    Evaluates candidates on random subsamples of the training data and models the
+    score jointly over the hyperparameters and the fraction of the training data
+    (the fidelity) with a single gaussian process.
+
+    The next point is the maximizer of the expected improvement at full fidelity.
+    The fidelity it is evaluated at is chosen in a cost-aware fashion similar to
+    'Multi-fidelity Bayesian Optimisation with Continuous Approximations' by
+    Kandasamy et al. (https://arxiv.org/abs/1703.06240): for each fidelity the
+    reduction of the posterior variance at full fidelity is divided by the
+    expected training time at that fidelity. Cheap subsamples are therefore used
+    for exploration and full fits only once the cheap ones stop being informative.
+
+    Args:
+        model: a model (currently supports scikit-learn, xgboost, or a class
+               derived from optml.models.Model)
+        hyperparams: a list of Parameter instances of type 'continuous' or 'integer'
+        eval_func: scoring function to be maximized. Takes input (y_true, y_predicted) where
+            y_true and y_predicted are numpy arrays
+        fidelities: fractions of the training data a model can be trained on. The
+            largest one is considered to be the full fidelity. default is (0.1, 0.3, 1.0)
+        n_init_samples: number of random points evaluated at the lowest fidelity
+            before the gaussian process is used. default is None which uses d+1
+        n_candidates: number of random candidates on which the acquisition function is
+            evaluated
+        n_restarts_optimizer: number of restarts when fitting the kernel of the gaussian process
+
+    Attributes:
+        fidelity_history: a list of tuples (score, params, fidelity, duration) with
+            all evaluations. hyperparam_history only contains the evaluations at
+            full fidelity
+    """
+    def __init__(self, model, hyperparams, eval_func, fidelities=(0.1, 0.3, 1.0),
+                 n_init_samples=None, n_candidates=1000, n_restarts_optimizer=2):
+        for hp in hyperparams:
+            if hp.param_type not in ['continuous', 'integer']:
+                raise ValueError("MultiFidelityBayesianOptimizer only takes parameters of type 'continuous' and 'integer'")
+        if (min(fidelities) <= 0) or (max(fidelities) > 1):
+            raise ValueError("fidelities need to be fractions in (0, 1]")
+        super(MultiFidelityBayesianOptimizer, self).__init__(model, hyperparams, eval_func,
+                                                             n_restarts_optimizer=n_restarts_optimizer)
+        self.fidelities = sorted(fidelities)
+        self.n_dims = len(hyperparams)
+        if n_init_samples is None:
+            n_init_samples = self.n_dims + 1
+        self.n_init_samples = n_init_samples
+        self.n_candidates = n_candidates
+        self.fidelity_history = []
+
+    @property
+    def full_fidelity(self):
+        return self.fidelities[-1]
+
+    def _to_unit_cube(self, xs):
+        lower, upper = self.bounds_arr[:, 0], self.bounds_arr[:, 1]
+        return (np.asarray(xs, dtype=float) - lower) / (upper - lower)
+
+    def _from_unit_cube(self, x):
+        lower, upper = self.bounds_arr[:, 0], self.bounds_arr[:, 1]
+        values = lower + np.clip(x, 0., 1.) * (upper - lower)
+        new_params = {}
+        for hp, v in zip(self.hyperparams, values):
+            if hp.param_type == 'integer':
+                new_params[hp.name] = int(round(v))
+            else:
+                new_params[hp.name] = float(v)
+        return new_params
+
+    def get_subsample_indices(self, n_samples):
+        """
+        Draws nested random subsets of the training rows, one per fidelity, so that
+        each subsample contains all smaller ones. Indices are sorted to keep row
+        access sequential.
+
+        Args:
+            n_samples: number of rows in the training data
+
+        Returns:
+            a dictionary with fidelities as keys and numpy arrays of row indices as values
+        """
+        permutation = np.random.permutation(n_samples)
+        subsamples = {}
+        for fidelity in self.fidelities:
+            n_rows = max(1, int(np.ceil(fidelity * n_samples)))
+            subsamples[fidelity] = np.sort(permutation[:n_rows])
+        return subsamples
+
+    def expected_cost(self, fidelity):
+        """
+        Estimates the training time at a given fidelity. Uses the mean of the
+        measured durations at this fidelity if available and otherwise assumes that
+        the training time grows linearly with the number of rows.
+
+        Args:
+            fidelity: a fraction of the training data
+
+        Returns:
+            a float with the expected duration in seconds
+        """
+        durations = [d for score, params, f, d in self.fidelity_history if f == fidelity]
+        if len(durations) > 0:
+            return max(np.mean(durations), 1e-6)
+        per_fraction = np.mean([d / f for score, params, f, d in self.fidelity_history])
+        return max(per_fraction * fidelity, 1e-6)
+
+    def fit_gaussian_process(self):
+        """
+        Fits a gaussian process on all evaluations. The input of the gaussian
+        process are the hyperparameters scaled to the unit cube with the fidelity
+        appended as last column.
+
+        Args:
+            None
+
+        Returns:
+            a fitted gaussian process regressor
+        """
+        xs = np.array([self._param_dict_to_arr(params) for score, params, f, d in self.fidelity_history], dtype=float)
+        fs = np.array([[f] for score, params, f, d in self.fidelity_history])
+        ys = np.array([score for score, params, f, d in self.fidelity_history])
+        kernel = ConstantKernel(1.0, (1e-2, 1e2)) * \
+            Matern(length_scale=np.ones(self.n_dims + 1), length_scale_bounds=(1e-2, 1e2), nu=2.5) + \
+            WhiteKernel(1e-3, (1e-6, 1e-1))
+        optimizer = gp.GaussianProcessRegressor(kernel=kernel,
+                                                n_restarts_optimizer=self.n_restarts_optimizer,
+                                                normalize_y=True)
+        optimizer.fit(np.hstack([self._to_unit_cube(xs), fs]), ys)
+        return optimizer
+
+    def choose_fidelity(self, optimizer, x):
+        """
+        Picks the fidelity that maximizes the reduction of the posterior variance at
+        full fidelity per second of expected training time.
+
+        Args:
+            optimizer: a fitted gaussian process regressor
+            x: a numpy array with the unit cube coordinates of the next point
+
+        Returns:
+            a float with the chosen fidelity
+        """
+        best_fidelity, best_value = self.full_fidelity, -np.inf
+        for fidelity in self.fidelities:
+            query = np.array([np.append(x, fidelity), np.append(x, self.full_fidelity)])
+            mu, cov = optimizer.predict(query, return_cov=True)
+            if cov[0, 0] <= 0:
+                continue
+            variance_reduction = cov[0, 1]**2 / cov[0, 0]
+            value = variance_reduction / self.expected_cost(fidelity)
+            if value > best_value:
+                best_fidelity, best_value = fidelity, value
+        return best_fidelity
+
+    def get_next_hyperparameters(self, optimizer):
+        """
+        Maximizes the expected improvement at full fidelity over a set of random
+        candidates and chooses the fidelity for the best candidate.
+
+        Args:
+            optimizer: a fitted gaussian process regressor
+
+        Returns:
+            a tuple with a dictionary of hyperparameters and the fidelity to evaluate them at
+        """
+        observed = np.array([self._param_dict_to_arr(params) for score, params, f, d in self.fidelity_history], dtype=float)
+        observed = self._to_unit_cube(observed)
+        candidates = np.random.uniform(size=(self.n_candidates, self.n_dims))
+        full = np.full((len(observed), 1), self.full_fidelity)
+        current_best = np.max(optimizer.predict(np.hstack([observed, full])))
+
+        full = np.full((self.n_candidates, 1), self.full_fidelity)
+        mu, std = optimizer.predict(np.hstack([candidates, full]), return_std=True)
+        exp_improv = np.zeros(self.n_candidates)
+        nonzero = std > 0
+        gamma = (mu[nonzero] - current_best) / std[nonzero]
+        exp_improv[nonzero] = std[nonzero] * (gamma * norm.cdf(gamma) + norm.pdf(gamma))
+        x = candidates[np.argmax(exp_improv)]
+        self.success = True
+        return self._from_unit_cube(x), self.choose_fidelity(optimizer, x)
+
+    def propose(self):
+        """
+        Returns a random point for the first n_init_samples trials and afterwards the
+        maximizer of the expected improvement at full fidelity. Proposed trials are
+        evaluated by whoever calls propose (e.g. the workers of
+        optml.distributed.Coordinator) on all of the training data, so the
+        subsampled fidelities are only used by self.fit().
+
+        Args:
+            None
+
+        Returns:
+            a dictionary with parameter names as keys and parameter values as values
+        """
+        if len(self.fidelity_history) < self.n_init_samples:
+            return self.get_random_values_dict()
+        new_hyperparams, fidelity = self.get_next_hyperparameters(self.fit_gaussian_process())
+        return new_hyperparams
+
+    def observe(self, score, hyperparams, duration=None):
+        """
+        Records the result of a trial that was proposed by self.propose() as an
+        evaluation at full fidelity.
+
+        Args:
+            score: the score of the trial
+            hyperparams: a dictionary with the evaluated hyperparameters
+            duration: the time in seconds it took to evaluate the trial. default is None
+
+        Returns:
+            None
+        """
+        super(MultiFidelityBayesianOptimizer, self).observe(score, hyperparams, duration)
+        self.fidelity_history.append((score, hyperparams, self.full_fidelity,
+                                      np.nan if duration is None else duration))
+
+    def fit(self, X_train, y_train, X_test=None, y_test=None, n_iters=10, n_folds=None):
+        """
+        Given training data and optional validation data fit the machine learning model
+        on subsamples of the training data to find optimal hyperparameters. If X_test
+        and y_test are provided then the scoring function is applied to the predictions
+        on X_test rather than X_train.
+
+        Args:
+            X_train: a numpy array with training data. each row corresponds to a data point
+            y_train: a numpy array containing the target variable for the training data
+            X_test: a numpy array with validation data. each row corresponds to a data point
+            y_test: a numpy array containing the target variable for the validation data
+            n_iters: total number of model evaluations (at any fidelity). default is 10.
+            n_folds: number of folds for cross-validation on the subsample. default is None
+
+        Returns:
+            best_params: a dictionary with optimized hyperparameters
+            best_model: an untrained model with the optimized hyperparameters
+        """
+        if (X_test is None) and (y_test is None):
+            X_test = X_train
+            y_test = y_train
+        elif (X_test is None) or (y_test is None):
+            raise MissingValueException("Need to provide 'X_test' and 'y_test'")
+        elif (X_test is not None) and (y_test is not None) and (n_folds is not None):
+            raise Exception("Provide either 'X_test' and 'y_test' or 'n_folds'")
+
+        subsamples = self.get_subsample_indices(len(y_train))
+        # each subsample is taken once and keeps its own folds for the whole run, so
+        # that folds (and cached fold matrices) are not recomputed whenever the fidelity changes
+        data = {}
+        for fidelity, idxs in subsamples.items():
+            if len(idxs) == len(y_train):
+                data[fidelity] = (X_train, y_train)
+            else:
+                data[fidelity] = (take(X_train, idxs), take(y_train, idxs))
+        cvs = {}
+        if (n_folds is not None) and (self.cv is not None):
+            self.cv.clear()
+        try:
+            self._fit_fidelities(data, cvs, X_test, y_test, n_iters, n_folds)
+        finally:
+            # only the folds of the full training data are kept
+            for fidelity, cv in cvs.items():
+                if fidelity != self.full_fidelity:
+                    cv.clear()
+            if n_folds is not None:
+                self.cv = cvs.get(self.full_fidelity)
+
+        best_params, best_model = self.get_best_params_and_model()
+        return best_params, best_model
+
+    def _fit_fidelities(self, data, cvs, X_test, y_test, n_iters, n_folds):
+        """
+        Runs the iterations of self.fit on the subsamples in data.
+        """
+        for i in range(n_iters):
+            n_full = len(self.hyperparam_history)
+            if i < self.n_init_samples:
+                new_hyperparams = self.get_random_values_dict()
+                fidelity = self.fidelities[0]
+            else:
+                optimizer = self.fit_gaussian_process()
+                new_hyperparams, fidelity = self.get_next_hyperparameters(optimizer)
+            if (n_full == 0) and (i == n_iters - 1):
+                # make sure that at least one model has been trained on all of the data
+                fidelity = self.full_fidelity
+                if i >= self.n_init_samples:
+                    new_hyperparams = self._incumbent_at_full_fidelity(optimizer)
+
+            if n_folds is not None:
+                if fidelity not in cvs:
+                    cvs[fidelity] = CrossValidation(n_folds, **self.cv_options)
+                self.cv = cvs[fidelity]
+            start = time.time()
+            score = self.evaluate_hyperparams(new_hyperparams, data[fidelity][0], data[fidelity][1],
+                                              X_test, y_test, n_folds)
+            duration = time.time() - start
+            self.fidelity_history.append((score, new_hyperparams, fidelity, duration))
+            if fidelity == self.full_fidelity:
+                self.hyperparam_history.append((score, new_hyperparams))
+
+    def _incumbent_at_full_fidelity(self, optimizer):
+        """
+        Returns the evaluated hyperparameters with the highest predicted score at full fidelity.
+        """
+        params = [p for score, p, f, d in self.fidelity_history]
+        xs = self._to_unit_cube(np.array([self._param_dict_to_arr(p) for p in params], dtype=float))
+        full = np.full((len(xs), 1), self.full_fidelity)
+        return params[np.argmax(optimizer.predict(np.hstack([xs, full])))]
@@ -72,14 +72,7 @@ class MixedAnnealer(Annealer):
             a float with the energy of the current state
         """
         state_input = self.bayesian_optimizer._param_dict_to_arr(self.state)
-        if self.bayesian_optimizer.acquisition_function == 'expected_improvement':
-            e = -1 * self.bayesian_optimizer.expected_improvement(self.gaussian_process, [state_input])
-        elif self.bayesian_optimizer.acquisition_function == 'upper_confidence_bound':
-            e = -1 * self.bayesian_optimizer.probability_of_improvement(self.gaussian_process, [state_input])
-        elif self.acquisition_function == 'probability_of_improvement':
-            e = -1 * self.bayesian_optimizer.probability_of_improvement(self.gaussian_process, [state_input])
-        elif self.acquisition_function == 'generalized_expected_improvement':
-            e = -1 * self.bayesian_optimizer.generalized_expected_improvement(self.gaussian_process, [state_input])
+        e = -1 * self.bayesian_optimizer.acquisition(self.gaussian_process, [state_input])
         return e
 
 
@@ -96,14 +89,7 @@ class CategoricalMaximizer(object):
         return combis   
 
     def find_max(self):
-        if self.bayesian_optimizer.acquisition_function == 'expected_improvement':
-            acquisition_function = lambda x: self.bayesian_optimizer.expected_improvement(self.gaussian_process, [x])
-        elif self.bayesian_optimizer.acquisition_function == 'upper_confidence_bound':
-            acquisition_function = lambda x: self.bayesian_optimizer.probability_of_improvement(self.gaussian_process, [x])
-        elif self.acquisition_function == 'probability_of_improvement':
-            acquisition_function = lambda x: self.bayesian_optimizer.probability_of_improvement(self.gaussian_process, [x])
-        elif self.acquisition_function == 'generalized_expected_improvement':
-            acquisition_function = lambda x: self.bayesian_optimizer.generalized_expected_improvement(self.gaussian_process, [x])
+        acquisition_function = lambda x: self.bayesian_optimizer.acquisition(self.gaussian_process, [x])
         grid = self.make_grid()
         scores = [acquisition_function(p) for p in grid]
         max_idx = np.argmax(scores)
@@ -0,0 +1,456 @@
+import time
+import numpy as np
+
+import sklearn.gaussian_process as gp
+from scipy.stats import norm
+from sklearn.gaussian_process.kernels import Matern, ConstantKernel, WhiteKernel
+
+from optml.optimizer_base import MissingValueException
+from optml.bayesian_optimizer.bayesianoptimizer import BayesianOptimizer
+
+
+def latin_hypercube(n_samples, n_dims):
+    """
+    Draws a latin hypercube sample in the unit cube.
+
+    Args:
+        n_samples: number of points
+        n_dims: number of dimensions
+
+    Returns:
+        a numpy array of shape (n_samples, n_dims) with values in [0, 1]
+    """
+    offsets = np.random.uniform(size=(n_samples, n_dims))
+    strata = np.array([np.random.permutation(n_samples) for _ in range(n_dims)]).T
+    return (strata + offsets) / float(n_samples)
+
+
+class TrustRegion(object):
+    """
+    A hyper-rectangle in the unit cube centred around the best point found
+    inside of it. The side length is doubled after a number of consecutive
+    improvements and halved after a number of consecutive failures.
+
+    Args:
+        n_dims: number of dimensions of the search space
+        length_init: initial side length of the region
+        length_min: the region is considered collapsed once its length falls below this value
+        length_max: maximum side length of the region
+        success_tolerance: number of consecutive improvements before the region is expanded
+        failure_tolerance: number of consecutive failures before the region is shrunk
+
+    Attributes:
+        center: a numpy array with the (unit cube) coordinates of the incumbent
+        best_score: score of the incumbent
+        length: current side length
+        weights: per-dimension scaling of the side length, derived from the
+            length scales of the local gaussian process
+        success_count: number of consecutive improvements
+        failure_count: number of consecutive failures
+    """
+    def __init__(self, n_dims, length_init=0.8, length_min=0.5**7, length_max=1.6,
+                 success_tolerance=3, failure_tolerance=None):
+        self.n_dims = n_dims
+        self.length_init = length_init
+        self.length_min = length_min
+        self.length_max = length_max
+        self.success_tolerance = success_tolerance
+        if failure_tolerance is None:
+            failure_tolerance = max(4, n_dims)
+        self.failure_tolerance = failure_tolerance
+        self.reset()
+
+    def reset(self):
+        """
+        Restores the initial side length and forgets the incumbent.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self.center = None
+        self.best_score = -np.inf
+        self.length = self.length_init
+        self.weights = np.ones(self.n_dims)
+        self.success_count = 0
+        self.failure_count = 0
+
+    @property
+    def collapsed(self):
+        return self.length < self.length_min
+
+    def get_bounds(self):
+        """
+        Returns the lower and upper corner of the region, clipped to the unit cube.
+
+        Args:
+            None
+
+        Returns:
+            a tuple of two numpy arrays
+        """
+        half_width = self.weights * self.length / 2.
+        lower = np.clip(self.center - half_width, 0., 1.)
+        upper = np.clip(self.center + half_width, 0., 1.)
+        return lower, upper
+
+    def contains(self, xs):
+        """
+        Checks which points lie inside the region.
+
+        Args:
+            xs: a numpy array of shape (n_points, n_dims) with unit cube coordinates
+
+        Returns:
+            a boolean numpy array of length n_points
+        """
+        lower, upper = self.get_bounds()
+        return np.all((xs >= lower) & (xs <= upper), axis=1)
+
+    def observe(self, x, score, update_length=True):
+        """
+        Updates the incumbent and the success/failure counters with a new observation
+        and expands or shrinks the region accordingly.
+
+        Args:
+            x: a numpy array with the unit cube coordinates of the evaluated point
+            score: the score of the evaluated point
+            update_length: if False only the incumbent is updated (used during the
+                initial design of the region)
+
+        Returns:
+            None
+        """
+        if np.isfinite(self.best_score):
+            improved = score > self.best_score + 1e-3 * np.abs(self.best_score)
+        else:
+            improved = score > self.best_score
+        if score > self.best_score:
+            self.best_score = score
+            self.center = np.array(x, dtype=float)
+        if not update_length:
+            return
+        if improved:
+            self.success_count += 1
+            self.failure_count = 0
+        else:
+            self.success_count = 0
+            self.failure_count += 1
+        if self.success_count >= self.success_tolerance:
+            self.length = min(2. * self.length, self.length_max)
+            self.success_count = 0
+        elif self.failure_count >= self.failure_tolerance:
+            self.length /= 2.
+            self.failure_count = 0
+
+
+class TrustRegionBayesianOptimizer(BayesianOptimizer):
+    """ Trust Region Bayesian Optimizer
+    Implemented as described in the paper 'Scalable Global Optimization via Local
+    Bayesian Optimization' by David Eriksson et al. (https://arxiv.org/abs/1910.01739)
+
+    Instead of a single gaussian process over the whole search space the optimizer
+    maintains several trust regions. Each region fits a local gaussian process
+    only on the evaluated points that lie inside of it and proposes candidates
+    close to its incumbent. Regions expand while they keep improving, shrink when
+    they fail and are restarted with a new initial design once they collapse.
+    This is intended for problems with many continuous or integer hyperparameters
+    where a global gaussian process is both expensive and barely better than
+    random search.
+
+    Args:
+        model: a model (currently supports scikit-learn, xgboost, or a class
+               derived from optml.models.Model)
+        hyperparams: a list of Parameter instances of type 'continuous' or 'integer'
+        eval_func: scoring function to be maximized. Takes input (y_true, y_predicted) where
+            y_true and y_predicted are numpy arrays
+        acquisition_function: 'expected_improvement' or 'thompson_sampling'
+        n_trust_regions: number of trust regions
+        n_init_samples: number of random points each region evaluates after a
+            (re)start. default is None which uses min(2*d, n_iters/(2*n_trust_regions))
+        n_candidates: number of candidates per region on which the acquisition
+            function is evaluated. default is None which uses min(100*d, 2000)
+        length_init, length_min, length_max: initial, minimal and maximal side
+            length of a region in the unit cube
+        success_tolerance: consecutive improvements before a region is expanded
+        failure_tolerance: consecutive failures before a region is shrunk. default
+            is None which uses max(4, d)
+        n_restarts_optimizer: number of restarts when fitting the kernel of a local
+            gaussian process
+
+    Attributes:
+        trust_regions: a list of TrustRegion instances
+        n_restarts: number of times a collapsed region has been restarted
+    """
+    def __init__(self, model, hyperparams, eval_func, acquisition_function='expected_improvement',
+                 n_trust_regions=3, n_init_samples=None, n_candidates=None,
+                 length_init=0.8, length_min=0.5**7, length_max=1.6,
+                 success_tolerance=3, failure_tolerance=None, n_restarts_optimizer=2):
+        for hp in hyperparams:
+            if hp.param_type not in ['continuous', 'integer']:
+                raise ValueError("TrustRegionBayesianOptimizer only takes parameters of type 'continuous' and 'integer'")
+        if acquisition_function not in ['expected_improvement', 'thompson_sampling']:
+            raise ValueError("acquisition_function needs to be 'expected_improvement' or 'thompson_sampling'")
+        super(TrustRegionBayesianOptimizer, self).__init__(model, hyperparams, eval_func,
+                                                           acquisition_function=acquisition_function,
+                                                           n_restarts_optimizer=n_restarts_optimizer)
+        self.n_dims = len(hyperparams)
+        self.n_init_samples = n_init_samples
+        if n_candidates is None:
+            n_candidates = min(100 * self.n_dims, 2000)
+        self.n_candidates = n_candidates
+        self.trust_regions = [TrustRegion(self.n_dims, length_init, length_min, length_max,
+                                          success_tolerance, failure_tolerance)
+                              for _ in range(n_trust_regions)]
+        self.n_restarts = 0
+        # state of propose/observe: the initial design that still needs to be
+        # proposed per region and the region of each proposal that waits for its score
+        self._design = None
+        self._design_size = None
+        self._asked = []
+
+    def _to_unit_cube(self, xs):
+        lower, upper = self.bounds_arr[:, 0], self.bounds_arr[:, 1]
+        return (np.asarray(xs, dtype=float) - lower) / (upper - lower)
+
+    def _from_unit_cube(self, x):
+        """
+        Converts a point in the unit cube into a dictionary of hyperparameters.
+        Integer parameters are rounded.
+
+        Args:
+            x: a numpy array with unit cube coordinates
+
+        Returns:
+            a dictionary with parameter names as keys and parameter values as values
+        """
+        lower, upper = self.bounds_arr[:, 0], self.bounds_arr[:, 1]
+        values = lower + np.clip(x, 0., 1.) * (upper - lower)
+        new_params = {}
+        for hp, v in zip(self.hyperparams, values):
+            if hp.param_type == 'integer':
+                new_params[hp.name] = int(round(v))
+            else:
+                new_params[hp.name] = float(v)
+        return new_params
+
+    def _history_arrays(self):
+        xs = np.array([self._param_dict_to_arr(params) for score, params in self.hyperparam_history], dtype=float)
+        ys = np.array([score for score, params in self.hyperparam_history], dtype=float)
+        return self._to_unit_cube(xs), ys
+
+    def fit_local_gp(self, region, xs, ys):
+        """
+        Fits a gaussian process on the points inside a trust region. If fewer than
+        d+1 points lie inside the region then the points closest to its centre are used.
+        The length scales of the fitted kernel determine the shape of the region.
+
+        Args:
+            region: a TrustRegion instance
+            xs: a numpy array with the unit cube coordinates of all evaluated points
+            ys: a numpy array with the corresponding scores
+
+        Returns:
+            a fitted gaussian process regressor
+        """
+        inside = region.contains(xs)
+        n_min = min(len(ys), self.n_dims + 1)
+        if np.sum(inside) < n_min:
+            distances = np.sum(((xs - region.center) / region.weights)**2, axis=1)
+            inside = np.zeros(len(ys), dtype=bool)
+            inside[np.argsort(distances)[:n_min]] = True
+        kernel = ConstantKernel(1.0, (1e-2, 1e2)) * \
+            Matern(length_scale=np.ones(self.n_dims), length_scale_bounds=(5e-3, 2.0), nu=2.5) + \
+            WhiteKernel(1e-3, (1e-6, 1e-1))
+        local_gp = gp.GaussianProcessRegressor(kernel=kernel,
+                                               n_restarts_optimizer=self.n_restarts_optimizer,
+                                               normalize_y=True)
+        local_gp.fit(xs[inside], ys[inside])
+        length_scales = local_gp.kernel_.k1.k2.length_scale
+        weights = length_scales / np.mean(length_scales)
+        region.weights = weights / np.prod(weights)**(1. / self.n_dims)
+        return local_gp
+
+    def get_candidates(self, region):
+        """
+        Samples candidates inside a trust region by perturbing a random subset of
+        the coordinates of its centre. For high dimensional problems only about
+        20 coordinates are perturbed at a time.
+
+        Args:
+            region: a TrustRegion instance
+
+        Returns:
+            a numpy array of shape (n_candidates, d) with unit cube coordinates
+        """
+        lower, upper = region.get_bounds()
+        perturbed = lower + (upper - lower) * np.random.uniform(size=(self.n_candidates, self.n_dims))
+        prob_perturb = min(20. / self.n_dims, 1.)
+        mask = np.random.uniform(size=(self.n_candidates, self.n_dims)) <= prob_perturb
+        no_perturbation = np.where(~np.any(mask, axis=1))[0]
+        mask[no_perturbation, np.random.randint(0, self.n_dims, size=len(no_perturbation))] = True
+        candidates = np.tile(region.center, (self.n_candidates, 1))
+        candidates[mask] = perturbed[mask]
+        return candidates
+
+    def score_candidates(self, local_gp, candidates, current_best):
+        """
+        Evaluates the acquisition function on all candidates at once.
+
+        Args:
+            local_gp: a fitted gaussian process regressor
+            candidates: a numpy array of shape (n_candidates, d)
+            current_best: the best score observed so far
+
+        Returns:
+            a numpy array with the value of the acquisition function for each candidate
+        """
+        if self.acquisition_function == 'thompson_sampling':
+            return local_gp.sample_y(candidates, 1, random_state=np.random.randint(2**31 - 1))[:, 0]
+        mu, std = local_gp.predict(candidates, return_std=True)
+        exp_improv = np.zeros(len(candidates))
+        nonzero = std > 0
+        gamma = (mu[nonzero] - current_best) / std[nonzero]
+        exp_improv[nonzero] = std[nonzero] * (gamma * norm.cdf(gamma) + norm.pdf(gamma))
+        return exp_improv
+
+    def get_next_hyperparameters(self):
+        """
+        Proposes the next point by maximizing the acquisition function inside each
+        active trust region and picking the best candidate over all regions.
+
+        Args:
+            None
+
+        Returns:
+            a tuple with the index of the proposing region and the unit cube
+            coordinates of the proposed point
+        """
+        xs, ys = self._history_arrays()
+        current_best = np.max(ys)
+        best_value, best_region_idx, best_candidate = -np.inf, None, None
+        for region_idx, region in enumerate(self.trust_regions):
+            if region.center is None:
+                # none of the points of its initial design have been evaluated yet
+                continue
+            local_gp = self.fit_local_gp(region, xs, ys)
+            candidates = self.get_candidates(region)
+            values = self.score_candidates(local_gp, candidates, current_best)
+            idx = np.argmax(values)
+            if (best_region_idx is None) or (values[idx] > best_value):
+                best_value, best_region_idx, best_candidate = values[idx], region_idx, candidates[idx]
+        self.success = True
+        return best_region_idx, best_candidate
+
+    def _initial_design_size(self):
+        if self._design_size is not None:
+            return self._design_size
+        if self.n_init_samples is None:
+            return 2 * self.n_dims
+        return self.n_init_samples
+
+    def propose(self):
+        """
+        Returns the next point of an initial design, or the maximizer of the
+        acquisition function over all trust regions once every region has proposed
+        its initial design. Without n_iters the initial design of a region has
+        n_init_samples or 2*d points.
+
+        Args:
+            None
+
+        Returns:
+            a dictionary with parameter names as keys and parameter values as values
+        """
+        if self._design is None:
+            self._design = {}
+            for region_idx, region in enumerate(self.trust_regions):
+                region.reset()
+                self._design[region_idx] = list(latin_hypercube(self._initial_design_size(), self.n_dims))
+        initializing = [idx for idx in self._design if len(self._design[idx]) > 0]
+        if len(initializing) > 0:
+            region_idx = initializing[0]
+            x = self._design[region_idx].pop()
+        elif all(region.center is None for region in self.trust_regions):
+            # the whole initial design is still being evaluated
+            region_idx = np.random.randint(len(self.trust_regions))
+            x = np.random.uniform(size=self.n_dims)
+            initializing = [region_idx]
+        else:
+            region_idx, x = self.get_next_hyperparameters()
+        new_hyperparams = self._from_unit_cube(x)
+        self._asked.append((region_idx, len(initializing) > 0, new_hyperparams))
+        return new_hyperparams
+
+    def observe(self, score, hyperparams, duration=None):
+        """
+        Records the result of a trial that was proposed by self.propose() and
+        updates the trust region that proposed it. Collapsed regions are restarted
+        with a new initial design.
+
+        Args:
+            score: the score of the trial
+            hyperparams: a dictionary with the evaluated hyperparameters
+            duration: the time in seconds it took to evaluate the trial. default is None
+
+        Returns:
+            None
+        """
+        super(TrustRegionBayesianOptimizer, self).observe(score, hyperparams, duration)
+        for i, (region_idx, initializing, params) in enumerate(self._asked):
+            if params == hyperparams:
+                del self._asked[i]
+                break
+        else:
+            return
+        region = self.trust_regions[region_idx]
+        x_rounded = self._to_unit_cube(self._param_dict_to_arr(hyperparams))
+        region.observe(x_rounded, score, update_length=not initializing)
+        if region.collapsed:
+            region.reset()
+            self._design[region_idx] = list(latin_hypercube(self._initial_design_size(), self.n_dims))
+            self.n_restarts += 1
+
+    def fit(self, X_train, y_train, X_test=None, y_test=None, n_iters=10, n_folds=None):
+        """
+        Given training data and optional validation data fit the machine learning model
+        sequentially to find optimal hyperparameters. If X_test and y_test are provided
+        then the scoring function is applied to the predictions on X_test
+        rather than X_train.
+
+        Args:
+            X_train: a numpy array with training data. each row corresponds to a data point
+            y_train: a numpy array containing the target variable for the training data
+            X_test: a numpy array with validation data. each row corresponds to a data point
+            y_test: a numpy array containing the target variable for the validation data
+            n_iters: total number of model evaluations. default is 10.
+            n_folds: number of folds for cross-validation. default is None
+
+        Returns:
+            best_params: a dictionary with optimized hyperparameters
+            best_model: an untrained model with the optimized hyperparameters
+        """
+        if (X_test is None) and (y_test is None):
+            X_test = X_train
+            y_test = y_train
+        elif (X_test is None) or (y_test is None):
+            raise MissingValueException("Need to provide 'X_test' and 'y_test'")
+        elif (X_test is not None) and (y_test is not None) and (n_folds is not None):
+            raise Exception("Provide either 'X_test' and 'y_test' or 'n_folds'")
+
+        # the initial design of every region fits into the budget of n_iters
+        self._design_size = self.n_init_samples
+        if self._design_size is None:
+            self._design_size = max(1, min(2 * self.n_dims, n_iters // (2 * len(self.trust_regions))))
+        self._design = None
+        self._asked = []
+        for i in range(n_iters):
+            new_hyperparams = self.propose()
+            start = time.time()
+            score = self.evaluate_hyperparams(new_hyperparams, X_train, y_train, X_test, y_test, n_folds)
+            self.observe(score, new_hyperparams, time.time() - start)
+
+        best_params, best_model = self.get_best_params_and_model()
+        return best_params, best_model
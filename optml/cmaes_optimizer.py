@@ -0,0 +1,303 @@
+import numpy as np
+from scipy.stats import norm
+
+from optml.optimizer_base import Optimizer, MissingValueException
+from optml.parallel import TrialPool
+
+
+class CMAESOptimizer(Optimizer):
+    """ Covariance Matrix Adaptation Evolution Strategy
+    A (mu/mu_w, lambda)-CMA-ES as described in 'The CMA Evolution Strategy: A
+    Tutorial' by Hansen (https://arxiv.org/abs/1604.00772) with restarts and
+    increasing population size (IPOP-CMA-ES, Auger and Hansen 2005).
+
+    The search runs in the unit cube spanned by the bounds of the hyperparameters.
+    Samples outside the cube are projected onto it. Integer parameters are rounded
+    before a model is trained; to keep the search from getting stuck on a single
+    integer the standard deviation of integer coordinates is kept above a floor
+    such that a step to a neighbouring integer has probability of at least
+    integer_margin (a diagonal version of 'CMA-ES with Margin' by Hamano et al.,
+    https://arxiv.org/abs/2205.13482). Each population is evaluated concurrently
+    on n_jobs worker processes.
+
+    Args:
+        model: a model (currently supports scikit-learn, xgboost, or a class
+               derived from optml.models.Model)
+        hyperparams: a list of Parameter instances of type 'continuous' or 'integer'
+        eval_func: scoring function to be maximized. Takes input (y_true, y_predicted) where
+            y_true and y_predicted are numpy arrays
+        sigma0: initial step size relative to the range of each parameter. default is 0.3
+        population_size: number of samples per generation of the first run. default is
+            None which uses 4 + floor(3 * log(d))
+        inc_popsize: factor by which the population grows with each restart. default is 2
+        integer_margin: lower bound on the probability that an integer parameter changes
+            its value. default is None which uses 1 / (d * population_size)
+        tolx: a run is restarted once all standard deviations are below tolx. default is 1e-6
+        tolfun: a run is restarted once the best score of the last generations varies by
+            less than tolfun. default is 1e-8
+        n_jobs: number of worker processes that evaluate a population. default is 1
+
+    Attributes:
+        restarts: a list with the population size and number of evaluations of each run
+    """
+    def __init__(self, model, hyperparams, eval_func, sigma0=0.3, population_size=None,
+                 inc_popsize=2, integer_margin=None, tolx=1e-6, tolfun=1e-8, n_jobs=1):
+        super(CMAESOptimizer, self).__init__(model, hyperparams, eval_func)
+        for hp in hyperparams:
+            if hp.param_type not in ['continuous', 'integer']:
+                raise ValueError("CMAESOptimizer only takes parameters of type 'continuous' and 'integer'")
+        self.n_dims = len(hyperparams)
+        self.bounds_arr = np.array([[hp.lower, hp.upper] for hp in hyperparams], dtype=float)
+        self.is_integer = np.array([hp.param_type == 'integer' for hp in hyperparams])
+        self.sigma0 = sigma0
+        if population_size is None:
+            population_size = 4 + int(3 * np.log(self.n_dims))
+        self.initial_population_size = population_size
+        self.inc_popsize = inc_popsize
+        self.integer_margin = integer_margin
+        self.tolx = tolx
+        self.tolfun = tolfun
+        self.n_jobs = n_jobs
+        self.restarts = []
+        self.mean = None
+        # state of propose/observe: sampled points that have not been proposed yet,
+        # proposed points that wait for their score and scored points of the next update
+        self._queue = []
+        self._asked = []
+        self._told = []
+        self._run_evals = 0
+
+    def start(self, population_size, mean=None):
+        """
+        Resets the state of the evolution strategy for a new run.
+
+        Args:
+            population_size: number of samples per generation
+            mean: a numpy array with the initial mean in unit cube coordinates. default
+                is None which uses the center of the cube
+
+        Returns:
+            None
+        """
+        d = self.n_dims
+        self.population_size = population_size
+        self.mu = population_size // 2
+        weights = np.log(self.mu + 0.5) - np.log(np.arange(1, self.mu + 1))
+        self.weights = weights / np.sum(weights)
+        self.mueff = 1. / np.sum(self.weights**2)
+        self.cc = (4. + self.mueff / d) / (d + 4. + 2. * self.mueff / d)
+        self.cs = (self.mueff + 2.) / (d + self.mueff + 5.)
+        self.c1 = 2. / ((d + 1.3)**2 + self.mueff)
+        self.cmu = min(1. - self.c1, 2. * (self.mueff - 2. + 1. / self.mueff) / ((d + 2.)**2 + self.mueff))
+        self.damps = 1. + 2. * max(0., np.sqrt((self.mueff - 1.) / (d + 1.)) - 1.) + self.cs
+        self.chi_n = np.sqrt(d) * (1. - 1. / (4. * d) + 1. / (21. * d**2))
+
+        self.mean = np.full(d, 0.5) if mean is None else np.asarray(mean, dtype=float)
+        self.sigma = self.sigma0
+        self.C = np.eye(d)
+        self.pc = np.zeros(d)
+        self.ps = np.zeros(d)
+        self.generation = 0
+        self.best_scores = []
+
+        margin = self.integer_margin
+        if margin is None:
+            margin = 1. / (d * population_size)
+        # a step of half an integer in unit cube coordinates has to be exceeded with probability margin
+        half_step = 0.5 / np.maximum(self.bounds_arr[:, 1] - self.bounds_arr[:, 0], 1.)
+        self.std_floor = np.where(self.is_integer, half_step / norm.ppf(1. - margin / 2.), 0.)
+
+    def _eigen(self):
+        eigenvalues, B = np.linalg.eigh(self.C)
+        return np.sqrt(np.maximum(eigenvalues, 1e-20)), B
+
+    def _to_params(self, x):
+        values = self.bounds_arr[:, 0] + x * (self.bounds_arr[:, 1] - self.bounds_arr[:, 0])
+        params = {}
+        for hp, v, is_int in zip(self.hyperparams, values, self.is_integer):
+            params[hp.name] = int(round(v)) if is_int else float(v)
+        return params
+
+    def get_next_hyperparameters(self):
+        """
+        Samples a new population.
+
+        Args:
+            None
+
+        Returns:
+            xs: a numpy array of shape (population_size, d) with the samples in unit cube coordinates
+            params: a list with a dictionary of hyperparameters for each sample
+        """
+        D, B = self._eigen()
+        z = np.random.randn(self.population_size, self.n_dims)
+        xs = np.clip(self.mean + self.sigma * (z * D).dot(B.T), 0., 1.)
+        return xs, [self._to_params(x) for x in xs]
+
+    def update(self, xs, scores):
+        """
+        Adapts mean, step size and covariance matrix to an evaluated population.
+
+        Args:
+            xs: a numpy array of shape (population_size, d) with the samples in unit cube coordinates
+            scores: a numpy array with the score of each sample
+
+        Returns:
+            None
+        """
+        d = self.n_dims
+        self.generation += 1
+        order = np.argsort(-np.asarray(scores))[:self.mu]
+        ys = (xs[order] - self.mean) / self.sigma
+        y_w = self.weights.dot(ys)
+        self.mean = self.mean + self.sigma * y_w
+
+        D, B = self._eigen()
+        C_inv_sqrt = (B / D).dot(B.T)
+        self.ps = (1. - self.cs) * self.ps + np.sqrt(self.cs * (2. - self.cs) * self.mueff) * C_inv_sqrt.dot(y_w)
+        ps_norm = np.linalg.norm(self.ps) / np.sqrt(1. - (1. - self.cs)**(2 * self.generation))
+        hsig = float(ps_norm / self.chi_n < 1.4 + 2. / (d + 1.))
+        self.pc = (1. - self.cc) * self.pc + hsig * np.sqrt(self.cc * (2. - self.cc) * self.mueff) * y_w
+
+        rank_mu = (ys * self.weights[:, None]).T.dot(ys)
+        self.C = (1. - self.c1 - self.cmu) * self.C + \
+            self.c1 * (np.outer(self.pc, self.pc) + (1. - hsig) * self.cc * (2. - self.cc) * self.C) + \
+            self.cmu * rank_mu
+        self.C = (self.C + self.C.T) / 2.
+        self.sigma *= np.exp((self.cs / self.damps) * (np.linalg.norm(self.ps) / self.chi_n - 1.))
+
+        # margin: increasing diagonal entries keeps C positive definite
+        floor = (self.std_floor / self.sigma)**2
+        diagonal = np.diag(self.C)
+        self.C[np.diag_indices(d)] = np.maximum(diagonal, floor)
+        self.best_scores.append(np.max(scores))
+
+    def should_restart(self):
+        """
+        Checks the IPOP stopping criteria of the current run.
+
+        Args:
+            None
+
+        Returns:
+            True if the run has converged or stagnated
+        """
+        continuous_std = self.sigma * np.sqrt(np.diag(self.C))[~self.is_integer]
+        if (len(continuous_std) > 0) and np.all(continuous_std < self.tolx):
+            return True
+        if (len(continuous_std) == 0) and np.all(self.sigma * np.sqrt(np.diag(self.C)) <= self.std_floor):
+            return True
+        eigenvalues = np.linalg.eigvalsh(self.C)
+        if np.max(eigenvalues) > 1e14 * max(np.min(eigenvalues), 1e-300):
+            return True
+        window = 10 + int(np.ceil(30. * self.n_dims / self.population_size))
+        if (len(self.best_scores) >= window) and \
+                (np.ptp(self.best_scores[-window:]) < self.tolfun):
+            return True
+        return False
+
+    def propose(self):
+        """
+        Returns the next sample of the current population. A new population is
+        sampled once all samples of the previous one have been proposed, so more
+        trials than population_size can be pending at a time.
+
+        Args:
+            None
+
+        Returns:
+            a dictionary with parameter names as keys and parameter values as values
+        """
+        if self.mean is None:
+            self.restarts = []
+            self.start(self.initial_population_size)
+        if len(self._queue) == 0:
+            xs, params = self.get_next_hyperparameters()
+            self._queue = list(zip(xs, params))
+        x, params = self._queue.pop(0)
+        self._asked.append((x, params))
+        return params
+
+    def observe(self, score, hyperparams, duration=None):
+        """
+        Records the result of a trial that was proposed by self.propose(). As soon as
+        population_size results have come in the distribution is adapted to them
+        and the restart criteria are checked.
+
+        Args:
+            score: the score of the trial
+            hyperparams: a dictionary with the evaluated hyperparameters
+            duration: the time in seconds it took to evaluate the trial. default is None
+
+        Returns:
+            None
+        """
+        self.hyperparam_history.append((score, hyperparams))
+        for i, (x, params) in enumerate(self._asked):
+            if params == hyperparams:
+                del self._asked[i]
+                break
+        else:
+            return
+        self._told.append((x, score))
+        self._run_evals += 1
+        if len(self._told) < self.population_size:
+            return
+        told, self._told = self._told[:self.population_size], self._told[self.population_size:]
+        self.update(np.array([x for x, s in told]), np.array([s for x, s in told], dtype=float))
+        if self.should_restart():
+            self.restarts.append((self.population_size, self._run_evals))
+            self._run_evals = 0
+            # samples of the previous run are not used to adapt the new one
+            self._queue, self._asked, self._told = [], [], []
+            self.start(int(self.population_size * self.inc_popsize), mean=np.random.uniform(size=self.n_dims))
+
+    def fit(self, X_train, y_train, X_test=None, y_test=None, n_iters=100, n_folds=None):
+        """
+        Given training data and optional validation data fit the machine learning model
+        for different hyperparameter configurations. If X_test and y_test are provided
+        then the scoring function is applied to the predictions on X_test rather than
+        X_train.
+
+        Args:
+            X_train: a numpy array with training data. each row corresponds to a data point
+            y_train: a numpy array containing the target variable for the training data
+            X_test: a numpy array with validation data. each row corresponds to a data point
+            y_test: a numpy array containing the target variable for the validation data
+            n_iters: maximum number of model evaluations over all runs. default is 100.
+            n_folds: number of folds for cross-validation. default is None
+
+        Returns:
+            best_params: a dictionary with optimized hyperparameters
+            best_model: an untrained model with the optimized hyperparameters
+        """
+        if (X_test is None) != (y_test is None):
+            raise MissingValueException("Need to provide 'X_test' and 'y_test'")
+        elif (X_test is not None) and (n_folds is not None):
+            raise Exception("Provide either 'X_test' and 'y_test' or 'n_folds'")
+
+        self.restarts = []
+        population_size = self.initial_population_size
+        self.start(population_size)
+        n_evals, run_evals = 0, 0
+        with TrialPool(self, X_train, y_train, X_test, y_test, n_folds, self.n_jobs) as pool:
+            while n_evals < n_iters:
+                xs, params = self.get_next_hyperparameters()
+                # never exceed the budget, an incomplete generation is not used for adaptation
+                xs, params = xs[:n_iters - n_evals], params[:n_iters - n_evals]
+                scores = np.asarray(pool.map(params), dtype=float)
+                self.hyperparam_history += list(zip(scores, params))
+                n_evals += len(params)
+                run_evals += len(params)
+                if len(params) < self.population_size:
+                    break
+                self.update(xs, scores)
+                if self.should_restart():
+                    self.restarts.append((population_size, run_evals))
+                    population_size = int(population_size * self.inc_popsize)
+                    run_evals = 0
+                    self.start(population_size, mean=np.random.uniform(size=self.n_dims))
+        self.restarts.append((population_size, run_evals))
+
+        best_params, best_model = self.get_best_params_and_model()
+        return best_params, best_model
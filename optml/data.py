@@ -0,0 +1,220 @@
+"""
+Helpers for training data that is not a dense in-memory numpy array.
+
+Data stored as .npy files can be opened with open_array (or np.load(path,
+mmap_mode='r')) and passed to any optimizer like an in-memory array. Folds are
+taken from such arrays as contiguous ranges, so that the rows are read from disk in
+order instead of being gathered with fancy indexing. Memory-mapped arrays that are
+sent to worker processes are reopened from their file there instead of being
+pickled (see share and unshare).
+
+scipy.sparse matrices and pandas DataFrames and Series are sliced by position
+(row indexing of CSR matrices, iloc) and passed to the models as they are, without
+densifying them. Sparse matrices should be in CSR format, other formats are
+converted for every slice.
+"""
+import os
+import sys
+import mmap
+import pickle
+import joblib
+import numpy as np
+import scipy.sparse
+
+
+def open_array(path, mode='r'):
+    """
+    Opens an array stored with np.save as a read-only memory map.
+
+    Args:
+        path: path of the .npy file
+        mode: the mmap_mode of np.load. default is 'r'
+
+    Returns:
+        a numpy.memmap
+    """
+    return np.load(path, mmap_mode=mode)
+
+
+def is_mapped(array):
+    """
+    Returns True if array is a memory map of a whole file (and not a view of one).
+    """
+    return isinstance(array, np.memmap) and isinstance(array.base, mmap.mmap) and \
+        (getattr(array, 'filename', None) is not None)
+
+
+def is_sparse(array):
+    return scipy.sparse.issparse(array)
+
+
+def is_frame(array):
+    """
+    Returns True for pandas DataFrames and Series (without importing pandas).
+    """
+    return hasattr(array, 'iloc')
+
+
+def n_rows(array):
+    """
+    Returns the number of rows of an array, sparse matrix or DataFrame.
+    """
+    return array.shape[0] if hasattr(array, 'shape') else len(array)
+
+
+def nbytes(array):
+    """
+    Returns the approximate memory size of an array, sparse matrix or DataFrame.
+    """
+    if is_sparse(array):
+        return sum(getattr(array, name).nbytes for name in ['data', 'indices', 'indptr', 'row', 'col']
+                   if hasattr(array, name))
+    if is_frame(array):
+        usage = array.memory_usage(index=True)
+        return int(usage.sum()) if hasattr(usage, 'sum') else int(usage)
+    if hasattr(array, 'nbytes'):
+        return array.nbytes
+    return sys.getsizeof(array)
+
+
+def fingerprint(*arrays):
+    """
+    Returns a key that identifies the content of the arrays. Memory-mapped files are
+    identified by their path, offset, shape and modification time, so that they are
+    not read from disk just to be hashed; all other arrays are hashed with joblib.
+    """
+    parts = []
+    for array in arrays:
+        if is_mapped(array):
+            parts.append(('memmap', os.path.abspath(array.filename), array.offset, array.shape,
+                          str(array.dtype), os.path.getmtime(array.filename)))
+        else:
+            parts.append(array)
+    return joblib.hash(parts)
+
+
+def index_ranges(idxs):
+    """
+    Splits sorted indices into runs of consecutive indices.
+
+    Args:
+        idxs: a sorted numpy array of integers
+
+    Returns:
+        a list of tuples (start, stop)
+    """
+    idxs = np.asarray(idxs)
+    if len(idxs) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(idxs) != 1) + 1
+    starts = np.concatenate([[0], breaks])
+    stops = np.concatenate([breaks, [len(idxs)]])
+    return [(int(idxs[start]), int(idxs[stop - 1]) + 1) for start, stop in zip(starts, stops)]
+
+
+def _slice(array, start, stop):
+    if is_frame(array):
+        return array.iloc[start:stop]
+    return array[start:stop]
+
+
+def take(array, idxs, max_ranges=64):
+    """
+    Returns the rows idxs of an array, sparse matrix or DataFrame. All rows in order
+    return the input itself and a single run of consecutive indices is returned as a
+    slice (for numpy arrays a view that reads nothing from a memory map until it is
+    used). A few runs of a numpy array are read range by range, other indices use
+    positional indexing.
+
+    Args:
+        array: a numpy array, memory map, scipy.sparse matrix or pandas DataFrame or Series
+        idxs: a sorted numpy array of integers
+        max_ranges: maximum number of ranges that are read one by one. default is 64
+
+    Returns:
+        the rows in the type of array (sparse matrices as CSR)
+    """
+    if is_sparse(array) and (array.format != 'csr'):
+        array = array.tocsr()
+    ranges = index_ranges(idxs)
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        if (start == 0) and (stop == n_rows(array)):
+            return array
+        return _slice(array, start, stop)
+    if is_frame(array):
+        return array.iloc[idxs]
+    if (not is_sparse(array)) and (0 < len(ranges) <= max_ranges):
+        return np.concatenate([array[start:stop] for start, stop in ranges])
+    return array[idxs]
+
+
+def save(path, array):
+    """
+    Stores an array in a format that load can open without unpickling dense copies:
+    numpy arrays as .npy (memory-mapped by load), sparse matrices as .npz and
+    DataFrames as pickles.
+
+    Args:
+        path: the path without extension
+        array: a numpy array, scipy.sparse matrix or pandas DataFrame or Series
+
+    Returns:
+        the path of the written file
+    """
+    if is_sparse(array):
+        path += '.npz'
+        scipy.sparse.save_npz(path, array.tocsr())
+    elif is_frame(array):
+        path += '.pkl'
+        with open(path, 'wb') as output_file:
+            pickle.dump(array, output_file, protocol=pickle.HIGHEST_PROTOCOL)
+    else:
+        path += '.npy'
+        np.save(path, np.asarray(array))
+    return path
+
+
+def load(path):
+    """
+    Opens a file written by save (or any .npy file, which is memory-mapped).
+    """
+    if path.endswith('.npz'):
+        return scipy.sparse.load_npz(path).tocsr()
+    if path.endswith('.pkl'):
+        with open(path, 'rb') as input_file:
+            return pickle.load(input_file)
+    return open_array(path)
+
+
+class MappedArray(object):
+    """
+    A picklable reference to a memory-mapped file that is reopened by unshare.
+    """
+    def __init__(self, array):
+        self.filename = os.path.abspath(array.filename)
+        self.dtype = array.dtype
+        self.shape = array.shape
+        self.offset = array.offset
+        self.order = 'F' if (array.flags.f_contiguous and not array.flags.c_contiguous) else 'C'
+        self.mode = array.mode
+
+    def open(self):
+        mode = 'r' if self.mode in ['r', 'c'] else 'r+'
+        return np.memmap(self.filename, dtype=self.dtype, mode=mode, offset=self.offset,
+                         shape=self.shape, order=self.order)
+
+
+def share(data):
+    """
+    Replaces the memory-mapped arrays in a tuple or list by MappedArray references
+    before it is sent to another process.
+    """
+    return type(data)(MappedArray(item) if is_mapped(item) else item for item in data)
+
+
+def unshare(data):
+    """
+    Reopens the MappedArray references in a tuple or list created by share.
+    """
+    return type(data)(item.open() if isinstance(item, MappedArray) else item for item in data)
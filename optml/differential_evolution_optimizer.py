@@ -0,0 +1,211 @@
+import numpy as np
+
+from optml.optimizer_base import Optimizer, MissingValueException
+from optml.parallel import TrialPool
+
+
+class DifferentialEvolutionOptimizer(Optimizer):
+    """ Differential Evolution
+    Evolves a population in the unit cube with the strategies of 'Differential
+    Evolution - A Simple and Efficient Heuristic for Global Optimization over
+    Continuous Spaces' by Storn and Price. All trial vectors of a generation are
+    created at once and evaluated concurrently on n_jobs worker processes.
+
+    Every parameter is encoded as one coordinate in [0, 1]: continuous and integer
+    parameters are scaled to their bounds (integers are rounded), categorical and
+    boolean parameters are encoded by splitting [0, 1] into one interval per value.
+
+    Args:
+        model: a model (currently supports scikit-learn, xgboost, or a class
+               derived from optml.models.Model)
+        hyperparams: a list of Parameter instances of type 'continuous', 'integer',
+            'categorical' or 'boolean'
+        eval_func: scoring function to be maximized. Takes input (y_true, y_predicted) where
+            y_true and y_predicted are numpy arrays
+        population_size: number of individuals. default is None which uses max(8, 5 * d)
+        strategy: 'rand1bin' (v = x_r1 + F * (x_r2 - x_r3)) or 'currenttobest1bin'
+            (v = x_i + F * (x_best - x_i) + F * (x_r1 - x_r2)). default is 'rand1bin'
+        mutation: the differential weight F. default is 0.8
+        recombination: the crossover probability CR. default is 0.9
+        n_jobs: number of worker processes that evaluate a generation. default is 1
+    """
+    def __init__(self, model, hyperparams, eval_func, population_size=None, strategy='rand1bin',
+                 mutation=0.8, recombination=0.9, n_jobs=1):
+        super(DifferentialEvolutionOptimizer, self).__init__(model, hyperparams, eval_func)
+        for hp in hyperparams:
+            if hp.param_type not in ['continuous', 'integer', 'categorical', 'boolean']:
+                raise ValueError("DifferentialEvolutionOptimizer only takes parameters of type "
+                                 "'continuous', 'integer', 'categorical' and 'boolean'")
+        if strategy not in ['rand1bin', 'currenttobest1bin']:
+            raise ValueError("strategy needs to be 'rand1bin' or 'currenttobest1bin'")
+        self.n_dims = len(hyperparams)
+        if population_size is None:
+            population_size = max(8, 5 * self.n_dims)
+        if population_size < 4:
+            raise ValueError("population_size needs to be at least 4")
+        self.population_size = population_size
+        self.strategy = strategy
+        self.mutation = mutation
+        self.recombination = recombination
+        self.n_jobs = n_jobs
+        self.population = None
+        # state of propose/observe: number of proposals and the target individual of
+        # each proposal that waits for its score
+        self._n_proposed = 0
+        self._asked = []
+
+    def _possible_values(self, hp):
+        if hp.param_type == 'boolean':
+            return [True, False]
+        return hp.possible_values
+
+    def decode(self, x):
+        """
+        Converts a point in the unit cube to a dictionary of hyperparameters.
+
+        Args:
+            x: a numpy array with one coordinate in [0, 1] per hyperparameter
+
+        Returns:
+            a dictionary with parameter names as keys and parameter values as values
+        """
+        params = {}
+        for hp, v in zip(self.hyperparams, x):
+            if hp.param_type in ['categorical', 'boolean']:
+                values = self._possible_values(hp)
+                params[hp.name] = values[min(int(v * len(values)), len(values) - 1)]
+            elif hp.param_type == 'integer':
+                params[hp.name] = int(round(hp.lower + v * (hp.upper - hp.lower)))
+            else:
+                params[hp.name] = float(hp.lower + v * (hp.upper - hp.lower))
+        return params
+
+    def get_trial_vectors(self, population, fitness):
+        """
+        Creates one trial vector per individual by mutation and binomial crossover.
+
+        Args:
+            population: a numpy array of shape (population_size, d) in the unit cube
+            fitness: a numpy array with the score of each individual
+
+        Returns:
+            a numpy array of shape (population_size, d) in the unit cube
+        """
+        n, d = population.shape
+        # random distinct donors per row that differ from the row itself
+        ranks = np.random.uniform(size=(n, n))
+        ranks[np.arange(n), np.arange(n)] = np.inf
+        donors = np.argsort(ranks, axis=1)[:, :3]
+        F = self.mutation
+        if self.strategy == 'rand1bin':
+            mutants = population[donors[:, 0]] + F * (population[donors[:, 1]] - population[donors[:, 2]])
+        else:
+            best = population[np.argmax(fitness)]
+            mutants = population + F * (best - population) + \
+                F * (population[donors[:, 0]] - population[donors[:, 1]])
+
+        cross = np.random.uniform(size=(n, d)) < self.recombination
+        cross[np.arange(n), np.random.randint(d, size=n)] = True
+        trials = np.where(cross, mutants, population)
+        # coordinates that leave the cube are moved halfway between the parent and the bound
+        trials = np.where(trials < 0, population / 2., trials)
+        trials = np.where(trials > 1, (population + 1.) / 2., trials)
+        return trials
+
+    def get_next_hyperparameters(self):
+        trials = self.get_trial_vectors(self.population, self.fitness)
+        return trials, [self.decode(x) for x in trials]
+
+    def propose(self):
+        """
+        Returns the next trial vector. The individuals are targeted in turn; the
+        first proposals evaluate the random initial population itself. Each trial
+        vector replaces its target individual in self.observe() if it scores at
+        least as well, so the population evolves asynchronously.
+
+        Args:
+            None
+
+        Returns:
+            a dictionary with parameter names as keys and parameter values as values
+        """
+        if self.population is None:
+            self.population = np.random.uniform(size=(self.population_size, self.n_dims))
+            self.fitness = np.full(self.population_size, -np.inf)
+        target = self._n_proposed % self.population_size
+        if (self._n_proposed < self.population_size) and not np.isfinite(self.fitness[target]):
+            x = self.population[target]
+        else:
+            x = self.get_trial_vectors(self.population, self.fitness)[target]
+        self._n_proposed += 1
+        params = self.decode(x)
+        self._asked.append((target, x, params))
+        return params
+
+    def observe(self, score, hyperparams, duration=None):
+        """
+        Records the result of a trial that was proposed by self.propose() and
+        replaces the target individual if the trial vector is at least as good.
+
+        Args:
+            score: the score of the trial
+            hyperparams: a dictionary with the evaluated hyperparameters
+            duration: the time in seconds it took to evaluate the trial. default is None
+
+        Returns:
+            None
+        """
+        self.hyperparam_history.append((score, hyperparams))
+        for i, (target, x, params) in enumerate(self._asked):
+            if params == hyperparams:
+                del self._asked[i]
+                break
+        else:
+            return
+        if score >= self.fitness[target]:
+            self.population[target] = x
+            self.fitness[target] = score
+
+    def fit(self, X_train, y_train, X_test=None, y_test=None, n_iters=10, n_folds=None):
+        """
+        Given training data and optional validation data fit the machine learning model
+        for different hyperparameter configurations. If X_test and y_test are provided
+        then the scoring function is applied to the predictions on X_test rather than
+        X_train.
+
+        Args:
+            X_train: a numpy array with training data. each row corresponds to a data point
+            y_train: a numpy array containing the target variable for the training data
+            X_test: a numpy array with validation data. each row corresponds to a data point
+            y_test: a numpy array containing the target variable for the validation data
+            n_iters: number of generations after the initial population. default is 10.
+            n_folds: number of folds for cross-validation. default is None
+
+        Returns:
+            best_params: a dictionary with optimized hyperparameters
+            best_model: an untrained model with the optimized hyperparameters
+        """
+        if (X_test is None) != (y_test is None):
+            raise MissingValueException("Need to provide 'X_test' and 'y_test'")
+        elif (X_test is not None) and (n_folds is not None):
+            raise Exception("Provide either 'X_test' and 'y_test' or 'n_folds'")
+
+        with TrialPool(self, X_train, y_train, X_test, y_test, n_folds, self.n_jobs) as pool:
+            self.population = np.random.uniform(size=(self.population_size, self.n_dims))
+            self.fitness = self._evaluate(pool, self.population)
+            for generation in range(n_iters):
+                trials, params = self.get_next_hyperparameters()
+                trial_fitness = self._evaluate(pool, trials, params)
+                improved = trial_fitness >= self.fitness
+                self.population[improved] = trials[improved]
+                self.fitness[improved] = trial_fitness[improved]
+
+        best_params, best_model = self.get_best_params_and_model()
+        return best_params, best_model
+
+    def _evaluate(self, pool, xs, params=None):
+        if params is None:
+            params = [self.decode(x) for x in xs]
+        scores = np.asarray(pool.map(params), dtype=float)
+        self.hyperparam_history += list(zip(scores, params))
+        return scores
@@ -0,0 +1,384 @@
+"""
+Distributed evaluation of trials through a SQLite database on a shared filesystem.
+
+A Coordinator drives any Optimizer through its propose/observe methods and writes
+pending trials to the database. Workers started with the `optml-worker` command,
+on the same machine or on any machine that sees the database, claim pending trials,
+evaluate them on memory-mapped copies of the data and write back scores and
+timings. Claimed trials carry a lease that the worker keeps extending while it is
+alive; trials of workers that die are handed out again once their lease expires.
+"""
+import os
+import sys
+import time
+import pickle
+import socket
+import sqlite3
+import argparse
+import threading
+import traceback
+from optml.data import is_mapped, save, load
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS study (key TEXT PRIMARY KEY, value BLOB)",
+    "CREATE TABLE IF NOT EXISTS trials (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+    "params BLOB, state TEXT, worker TEXT, attempts INTEGER DEFAULT 0, "
+    "lease_expires REAL, score REAL, error TEXT, started REAL, duration REAL)",
+    "CREATE INDEX IF NOT EXISTS trials_state ON trials (state)",
+]
+_DATA_NAMES = ['X_train', 'y_train', 'X_test', 'y_test']
+
+
+def connect(db_path):
+    """
+    Opens the database and creates its tables. Connections run in autocommit mode
+    so that transactions are started explicitly with BEGIN IMMEDIATE.
+
+    Args:
+        db_path: path of the SQLite database
+
+    Returns:
+        a sqlite3 connection
+    """
+    connection = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+    for statement in _SCHEMA:
+        connection.execute(statement)
+    return connection
+
+
+def claim_trial(connection, worker_id, lease, max_attempts):
+    """
+    Claims the oldest pending trial, or a running trial whose lease has expired.
+    BEGIN IMMEDIATE takes the write lock of the database before the trial is
+    selected, so that no two workers can claim the same trial. Trials that have
+    already been claimed max_attempts times are marked as failed instead.
+
+    Args:
+        connection: a connection returned by connect
+        worker_id: a string identifying the worker
+        lease: number of seconds until the claim expires unless it is renewed
+        max_attempts: maximum number of times a trial is handed out
+
+    Returns:
+        a tuple (trial_id, params) or None if there is no trial to claim
+    """
+    now = time.time()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        while True:
+            row = connection.execute(
+                "SELECT id, params, attempts FROM trials WHERE state=? OR (state=? AND lease_expires<?) "
+                "ORDER BY id LIMIT 1", (PENDING, RUNNING, now)).fetchone()
+            if row is None:
+                connection.execute("COMMIT")
+                return None
+            trial_id, params, attempts = row
+            if attempts >= max_attempts:
+                connection.execute("UPDATE trials SET state=?, error=? WHERE id=?",
+                                   (FAILED, 'worker died {} times during this trial'.format(attempts), trial_id))
+                continue
+            connection.execute("UPDATE trials SET state=?, worker=?, attempts=attempts+1, "
+                               "lease_expires=?, started=? WHERE id=?",
+                               (RUNNING, worker_id, now + lease, now, trial_id))
+            connection.execute("COMMIT")
+            return trial_id, pickle.loads(params)
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+
+
+def finish_trial(connection, trial_id, worker_id, score=None, duration=None, error=None):
+    """
+    Records the result of a trial. The update only succeeds if the trial is still
+    claimed by this worker, i.e. it has not been handed out again after its lease
+    expired.
+
+    Returns:
+        True if the result was recorded
+    """
+    state = FAILED if error is not None else DONE
+    cursor = connection.execute("UPDATE trials SET state=?, score=?, duration=?, error=? "
+                                "WHERE id=? AND worker=? AND state=?",
+                                (state, score, duration, error, trial_id, worker_id, RUNNING))
+    return cursor.rowcount == 1
+
+
+class Coordinator(object):
+    """
+    Runs an optimization whose trials are evaluated by workers that share the
+    database. Any Optimizer that implements propose() can be distributed this way.
+
+    Args:
+        optimizer: an instance of optml.optimizer_base.Optimizer. It is pickled to the
+            workers, so its model and eval_func need to be importable there
+        db_path: path of the SQLite database. The data is stored in the same directory
+            (see optml.data.save)
+        lease: number of seconds after which the trial of an unresponsive worker is
+            handed out again. default is 60
+        max_attempts: number of times a trial is handed out before it counts as
+            failed. default is 3
+        poll_interval: seconds between checks for finished trials. default is 0.5
+    """
+    def __init__(self, optimizer, db_path, lease=60., max_attempts=3, poll_interval=0.5):
+        self.optimizer = optimizer
+        self.db_path = db_path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.failed_trials = []
+        self.connection = connect(db_path)
+
+    def _set(self, key, value):
+        self.connection.execute("INSERT OR REPLACE INTO study (key, value) VALUES (?, ?)",
+                                (key, pickle.dumps(value)))
+
+    def share_data(self, X_train, y_train, X_test=None, y_test=None, n_folds=None):
+        """
+        Writes the data next to the database, numpy arrays as .npy files that the
+        workers memory-map and sparse matrices as .npz files, and publishes the
+        optimizer and study settings. Arrays that are already memory-mapped .npy
+        files (e.g. from optml.data.open_array) are not copied; the workers open the
+        same files.
+        """
+        directory = os.path.dirname(os.path.abspath(self.db_path))
+        prefix = os.path.splitext(os.path.basename(self.db_path))[0]
+        paths = {}
+        for name, array in zip(_DATA_NAMES, [X_train, y_train, X_test, y_test]):
+            if array is None:
+                paths[name] = None
+                continue
+            if is_mapped(array) and array.filename.endswith('.npy'):
+                paths[name] = os.path.abspath(array.filename)
+                continue
+            paths[name] = save(os.path.join(directory, '{}_{}'.format(prefix, name)), array)
+        # workers start loading the study as soon as they see the optimizer, so all
+        # keys are written in one transaction
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            self._set('data', paths)
+            self._set('n_folds', n_folds)
+            self._set('optimizer', self.optimizer)
+            self._set('settings', {'lease': self.lease, 'max_attempts': self.max_attempts})
+            self._set('finished', False)
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+
+    def cancel_unfinished(self):
+        """
+        Cancels the pending and running trials of an earlier run on the same database,
+        so that workers do not spend time on trials whose results nobody collects.
+        Results of cancelled trials that are still running are discarded by
+        finish_trial.
+
+        Returns:
+            number of cancelled trials
+        """
+        cursor = self.connection.execute("UPDATE trials SET state=?, error=? WHERE state IN (?, ?)",
+                                         (CANCELLED, 'cancelled by a later run', PENDING, RUNNING))
+        return cursor.rowcount
+
+    def submit(self, params):
+        cursor = self.connection.execute("INSERT INTO trials (params, state) VALUES (?, ?)",
+                                         (pickle.dumps(params), PENDING))
+        return cursor.lastrowid
+
+    def collect(self, observed, trial_ids=None):
+        """
+        Passes newly finished trials to the optimizer.
+
+        Args:
+            observed: a set with the ids of trials that have already been collected
+            trial_ids: a set with the ids of the trials to collect. default is None
+                which collects all trials in the database
+
+        Returns:
+            number of newly finished trials
+        """
+        rows = self.connection.execute("SELECT id, params, state, score, duration, error FROM trials "
+                                       "WHERE state IN (?, ?)", (DONE, FAILED)).fetchall()
+        n_new = 0
+        for trial_id, params, state, score, duration, error in rows:
+            if (trial_id in observed) or ((trial_ids is not None) and (trial_id not in trial_ids)):
+                continue
+            observed.add(trial_id)
+            n_new += 1
+            if state == DONE:
+                self.optimizer.observe(score, pickle.loads(params), duration)
+            else:
+                self.failed_trials.append((pickle.loads(params), error))
+        return n_new
+
+    def fit(self, X_train, y_train, X_test=None, y_test=None, n_iters=10, n_folds=None, max_pending=None):
+        """
+        Proposes n_iters trials and waits until workers have evaluated them. At most
+        max_pending trials are queued or running at any time; new proposals are made
+        as soon as results come in, so the optimizer sees as many results as possible.
+        Optimizers with a finite search space (GridSearchOptimizer) raise StopIteration
+        once it is exhausted, which ends the study early. Unfinished trials of earlier
+        runs on the same database are cancelled (see cancel_unfinished).
+
+        Args:
+            X_train: a numpy array with training data. each row corresponds to a data point
+            y_train: a numpy array containing the target variable for the training data
+            X_test: a numpy array with validation data. each row corresponds to a data point
+            y_test: a numpy array containing the target variable for the validation data
+            n_iters: number of trials. default is 10.
+            n_folds: number of folds for cross-validation. default is None
+            max_pending: maximum number of unfinished trials. default is None which
+                submits all trials proposed by the optimizer at once
+
+        Returns:
+            best_params: a dictionary with optimized hyperparameters
+            best_model: an untrained model with the optimized hyperparameters
+
+        Raises:
+            RuntimeError: if no trial of this run succeeded
+        """
+        if max_pending is None:
+            max_pending = n_iters
+        self.cancel_unfinished()
+        self.share_data(X_train, y_train, X_test, y_test, n_folds)
+        # trials of earlier runs on the same database are not passed to the optimizer
+        observed, submitted = set(), set()
+        n_submitted, n_finished = 0, 0
+        n_observed = len(self.optimizer.hyperparam_history)
+        try:
+            while n_finished < n_iters:
+                while (n_submitted < n_iters) and (n_submitted - n_finished < max_pending):
+                    try:
+                        params = self.optimizer.propose()
+                    except StopIteration:
+                        # e.g. every cell of a grid has been proposed
+                        n_iters = n_submitted
+                        break
+                    submitted.add(self.submit(params))
+                    n_submitted += 1
+                n_new = self.collect(observed, submitted)
+                n_finished += n_new
+                if n_new == 0:
+                    time.sleep(self.poll_interval)
+        finally:
+            self._set('finished', True)
+        if len(self.optimizer.hyperparam_history) == n_observed:
+            message = "none of the {} trials succeeded".format(n_submitted)
+            if len(self.failed_trials) > 0:
+                message += "; the last one failed with:\n{}".format(self.failed_trials[-1][1])
+            raise RuntimeError(message)
+        return self.optimizer.get_best_params_and_model()
+
+
+class Worker(object):
+    """
+    Claims and evaluates trials of a study until the coordinator has finished or no
+    work has been available for max_idle seconds.
+
+    Args:
+        db_path: path of the SQLite database of the study
+        worker_id: a string identifying the worker. default is None which uses host name and pid
+        poll_interval: seconds to wait when no trial is available. default is 0.5
+        max_idle: seconds without work after which the worker stops. default is None
+            which waits until the study is finished
+    """
+    def __init__(self, db_path, worker_id=None, poll_interval=0.5, max_idle=None):
+        self.db_path = db_path
+        if worker_id is None:
+            worker_id = '{}:{}'.format(socket.gethostname(), os.getpid())
+        self.worker_id = worker_id
+        self.poll_interval = poll_interval
+        self.max_idle = max_idle
+        self.connection = connect(db_path)
+        self.n_evaluated = 0
+
+    def _get(self, key, default=None):
+        row = self.connection.execute("SELECT value FROM study WHERE key=?", (key,)).fetchone()
+        return default if row is None else pickle.loads(row[0])
+
+    def load_study(self):
+        paths = self._get('data')
+        self.data = [None if paths[name] is None else load(paths[name]) for name in _DATA_NAMES]
+        self.n_folds = self._get('n_folds')
+        self.optimizer = self._get('optimizer')
+        settings = self._get('settings')
+        self.lease = settings['lease']
+        self.max_attempts = settings['max_attempts']
+
+    def _heartbeat(self, trial_id, stop):
+        # runs in its own thread, which needs its own connection
+        connection = connect(self.db_path)
+        try:
+            while not stop.wait(self.lease / 3.):
+                connection.execute("UPDATE trials SET lease_expires=? WHERE id=? AND worker=? AND state=?",
+                                   (time.time() + self.lease, trial_id, self.worker_id, RUNNING))
+        finally:
+            connection.close()
+
+    def evaluate(self, trial_id, params):
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(trial_id, stop))
+        heartbeat.daemon = True
+        heartbeat.start()
+        start = time.time()
+        try:
+            X_train, y_train, X_test, y_test = self.data
+            score = self.optimizer.evaluate_hyperparams(params, X_train, y_train, X_test, y_test, self.n_folds)
+            finish_trial(self.connection, trial_id, self.worker_id, score=float(score),
+                         duration=time.time() - start)
+        except Exception:
+            finish_trial(self.connection, trial_id, self.worker_id, duration=time.time() - start,
+                         error=traceback.format_exc())
+        finally:
+            stop.set()
+            heartbeat.join()
+        self.n_evaluated += 1
+
+    def run(self):
+        """
+        Processes trials until there is no more work.
+
+        Returns:
+            number of evaluated trials
+        """
+        while self._get('optimizer') is None:
+            time.sleep(self.poll_interval)
+        self.load_study()
+        idle_since = time.time()
+        while True:
+            claimed = claim_trial(self.connection, self.worker_id, self.lease, self.max_attempts)
+            if claimed is not None:
+                self.evaluate(*claimed)
+                idle_since = time.time()
+            elif self._get('finished', False):
+                break
+            elif (self.max_idle is not None) and (time.time() - idle_since > self.max_idle):
+                break
+            else:
+                time.sleep(self.poll_interval)
+        return self.n_evaluated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Evaluate trials of a distributed optml study.')
+    parser.add_argument('db_path', help='path of the SQLite database of the study')
+    parser.add_argument('--worker-id', default=None, help='name of this worker (default: host:pid)')
+    parser.add_argument('--poll-interval', type=float, default=0.5,
+                        help='seconds to wait when no trial is available')
+    parser.add_argument('--max-idle', type=float, default=None,
+                        help='stop after this many seconds without work')
+    args = parser.parse_args(argv)
+    worker = Worker(args.db_path, worker_id=args.worker_id, poll_interval=args.poll_interval,
+                    max_idle=args.max_idle)
+    n_evaluated = worker.run()
+    sys.stdout.write('{} evaluated {} trials\n'.format(worker.worker_id, n_evaluated))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
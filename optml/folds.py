@@ -0,0 +1,220 @@
+"""
+Cross-validation folds that are computed once per study and reused by every trial.
+
+CrossValidation computes the train and test indices of its folds the first time it
+sees a dataset and keeps them for as long as the dataset object is alive. It can
+also keep the fold matrices themselves (X[train_idxs] etc.) as contiguous arrays,
+either in memory or as memory-mapped .npy files, so that trials do not copy the
+data again for every fold. Indices are kept sorted, so that folds of memory-mapped
+data are read from disk as contiguous ranges (see optml.data.take). Folds of
+sparse matrices and DataFrames are cached in memory as they are, without densifying
+them, even with cache='mmap'.
+"""
+import os
+import uuid
+import shutil
+import weakref
+import tempfile
+import numpy as np
+from optml.data import fingerprint, take, nbytes
+from sklearn.model_selection import KFold, StratifiedKFold, GroupKFold, TimeSeriesSplit
+
+STRATEGIES = ['kfold', 'stratified', 'group', 'timeseries']
+
+
+class CrossValidation(object):
+    """
+    Precomputed cross-validation folds.
+
+    Args:
+        n_folds: number of folds
+        strategy: 'kfold', 'stratified' (folds preserve the class frequencies of y),
+            'group' (rows with the same group never appear in both the training and the
+            test part of a fold) or 'timeseries' (each fold is tested on the rows that
+            follow its training rows). default is 'kfold'
+        shuffle: shuffle the rows before splitting ('kfold' and 'stratified' only). default is False
+        random_state: seed for shuffling. default is None which draws a seed once, so
+            that all worker processes use the same folds
+        groups: an array with the group of each row, required for 'group'
+        cache: None, 'memory' or 'mmap'. default is None which slices the folds for
+            every trial
+        max_cache_bytes: maximum size of the cached fold matrices; folds beyond it are
+            sliced for every trial. default is 1 GB
+        cache_dir: directory for the memory-mapped files. default is None which uses
+            a temporary directory that is removed together with the CrossValidation
+            (when it is garbage collected or at exit)
+    """
+    def __init__(self, n_folds, strategy='kfold', shuffle=False, random_state=None, groups=None,
+                 cache=None, max_cache_bytes=1024 ** 3, cache_dir=None):
+        if strategy not in STRATEGIES:
+            raise ValueError("strategy needs to be one of {}".format(STRATEGIES))
+        if (strategy == 'group') and (groups is None):
+            raise ValueError("Need to provide 'groups' for the 'group' strategy")
+        if cache not in [None, 'memory', 'mmap']:
+            raise ValueError("cache needs to be None, 'memory' or 'mmap'")
+        if shuffle and (random_state is None):
+            random_state = np.random.randint(2 ** 31 - 1)
+        self.n_folds = n_folds
+        self.strategy = strategy
+        self.shuffle = shuffle
+        self.random_state = random_state
+        self.groups = groups
+        self.cache = cache
+        self.max_cache_bytes = max_cache_bytes
+        self.cache_dir = cache_dir
+        self._temp_dir = None
+        self._finalizer = None
+        self._reset()
+
+    def _reset(self):
+        self._data_ref = None
+        self._data_key = None
+        self.indices = None
+        self.cached_folds = {}
+        self.cached_bytes = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # worker processes recompute the indices; memory-mapped folds are reopened from disk
+        state['_data_ref'] = None
+        # only the original instance removes the temporary directory
+        state['_finalizer'] = None
+        state['cached_folds'] = dict((fold_idx, paths) for fold_idx, paths in self.cached_folds.items()
+                                     if isinstance(paths[0], str))
+        state['cached_bytes'] = sum(os.path.getsize(path) for paths in state['cached_folds'].values()
+                                    for path in paths)
+        return state
+
+    def get_splitter(self):
+        if self.strategy == 'kfold':
+            return KFold(n_splits=self.n_folds, shuffle=self.shuffle,
+                         random_state=self.random_state if self.shuffle else None)
+        elif self.strategy == 'stratified':
+            return StratifiedKFold(n_splits=self.n_folds, shuffle=self.shuffle,
+                                   random_state=self.random_state if self.shuffle else None)
+        elif self.strategy == 'group':
+            return GroupKFold(n_splits=self.n_folds)
+        return TimeSeriesSplit(n_splits=self.n_folds)
+
+    def __len__(self):
+        return self.n_folds
+
+    def _is_current(self, X):
+        return (self._data_ref is not None) and (self._data_ref() is X)
+
+    def split(self, X, y=None):
+        """
+        Returns the folds of X, computing them only the first time X is seen.
+
+        Args:
+            X: the training data
+            y: the target variable, required for 'stratified'
+
+        Returns:
+            a list of tuples (train_idxs, test_idxs)
+        """
+        if self._is_current(X):
+            return self.indices
+        key = fingerprint(X, y)
+        if key != self._data_key:
+            self.clear()
+            self._data_key = key
+            self.indices = [(np.sort(train_idxs), np.sort(test_idxs)) for train_idxs, test_idxs in
+                            self.get_splitter().split(X, y, self.groups)]
+        try:
+            self._data_ref = weakref.ref(X)
+        except TypeError:
+            # e.g. lists cannot be referenced weakly and are hashed again every time
+            self._data_ref = None
+        return self.indices
+
+    def get_cache_dir(self):
+        """
+        Returns the directory of the memory-mapped folds, creating a temporary one
+        if no cache_dir was given.
+        """
+        if self.cache_dir is not None:
+            return self.cache_dir
+        if self._temp_dir is None:
+            self._temp_dir = tempfile.mkdtemp(prefix='optml_folds_')
+            self._finalizer = weakref.finalize(self, shutil.rmtree, self._temp_dir, True)
+        return self._temp_dir
+
+    def _store(self, fold_idx, arrays):
+        n_bytes = sum(nbytes(array) for array in arrays)
+        if self.cached_bytes + n_bytes > self.max_cache_bytes:
+            return arrays
+        dense = all(isinstance(array, np.ndarray) for array in arrays)
+        if (self.cache == 'mmap') and dense:
+            directory = self.get_cache_dir()
+            paths = []
+            for array in arrays:
+                path = os.path.join(directory, 'optml_fold_{}.npy'.format(uuid.uuid4().hex))
+                np.save(path, np.ascontiguousarray(array))
+                paths.append(path)
+            self.cached_folds[fold_idx] = tuple(paths)
+            arrays = self._load(fold_idx)
+        else:
+            arrays = tuple(np.ascontiguousarray(array) if isinstance(array, np.ndarray) else array
+                           for array in arrays)
+            self.cached_folds[fold_idx] = arrays
+        self.cached_bytes += n_bytes
+        return arrays
+
+    def _load(self, fold_idx):
+        cached = self.cached_folds[fold_idx]
+        if isinstance(cached[0], str):
+            return tuple(np.load(path, mmap_mode='r') for path in cached)
+        return cached
+
+    def fold(self, fold_idx, X, y):
+        """
+        Returns the training and test data of a fold.
+
+        Args:
+            fold_idx: index of the fold
+            X: the training data
+            y: the target variable for the training data
+
+        Returns:
+            a tuple (X_train, y_train, X_test, y_test)
+        """
+        train_idxs, test_idxs = self.split(X, y)[fold_idx]
+        if fold_idx in self.cached_folds:
+            return self._load(fold_idx)
+        arrays = (take(X, train_idxs), take(y, train_idxs), take(X, test_idxs), take(y, test_idxs))
+        if self.cache is not None:
+            arrays = self._store(fold_idx, arrays)
+        return arrays
+
+    def folds(self, X, y):
+        """
+        Generates the training and test data of every fold.
+
+        Returns:
+            a generator with tuples (X_train, y_train, X_test, y_test)
+        """
+        for fold_idx in range(len(self.split(X, y))):
+            yield self.fold(fold_idx, X, y)
+
+    def materialize(self, X, y):
+        """
+        Computes the folds before they are shared with worker processes. Memory-mapped
+        folds are also written to disk, so that all workers read the same files.
+        """
+        indices = self.split(X, y)
+        if self.cache == 'mmap':
+            for fold_idx in range(len(indices)):
+                self.fold(fold_idx, X, y)
+        return self
+
+    def clear(self):
+        """
+        Removes the cached fold matrices, including memory-mapped files.
+        """
+        for cached in self.cached_folds.values():
+            if isinstance(cached[0], str):
+                for path in cached:
+                    if os.path.exists(path):
+                        os.remove(path)
+        self._reset()
@@ -1,19 +1,100 @@
+import pickle
+import traceback
 import numpy as np
-from optml.optimizer_base import Optimizer
+from optml.optimizer_base import Optimizer, MissingValueException
+from optml.parallel import TrialPool
+from optml.data import share, unshare
+from optml.validation import score_model
+from multiprocessing import Process, Queue
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
 
 class GeneticOptimizer(Optimizer):
+    """ Genetic Algorithm
+    By default one child is created and evaluated per iteration. With
+    generational=True a whole population is kept as an (N x d) matrix and each
+    generation is created with vectorized selection, crossover and mutation and
+    evaluated concurrently on n_jobs worker processes.
+
+    Args:
+        model: a model (currently supports scikit-learn, xgboost, or a class
+               derived from optml.models.Model)
+        hyperparams: a list of Parameter instances of type 'continuous' or 'integer'
+        eval_func: scoring function to be maximized. Takes input (y_true, y_predicted) where
+            y_true and y_predicted are numpy arrays
+        n_init_samples: number of random individuals in the initial population
+        parent_selection_method: 'RouletteWheel', 'Max' or (only in generational mode) 'Tournament'
+        mutation_noise: a dictionary with the standard deviation of the gaussian
+            mutation for each parameter
+        generational: whether to evolve whole generations. default is False
+        population_size: maximum number of individuals in a generation. default is
+            None which uses n_init_samples
+        n_elites: number of best individuals that are carried over unchanged to the
+            next generation. default is 1
+        tournament_size: number of individuals competing in each tournament. default is 3
+        n_jobs: number of worker processes that evaluate a generation. default is 1
+        n_islands: number of populations that evolve in separate processes. If larger
+            than 1 the generational operators are used on each island and n_jobs is
+            ignored. default is 1
+        migration_interval: number of generations between migrations. default is 5
+        n_migrants: number of best individuals an island sends per migration. default is 1
+        migration_topology: 'ring' (each island sends to the next one), 'fully_connected'
+            (to all other islands) or 'random' (to a random other island). default is 'ring'
+
+    Attributes:
+        island_histories: in island mode, a list with the hyperparam_history of each island
+    """
     def __init__(self, model, hyperparams, eval_func, n_init_samples,
-                 parent_selection_method, mutation_noise):
+                 parent_selection_method, mutation_noise, generational=False,
+                 population_size=None, n_elites=1, tournament_size=3, n_jobs=1,
+                 n_islands=1, migration_interval=5, n_migrants=1, migration_topology='ring'):
         super(GeneticOptimizer, self).__init__(model, hyperparams, eval_func)
         self.fitness_function = eval_func        
         self.bounds = {hp.name:[hp.lower, hp.upper] for hp in self.hyperparams}
         self.n_init_samples = n_init_samples
         self.parent_selection_method = parent_selection_method
         self.mutation_noise = mutation_noise
+        self.generational = generational
+        if population_size is None:
+            population_size = n_init_samples
+        if n_elites >= population_size:
+            raise ValueError("n_elites needs to be smaller than population_size")
+        self.population_size = population_size
+        self.n_elites = n_elites
+        self.tournament_size = tournament_size
+        self.n_jobs = n_jobs
+        if n_migrants >= population_size:
+            raise ValueError("n_migrants needs to be smaller than population_size")
+        self.n_islands = n_islands
+        self.migration_interval = migration_interval
+        self.n_migrants = n_migrants
+        self.migration_topology = migration_topology
+        self.island_histories = []
 
     def get_next_hyperparameters(self):
         pass
 
+    def propose(self):
+        """
+        Returns a random individual until n_init_samples trials have been observed
+        and afterwards a child of parents selected from all observed trials, like
+        an iteration of the default (non-generational) mode.
+
+        Args:
+            None
+
+        Returns:
+            a dictionary with parameter names as keys and parameter values as values
+        """
+        if len(self.hyperparam_history) < self.n_init_samples:
+            return self._random_sample()
+        fitnesses = self.cutoff_fitness([{'params': params, 'fitness': score}
+                                         for score, params in self.hyperparam_history])
+        params = self.mutate(self.crossover(self.select_parents(fitnesses, 3)))
+        return self._row_to_params([params[hp.name] for hp in self.hyperparams])
+
     def getParamType(self, parameter_name):
         return self.param_dict[parameter_name].param_type
 
@@ -31,12 +112,11 @@ class GeneticOptimizer(Optimizer):
         return [{'params': self._random_sample()} for _ in range(self.n_init_samples)]
 
     def calculate_fitness(self, params, X_train, y_train, X_test=None, y_test=None):
-        model = self.build_new_model(params)
-        model.fit(X_train,y_train)
+        model = self.fit_new_model(params, X_train, y_train)
         if (X_test is not None) and (y_test is not None):
-            score = self.fitness_function(y_test, model.predict(X_test))
+            score = score_model(model, X_test, y_test, self.fitness_function, self.prediction_chunk_size)
         else:
-            score = self.fitness_function(y_train, model.predict(X_train))
+            score = score_model(model, X_train, y_train, self.fitness_function, self.prediction_chunk_size)
         return {'params': params, 'fitness': score}
 
     def cutoff_fitness(self, fitness):
@@ -44,11 +124,12 @@ class GeneticOptimizer(Optimizer):
 
     def select_parents(self, with_fitness, n_parents):
         fitness = [k['fitness'] for k in with_fitness]
+        cumulative_fitness = np.cumsum(fitness)
         parents = []
         for i in range(n_parents):        
             if self.parent_selection_method=='RouletteWheel':
-                r = np.random.uniform(0, sum(fitness))
-                parent_idx = np.where(r<np.cumsum(fitness))[0][0]            
+                r = np.random.uniform(0, cumulative_fitness[-1])
+                parent_idx = np.where(r<cumulative_fitness)[0][0]            
             elif self.parent_selection_method=='Max':
                 parent_idx = np.argmax(fitness)
             parents.append(with_fitness[parent_idx])
@@ -66,7 +147,7 @@ class GeneticOptimizer(Optimizer):
 
     def mutate(self, params):
         for k in params.keys():
-            with_noise = params[k] + self.mutation_noise[k] * np.random.randn(1)
+            with_noise = params[k] + self.mutation_noise[k] * np.random.randn()
             if self.getParamType(k) == 'integer':
                 with_noise = int(round(with_noise))
             if with_noise < self.bounds[k][0]:
@@ -80,10 +161,141 @@ class GeneticOptimizer(Optimizer):
         best_idx = np.argmax([f['fitness'] for f in fitnesses])
         return fitnesses[best_idx]['params']
 
+    def _check_generational_params(self):
+        for hp in self.hyperparams:
+            if hp.param_type not in ['continuous', 'integer']:
+                raise ValueError("The generational GeneticOptimizer only takes parameters of type 'continuous' and 'integer'")
+            if hp.name not in self.mutation_noise:
+                raise MissingValueException("Need to provide the mutation noise for '{}'".format(hp.name))
+
+    @property
+    def _bounds_arr(self):
+        return np.array([self.bounds[hp.name] for hp in self.hyperparams], dtype=float)
+
+    @property
+    def _is_integer(self):
+        return np.array([hp.param_type == 'integer' for hp in self.hyperparams])
+
+    def _repair(self, population):
+        """
+        Clips a population matrix to the bounds and rounds integer columns.
+        """
+        bounds = self._bounds_arr
+        population = np.clip(population, bounds[:, 0], bounds[:, 1])
+        population[:, self._is_integer] = np.round(population[:, self._is_integer])
+        return population
+
+    def _row_to_params(self, row):
+        params = {}
+        for hp, v in zip(self.hyperparams, row):
+            if hp.param_type == 'integer':
+                params[hp.name] = int(v)
+            else:
+                params[hp.name] = float(v)
+        return params
+
+    def init_population_matrix(self, n_individuals):
+        """
+        Samples individuals uniformly within the bounds.
+
+        Args:
+            n_individuals: number of individuals
+
+        Returns:
+            a numpy array of shape (n_individuals, number of hyperparameters)
+        """
+        bounds = self._bounds_arr
+        population = np.random.uniform(bounds[:, 0], bounds[:, 1],
+                                       size=(n_individuals, len(self.hyperparams)))
+        return self._repair(population)
+
+    def select_parents_vectorized(self, fitness, n_children, n_parents):
+        """
+        Selects the parents of a whole generation at once.
+
+        Args:
+            fitness: a numpy array with the fitness of each individual
+            n_children: number of children to create
+            n_parents: number of parents per child
+
+        Returns:
+            a numpy integer array of shape (n_children, n_parents) with indices of
+            individuals in the population
+        """
+        size = (n_children, n_parents)
+        if self.parent_selection_method == 'Tournament':
+            contestants = np.random.randint(len(fitness), size=size + (self.tournament_size,))
+            winners = np.argmax(fitness[contestants], axis=2)
+            return np.take_along_axis(contestants, winners[..., None], axis=2)[..., 0]
+        elif self.parent_selection_method == 'RouletteWheel':
+            # shift so that all selection probabilities are positive
+            weights = fitness - np.min(fitness) + 1e-12
+            cdf = np.cumsum(weights)
+            idxs = np.searchsorted(cdf, np.random.uniform(0, cdf[-1], size=size), side='right')
+            return np.minimum(idxs, len(fitness) - 1)
+        elif self.parent_selection_method == 'Max':
+            return np.full(size, np.argmax(fitness))
+        raise ValueError("parent_selection_method needs to be 'RouletteWheel', 'Tournament' or 'Max'")
+
+    def crossover_vectorized(self, population, fitness, parent_idxs):
+        """
+        Creates one child per row of parent_idxs as the fitness-weighted average of
+        its parents, the vectorized version of self.crossover.
+
+        Args:
+            population: a numpy array of shape (N, d)
+            fitness: a numpy array with the fitness of each individual
+            parent_idxs: a numpy integer array of shape (n_children, n_parents)
+
+        Returns:
+            a numpy array of shape (n_children, d)
+        """
+        weights = fitness[parent_idxs] - np.min(fitness) + 1e-12
+        weights = weights / np.sum(weights, axis=1, keepdims=True)
+        return np.einsum('cp,cpd->cd', weights, population[parent_idxs])
+
+    def mutate_vectorized(self, children):
+        """
+        Adds gaussian noise with standard deviation self.mutation_noise to each
+        child, the vectorized version of self.mutate.
+
+        Args:
+            children: a numpy array of shape (n_children, d)
+
+        Returns:
+            a numpy array of shape (n_children, d) within the bounds
+        """
+        noise = np.array([self.mutation_noise[hp.name] for hp in self.hyperparams], dtype=float)
+        return self._repair(children + noise * np.random.randn(*children.shape))
+
+    def next_generation(self, population, fitness):
+        """
+        Creates the next generation from the current one. The n_elites best
+        individuals survive, the rest of the population is replaced by children.
+
+        Args:
+            population: a numpy array of shape (N, d)
+            fitness: a numpy array with the fitness of each individual
+
+        Returns:
+            elites: a numpy array of shape (n_elites, d)
+            children: a numpy array of shape (population_size - n_elites, d)
+        """
+        elite_idxs = np.argsort(-fitness)[:self.n_elites]
+        n_children = self.population_size - len(elite_idxs)
+        parent_idxs = self.select_parents_vectorized(fitness, n_children, 3)
+        children = self.mutate_vectorized(self.crossover_vectorized(population, fitness, parent_idxs))
+        return population[elite_idxs], children
+
     def fit(self, X_train, y_train, X_test=None, y_test=None, n_iters=10, n_tries=5, n_folds=None):
         """
+        n_iters: number of children, or number of generations if self.generational or self.n_islands > 1
         n_tries: number of attempts to improve the parameters. stopping condition
         """
+        if self.n_islands > 1:
+            return self._fit_islands(X_train, y_train, X_test, y_test, n_iters, n_folds)
+        if self.generational:
+            return self._fit_generational(X_train, y_train, X_test, y_test, n_iters, n_folds)
         population = self.init_population()
         fitnesses = [self.calculate_fitness(individual['params'], X_train, y_train, X_test, y_test) for individual in population]
         #self.hyperparam_history += zip([f['fitness'] for f in fitnesses],
@@ -99,12 +311,9 @@ class GeneticOptimizer(Optimizer):
             params = self.mutate(params)
 
             if n_folds is not None:
-                splits = self.get_kfold_split(n_folds, X_train)
                 scores = []
-                for train_idxs, test_idxs in splits:
-                    new_params_with_fitness = self.calculate_fitness(params, 
-                                    X_train[train_idxs], y_train[train_idxs], 
-                                    X_train[test_idxs], y_train[test_idxs])
+                for fold in self.get_cross_validation(n_folds).folds(X_train, y_train):
+                    new_params_with_fitness = self.calculate_fitness(params, *fold)
                     scores.append(new_params_with_fitness['fitness'])
                 new_params_with_fitness['fitness'] = np.mean(scores)
             else:
@@ -124,3 +333,196 @@ class GeneticOptimizer(Optimizer):
         best_params = self.select_best(fitnesses)
         best_model = self.build_new_model(params)
         return best_params, best_model
+
+    def _fit_generational(self, X_train, y_train, X_test, y_test, n_generations, n_folds):
+        """
+        Evolves n_generations generations and evaluates each of them on a TrialPool.
+        """
+        self._check_generational_params()
+        if (X_test is not None) and (y_test is not None) and (n_folds is not None):
+            raise Exception("Provide either 'X_test' and 'y_test' or 'n_folds'")
+        with TrialPool(self, X_train, y_train, X_test, y_test, n_folds, self.n_jobs) as pool:
+            population, fitness = self._initial_generation(pool)
+            for generation in range(n_generations):
+                population, fitness = self._evolve(pool, population, fitness)
+        self.population = population
+        self.fitness = fitness
+        best_params, best_model = self.get_best_params_and_model()
+        return best_params, best_model
+
+    def _initial_generation(self, pool):
+        population = self.init_population_matrix(self.n_init_samples)
+        fitness = self._evaluate_population(pool, population)
+        # bound the population in case n_init_samples > population_size
+        keep = np.argsort(-fitness)[:self.population_size]
+        return population[keep], fitness[keep]
+
+    def _evolve(self, pool, population, fitness):
+        elites, children = self.next_generation(population, fitness)
+        population = np.vstack([elites, children])
+        fitness = np.concatenate([fitness[np.argsort(-fitness)[:len(elites)]],
+                                  self._evaluate_population(pool, children)])
+        return population, fitness
+
+    def _evaluate_population(self, pool, population):
+        params = [self._row_to_params(row) for row in population]
+        fitness = np.asarray(pool.map(params), dtype=float)
+        self.hyperparam_history += list(zip(fitness, params))
+        return fitness
+
+    def migration_targets(self, island_idx):
+        """
+        Returns the islands that receive the migrants of an island.
+
+        Args:
+            island_idx: index of the sending island
+
+        Returns:
+            a list of island indices
+        """
+        others = [i for i in range(self.n_islands) if i != island_idx]
+        if self.migration_topology == 'ring':
+            return [(island_idx + 1) % self.n_islands]
+        elif self.migration_topology == 'fully_connected':
+            return others
+        elif self.migration_topology == 'random':
+            return [others[np.random.randint(len(others))]]
+        raise ValueError("migration_topology needs to be 'ring', 'fully_connected' or 'random'")
+
+    def receive_migrants(self, population, fitness, migrants, migrant_fitness):
+        """
+        Replaces the worst individuals of a population by better migrants. Migrants
+        carry their fitness with them and are not evaluated again.
+
+        Args:
+            population: a numpy array of shape (N, d)
+            fitness: a numpy array with the fitness of each individual
+            migrants: a numpy array of shape (n_migrants, d)
+            migrant_fitness: a numpy array with the fitness of each migrant
+
+        Returns:
+            the new population and fitness
+        """
+        population, fitness = population.copy(), fitness.copy()
+        worst = np.argsort(fitness)[:len(migrants)]
+        for idx, migrant, migrant_score in zip(worst, migrants, migrant_fitness):
+            if migrant_score > fitness[idx]:
+                population[idx] = migrant
+                fitness[idx] = migrant_score
+        return population, fitness
+
+    def _fit_islands(self, X_train, y_train, X_test, y_test, n_generations, n_folds):
+        """
+        Evolves self.n_islands populations in separate processes for n_generations
+        generations each and collects their histories and trial statuses. If an
+        island fails, its exception is raised here and the remaining islands are
+        terminated; an island process that dies without a result (e.g. because it
+        was killed) raises a RuntimeError.
+        """
+        self._check_generational_params()
+        if (X_test is not None) and (y_test is not None) and (n_folds is not None):
+            raise Exception("Provide either 'X_test' and 'y_test' or 'n_folds'")
+        data = share((X_train, y_train, X_test, y_test, n_folds))
+        inboxes = [Queue() for _ in range(self.n_islands)]
+        results = Queue()
+        seeds = np.random.randint(2**31 - 1, size=self.n_islands)
+        islands = [Process(target=_run_island,
+                           args=(self, island_idx, seeds[island_idx], data, n_generations, inboxes, results))
+                   for island_idx in range(self.n_islands)]
+        for island in islands:
+            island.start()
+        island_results = {}
+        try:
+            # read the results before joining, a process does not exit while its queue is being fed
+            while len(island_results) < len(islands):
+                try:
+                    island_idx, error, result = results.get(timeout=1.)
+                except Empty:
+                    _check_islands(islands, island_results, results)
+                    continue
+                if error is not None:
+                    raise error
+                island_results[island_idx] = result
+        finally:
+            for island in islands:
+                if (len(island_results) < len(islands)) and island.is_alive():
+                    island.terminate()
+                island.join()
+        island_results = [island_results[island_idx] for island_idx in range(len(islands))]
+        self.island_histories = [history for history, statuses, population, fitness in island_results]
+        self.island_populations = [(population, fitness) for history, statuses, population, fitness in island_results]
+        self.hyperparam_history = [score_params for history in self.island_histories for score_params in history]
+        self.trial_statuses = [status for history, statuses, population, fitness in island_results
+                               for status in statuses]
+        best_params, best_model = self.get_best_params_and_model()
+        return best_params, best_model
+
+
+def _check_islands(islands, island_results, results):
+    """
+    Raises a RuntimeError if an island process has exited without sending its result.
+    """
+    for island_idx, island in enumerate(islands):
+        if (island_idx in island_results) or (island.exitcode is None):
+            continue
+        try:
+            # the result may have arrived just before the process exited
+            result = results.get(timeout=1.)
+        except Empty:
+            raise RuntimeError("island {} exited with code {} without returning its results".format(
+                island_idx, island.exitcode))
+        results.put(result)
+        return
+
+
+def _run_island(optimizer, island_idx, seed, data, n_generations, inboxes, results):
+    """
+    Runs _evolve_island and puts (island_idx, error, result) on the results queue,
+    where error is the exception the island raised or None.
+    """
+    try:
+        results.put((island_idx, None, _evolve_island(optimizer, island_idx, seed, data, n_generations,
+                                                      inboxes)))
+    except Exception as error:
+        try:
+            pickle.dumps(error)
+        except Exception:
+            error = RuntimeError("island {} failed:\n{}".format(island_idx, traceback.format_exc()))
+        results.put((island_idx, error, None))
+
+
+def _evolve_island(optimizer, island_idx, seed, data, n_generations, inboxes):
+    """
+    Evolves the population of one island. Every optimizer.migration_interval
+    generations the best individuals are sent to the inboxes of the target islands
+    and all migrants that have arrived in the own inbox are merged into the
+    population. Migration is asynchronous: islands never wait for each other.
+
+    Returns:
+        a tuple (hyperparam_history, trial_statuses, population, fitness)
+    """
+    np.random.seed(seed)
+    data = unshare(data)
+    optimizer.hyperparam_history = []
+    optimizer.trial_statuses = []
+    for inbox in inboxes:
+        # migrants that are never received must not keep this process alive
+        inbox.cancel_join_thread()
+    inbox = inboxes[island_idx]
+    with TrialPool(optimizer, *data) as pool:
+        population, fitness = optimizer._initial_generation(pool)
+        for generation in range(1, n_generations + 1):
+            population, fitness = optimizer._evolve(pool, population, fitness)
+            if generation % optimizer.migration_interval != 0:
+                continue
+            best = np.argsort(-fitness)[:optimizer.n_migrants]
+            for target in optimizer.migration_targets(island_idx):
+                inboxes[target].put((population[best], fitness[best]))
+            while True:
+                try:
+                    migrants, migrant_fitness = inbox.get_nowait()
+                except Empty:
+                    break
+                population, fitness = optimizer.receive_migrants(population, fitness,
+                                                                 migrants, migrant_fitness)
+    return optimizer.hyperparam_history, optimizer.trial_statuses, population, fitness
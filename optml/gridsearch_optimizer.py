@@ -1,15 +1,23 @@
+import os
+import json
+import time
 import numpy as np
 import warnings
-import itertools
+import operator
+import threading
+from functools import reduce
 from multiprocessing import Pool
-from functools import partial
-from copy import deepcopy
+from multiprocessing.pool import ThreadPool
 from optml.optimizer_base import Optimizer, MissingValueException
-from sklearn.model_selection import KFold
+from optml.isolation import run_isolated, OK
+from optml.staged import get_shared_fit, group_by_rounds
+from optml.data import share, unshare
+from optml.pipeline_cache import TransformerCache, clone_pipeline, fit_pipeline
+from optml.validation import score_model
 
 def build_new_model(model, model_params, model_module):
     if model_module == 'pipeline':
-            new_model = model.set_params(**model_params)
+        new_model = clone_pipeline(model, model_params)
     elif (model_module == 'sklearn') or (model_module == 'xgboost'):
         new_model = model.__class__(**model_params)
     elif model_module == 'statsmodels':
@@ -18,58 +26,590 @@ def build_new_model(model, model_params, model_module):
         new_model = model.__class__(**model_params)
     return new_model
 
-def objective(model, model_module, eval_func, X_train, y_train, X_test, y_test, params, n_folds=None):
+def fit_new_model(model, model_params, model_module, X_train, y_train, pipeline_cache=None):
+    new_model = build_new_model(model, model_params, model_module)
+    if (model_module == 'pipeline') and (pipeline_cache is not None):
+        return fit_pipeline(new_model, X_train, y_train, pipeline_cache)
+    new_model.fit(X_train, y_train)
+    return new_model
+
+def objective(model, model_module, eval_func, X_train, y_train, X_test, y_test, params,
+              pipeline_cache=None, chunk_size=None):
+    # cross-validation runs one task per (cell, fold), see _evaluate_tasks
     model_params = model.get_params()
     model_params.update(params)
-
-    if n_folds is not None:
-        kf = KFold(n_splits=n_folds)
-        scores = []
-        splits = kf.split(X_train)
-        for train_idxs, test_idxs in splits:
-            new_model = build_new_model(model, model_params, model_module)
-            new_model.fit(X_train[train_idxs], y_train[train_idxs])
-            scores.append(self.eval_func(y_train[test_idxs], new_model.predict(X_train[test_idxs])))
-        score = np.mean(scores)
-    else:
-        new_model = build_new_model(model, model_params, model_module)
-        new_model.fit(X_train, y_train)
-        y_pred = new_model.predict(X_test)
-        y_true = y_test
-        score = eval_func(y_true, y_pred)
+    new_model = fit_new_model(model, model_params, model_module, X_train, y_train, pipeline_cache)
+    score = score_model(new_model, X_test, y_test, eval_func, chunk_size)
     return (score, params)
 
+class LazyGrid(object):
+    """
+    The cartesian product of the possible values of several parameters. The grid
+    is never materialized: cell i is decoded into a dictionary of parameters on
+    demand, in the same order as itertools.product would enumerate the cells
+    (i.e. the last parameter changes fastest).
+
+    Args:
+        grid_dict: a list of tuples (parameter name, list of possible values)
+
+    Attributes:
+        param_names: a list with the names of the parameters
+        param_values: a list with the possible values of each parameter
+        shape: a tuple with the number of values of each parameter
+    """
+    def __init__(self, grid_dict):
+        self.param_names = [name for name, values in grid_dict]
+        self.param_values = [list(values) for name, values in grid_dict]
+        self.shape = tuple(len(values) for values in self.param_values)
+
+    def __len__(self):
+        return reduce(operator.mul, self.shape, 1)
+
+    def __getitem__(self, idx):
+        n_cells = len(self)
+        if idx < 0:
+            idx += n_cells
+        if (idx < 0) or (idx >= n_cells):
+            raise IndexError("grid index out of range")
+        value_idxs = []
+        for values in reversed(self.param_values):
+            idx, value_idx = divmod(idx, len(values))
+            value_idxs.append(value_idx)
+        return {name: values[value_idx] for name, values, value_idx
+                in zip(self.param_names, self.param_values, reversed(value_idxs))}
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def value_indices(self, cells):
+        """
+        Decodes many cells at once into the indices of their parameter values.
+
+        Args:
+            cells: an array of cell indices
+
+        Returns:
+            an integer numpy array of shape (n_cells, n_parameters)
+        """
+        cells = np.array(cells, dtype=np.int64)
+        value_idxs = np.empty((len(cells), len(self.shape)), dtype=np.int64)
+        for axis in reversed(range(len(self.shape))):
+            cells, value_idxs[:, axis] = np.divmod(cells, self.shape[axis])
+        return value_idxs
+
+
+class GridUnion(object):
+    """
+    Concatenation of several LazyGrids that can be indexed like a single grid.
+
+    Args:
+        grids: a list of LazyGrid instances
+    """
+    def __init__(self, grids):
+        self.grids = grids
+        self.offsets = np.cumsum([0] + [len(grid) for grid in grids])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if (idx < 0) or (idx >= len(self)):
+            raise IndexError("grid index out of range")
+        grid_idx = np.searchsorted(self.offsets, idx, side='right') - 1
+        return self.grids[grid_idx][idx - self.offsets[grid_idx]]
+
+    def __iter__(self):
+        for grid in self.grids:
+            for params in grid:
+                yield params
+
+
+def _hashable(value):
+    if isinstance(value, (float, np.floating)):
+        return round(float(value), 12)
+    elif isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def _to_json(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError("{} is not JSON serializable".format(type(value)))
+
+def _cell_key(params):
+    """
+    A hashable representation of a dictionary of parameters which is used to
+    recognize grid points that have already been evaluated.
+    """
+    return tuple((name, _hashable(params[name])) for name in sorted(params.keys()))
+
+
+class CellCostModel(object):
+    """
+    Estimates how long it takes to evaluate a grid cell. The log of the duration
+    is modelled as the log of an optional user-supplied cost hint plus an additive
+    correction with one term per parameter value that is learned from the
+    durations of the cells evaluated so far.
+
+    Args:
+        cost_hint: a function that takes a dictionary of parameters and returns a
+            number proportional to the expected cost, e.g.
+            lambda params: params['n_estimators'] * params['max_depth']. default is None
+
+    Attributes:
+        n_observations: number of durations the model has been updated with
+    """
+    def __init__(self, cost_hint=None):
+        self.cost_hint = cost_hint
+        self.n_observations = 0
+        self._residual_sum = 0.
+        self._value_residuals = {}
+
+    def _log_hint(self, params):
+        if self.cost_hint is None:
+            return 0.
+        return np.log(max(self.cost_hint(params), 1e-12))
+
+    def observe(self, params, duration):
+        """
+        Updates the model with the measured duration of a cell.
+
+        Args:
+            params: a dictionary with the parameters of the cell
+            duration: the duration in seconds
+
+        Returns:
+            None
+        """
+        residual = np.log(max(duration, 1e-6)) - self._log_hint(params)
+        self.n_observations += 1
+        self._residual_sum += residual
+        for key in _cell_key(params):
+            value_residual = self._value_residuals.setdefault(key, [0., 0])
+            value_residual[0] += residual
+            value_residual[1] += 1
+
+    def _effect(self, name, value):
+        if self.n_observations == 0:
+            return 0.
+        residual_sum, count = self._value_residuals.get((name, _hashable(value)), (0., 0))
+        if count == 0:
+            return 0.
+        return residual_sum / count - self._residual_sum / self.n_observations
+
+    def estimate(self, grid, cells):
+        """
+        Estimates the log of the cost of many cells of a grid at once.
+
+        Args:
+            grid: a LazyGrid or GridUnion
+            cells: a numpy array with cell indices
+
+        Returns:
+            a numpy array with the estimated log cost of each cell
+        """
+        cells = np.asarray(cells, dtype=np.int64)
+        if isinstance(grid, GridUnion):
+            log_costs = np.empty(len(cells))
+            grid_idxs = np.searchsorted(grid.offsets, cells, side='right') - 1
+            for grid_idx, sub_grid in enumerate(grid.grids):
+                in_grid = grid_idxs == grid_idx
+                log_costs[in_grid] = self.estimate(sub_grid, cells[in_grid] - grid.offsets[grid_idx])
+            return log_costs
+        log_costs = np.zeros(len(cells))
+        if self.n_observations > 0:
+            log_costs += self._residual_sum / self.n_observations
+            value_idxs = grid.value_indices(cells)
+            for axis, (name, values) in enumerate(zip(grid.param_names, grid.param_values)):
+                effects = np.array([self._effect(name, value) for value in values])
+                log_costs += effects[value_idxs[:, axis]]
+        if self.cost_hint is not None:
+            log_costs += np.array([self._log_hint(grid[cell_idx]) for cell_idx in cells])
+        return log_costs
+
+
+class _LongestFirstSchedule(object):
+    """
+    Yields tuples (cell index, estimated cost) in order of decreasing estimated
+    cost. The remaining cells are re-sorted whenever the number of observed
+    durations has doubled since the last sort.
+    """
+    def __init__(self, grid, cells, cost_model, min_observations=1):
+        self.grid = grid
+        self.cost_model = cost_model
+        self.min_observations = min_observations
+        self.cells = np.fromiter(cells, dtype=np.int64)
+        self.costs = np.zeros(len(self.cells))
+        self.remaining_cost = 0.
+        self._sorted_at = -1
+
+    def _sort(self, start):
+        remaining = self.cells[start:]
+        costs = np.exp(self.cost_model.estimate(self.grid, remaining))
+        order = np.argsort(-costs, kind='stable')
+        self.cells[start:] = remaining[order]
+        self.costs[start:] = costs[order]
+        self.remaining_cost = np.sum(costs)
+        self._sorted_at = self.cost_model.n_observations
+
+    def __iter__(self):
+        for position in range(len(self.cells)):
+            n_observations = self.cost_model.n_observations
+            if (self._sorted_at < 0) or (n_observations >= max(2 * self._sorted_at, self.min_observations)
+                                         and n_observations > self._sorted_at):
+                self._sort(position)
+            self.remaining_cost -= self.costs[position]
+            yield self.cells[position], self.costs[position]
+
+
+# state of a worker process; set once per process by _init_worker so that the
+# data does not have to be sent along with every single task
+_worker_state = {}
+
+def _init_worker(model, model_module, eval_func, grid, X_train, y_train, X_test, y_test, folds,
+                 early_stopping_rounds=None, chunk_size=None, trial_limits=None):
+    X_train, y_train, X_test, y_test = unshare((X_train, y_train, X_test, y_test))
+    _worker_state.update({'model': model, 'model_module': model_module, 'eval_func': eval_func,
+                          'grid': grid, 'X_train': X_train, 'y_train': y_train,
+                          'X_test': X_test, 'y_test': y_test, 'folds': folds,
+                          'early_stopping_rounds': early_stopping_rounds, 'chunk_size': chunk_size,
+                          'trial_limits': trial_limits,
+                          'shared_fit': get_shared_fit(model, model_module),
+                          'pipeline_cache': TransformerCache() if model_module == 'pipeline' else None})
+
+def _evaluate_batch(batch):
+    """
+    Evaluates a list of (cell, fold) tasks in a worker. If trial limits are set
+    (a tuple (timeout, memory_limit), see Optimizer.set_trial_limits) every task
+    runs in its own process that is killed when it exceeds the limits; fits are
+    not shared between cells then.
+    Returns a list of tuples (cell_idx, fold_idx, score, duration, status) where
+    status is None without trial limits and otherwise a tuple (status, error) as
+    returned by optml.isolation.run_isolated. The score of failed tasks is None.
+    """
+    trial_limits = _worker_state['trial_limits']
+    if trial_limits is None:
+        return [result + (None,) for result in _evaluate_tasks(batch)]
+    timeout, memory_limit = trial_limits
+    results = []
+    for task in batch:
+        start = time.time()
+        status, value = run_isolated(_evaluate_tasks, ([task],), timeout=timeout, memory_limit=memory_limit)
+        if status == OK:
+            results.append(value[0] + ((OK, None),))
+        else:
+            results.append(task + (None, time.time() - start, (status, value)))
+    return results
+
+def _evaluate_tasks(batch):
+    """
+    Evaluates a list of (cell, fold) tasks in a worker process. If fold_idx is None
+    the model is trained on the whole training data and scored on the test data.
+    Cells of the same fold that only differ in the number of boosting rounds or in
+    the warm-start path parameter share their fits (see optml.staged); their
+    duration is split evenly.
+    Returns a list of tuples (cell_idx, fold_idx, score, duration).
+    """
+    state = _worker_state
+    shared_param, score_group = state['shared_fit']
+    cells_by_fold = {}
+    for cell_idx, fold_idx in batch:
+        cells_by_fold.setdefault(fold_idx, []).append(cell_idx)
+    results = []
+    for fold_idx, cells in cells_by_fold.items():
+        if fold_idx is None:
+            X_train, y_train = state['X_train'], state['y_train']
+            X_test, y_test = state['X_test'], state['y_test']
+        else:
+            X_train, y_train, X_test, y_test = state['folds'].fold(fold_idx, state['X_train'], state['y_train'])
+        params_list = [state['grid'][cell_idx] for cell_idx in cells]
+        if shared_param is None:
+            groups = [[idx] for idx in range(len(cells))]
+        else:
+            groups = group_by_rounds(params_list, shared_param)
+        for group in groups:
+            start = time.time()
+            if (len(group) == 1) and (state['early_stopping_rounds'] is None):
+                score, params = objective(state['model'], state['model_module'], state['eval_func'],
+                                          X_train, y_train, X_test, y_test, params_list[group[0]],
+                                          pipeline_cache=state['pipeline_cache'], chunk_size=state['chunk_size'])
+                scores = [score]
+            else:
+                model_params = state['model'].get_params()
+                model_params.update(params_list[group[0]])
+                values = [params_list[idx].get(shared_param, model_params[shared_param]) for idx in group]
+                scores = score_group(state['model'], state['model_module'], model_params, shared_param,
+                                     values, state['eval_func'], X_train, y_train, X_test, y_test,
+                                     early_stopping_rounds=state['early_stopping_rounds'],
+                                     chunk_size=state['chunk_size'])
+            duration = (time.time() - start) / len(group)
+            for idx, score in zip(group, scores):
+                results.append((cells[idx], fold_idx, score, duration))
+    return results
+
+class _TaskFeed(object):
+    """
+    Generates batches of (cell, fold) tasks for a pool of workers. At most
+    max_pending batches are handed out before results have come back, which keeps
+    memory constant and allows skipping the remaining folds of cells that have
+    been cancelled.
+
+    Folds are interleaved within blocks of cells, i.e. all cells of a block are
+    evaluated on the first fold before any of them is evaluated on the second fold.
+    A batch is closed once the summed cost of its tasks reaches batch_cost().
+
+    Args:
+        cells: an iterable of tuples (cell index, estimated cost)
+        n_folds: number of folds or None
+        block_size: number of cells whose folds are interleaved
+        max_pending: maximum number of batches that are handed out at once
+        batch_cost: a function returning the target cost of the next batch
+        max_batch_size: maximum number of tasks in a batch
+    """
+    def __init__(self, cells, n_folds, block_size, max_pending, batch_cost, max_batch_size):
+        self.cells = cells
+        self.n_folds = n_folds
+        self.block_size = block_size
+        self.max_pending = max_pending
+        self.batch_cost = batch_cost
+        self.max_batch_size = max_batch_size
+        self.cancelled = set()
+        self.stopped = False
+        self._slots = threading.Semaphore(max_pending)
+
+    def task_done(self):
+        self._slots.release()
+
+    def stop(self):
+        self.stopped = True
+        for _ in range(self.max_pending):
+            self._slots.release()
+
+    def _tasks(self):
+        if self.n_folds is None:
+            for cell_idx, cost in self.cells:
+                yield cell_idx, None, cost
+            return
+        block = []
+        for cell in self.cells:
+            block.append(cell)
+            if len(block) == self.block_size:
+                for task in self._interleave(block):
+                    yield task
+                block = []
+        for task in self._interleave(block):
+            yield task
+
+    def _interleave(self, block):
+        for fold_idx in range(self.n_folds):
+            for cell_idx, cost in block:
+                yield cell_idx, fold_idx, cost
+
+    def __iter__(self):
+        # runs in the task handler thread of the pool
+        batch, batch_cost = [], 0.
+        for cell_idx, fold_idx, cost in self._tasks():
+            if cell_idx in self.cancelled:
+                continue
+            batch.append((cell_idx, fold_idx))
+            batch_cost += cost
+            if (batch_cost >= self.batch_cost()) or (len(batch) >= self.max_batch_size):
+                self._slots.acquire()
+                if self.stopped:
+                    return
+                yield batch
+                batch, batch_cost = [], 0.
+        if len(batch) > 0:
+            self._slots.acquire()
+            if not self.stopped:
+                yield batch
+
 class GridSearchOptimizer(Optimizer):
     """
+    Evaluates all combinations of parameter values on a regular grid in parallel.
+    Optionally the grid is refined in several rounds around the best cells.
+
+    Args:
+        model: a model (currently supports scikit-learn, xgboost, or a class
+               derived from optml.models.Model)
+        hyperparams: a list of Parameter instances
+        eval_func: scoring function to be maximized. Takes input (y_true, y_predicted) where
+            y_true and y_predicted are numpy arrays
+        grid_sizes: a dictionary with the number of grid points for each numerical parameter
+        n_jobs: number of worker processes
+        chunksize: number of grid cells that are sent to a worker at once. default is
+            None which picks a chunksize based on the size of the grid and n_jobs.
+            Only used with scheduling='product'
+        scheduling: 'product' evaluates cells in the order of the grid in batches of
+            chunksize cells. 'longest_first' evaluates the cells with the highest expected
+            cost first and sizes each batch so that it holds a fixed fraction of the
+            remaining expected cost, which shortens the total run time of large parallel
+            grids. default is 'product'
+        cost_hint: a function that takes a dictionary of parameters and returns a number
+            proportional to the expected cost of evaluating them. Used by the
+            'longest_first' scheduling until durations have been measured. default is None
+
+    Attributes:
+        grid: a LazyGrid with all combinations of parameter values
+        grid_spacing: a dictionary with the distance between neighbouring grid points
+            for each numerical parameter
+        cancelled_cells: a list of tuples (mean score of the evaluated folds, params)
+            for cells whose cross-validation was cancelled
+        cost_model: a CellCostModel that learns the duration of cells during the search
     """
-    def __init__(self, model, hyperparams, eval_func, grid_sizes, n_jobs=1):
+    def __init__(self, model, hyperparams, eval_func, grid_sizes, n_jobs=1, chunksize=None,
+                 scheduling='product', cost_hint=None):
+        if scheduling not in ['product', 'longest_first']:
+            raise ValueError("scheduling needs to be 'product' or 'longest_first'")
         super(GridSearchOptimizer, self).__init__(model, hyperparams, eval_func)
         self.eval_func = eval_func
         self.bounds_arr = np.array([[hp.lower, hp.upper] for hp in self.hyperparams])
         self.n_jobs = n_jobs
-        self.grid = np.array(self.build_grid(grid_sizes))
-        #self.split_grid_across_jobs(grid)
+        self.chunksize = chunksize
+        self.scheduling = scheduling
+        self.cost_model = CellCostModel(cost_hint)
+        self.grid_sizes = grid_sizes
+        self.grid_spacing = {}
+        self.grid = self.build_grid(grid_sizes)
+        self.cancelled_cells = []
+        self._checkpoint = None
+        self._next_cell = 0
 
     def build_grid(self, grid_sizes):
-        grid_dict = {}
+        grid_dict = []
         for param_name, param in self.param_dict.items():
             if param.param_type == 'continuous':
-                grid_dict[param_name] = np.linspace(param.lower, param.upper, grid_sizes[param_name])
+                grid_dict.append((param_name, np.linspace(param.lower, param.upper, grid_sizes[param_name])))
+                self.grid_spacing[param_name] = (param.upper - param.lower) / max(1., grid_sizes[param_name] - 1.)
             elif param.param_type == 'integer':
-                step_size = int(round((param.upper - param.lower)/float(grid_sizes[param_name])))
-                grid_dict[param_name] = np.concatenate([np.arange(param.lower, param.upper, step_size), [param.upper]])
+                step_size = max(1, int(round((param.upper - param.lower)/float(grid_sizes[param_name]))))
+                grid_dict.append((param_name, np.concatenate([np.arange(param.lower, param.upper, step_size), [param.upper]])))
+                self.grid_spacing[param_name] = step_size
             elif param.param_type == 'categorical':
-                grid_dict[param_name] = param.possible_values
+                grid_dict.append((param_name, param.possible_values))
             elif param.param_type == 'boolean':
-                grid_dict[param_name] = [True, False]
-        # now build the grid as a list with all possible combinations i.e. the cartesian product
-        grid = []
-        for params in list(itertools.product(*[[(k,v) for v in vals] for k, vals in grid_dict.items()])):
-            grid.append(dict(params))
-        return grid
+                grid_dict.append((param_name, [True, False]))
+        # the grid is the cartesian product of all parameter values; cells are
+        # only decoded when they are evaluated
+        return LazyGrid(grid_dict)
+
+    def refine_grid(self, params, spacing):
+        """
+        Builds a grid in the box [value - spacing, value + spacing] around a grid cell
+        in every numerical dimension. The box has 2k+1 evenly spaced points per
+        dimension with k = max(1, (grid_size - 1) // 2), so the cell itself is the
+        centre of the box and the points next to it lie halfway to the neighbouring
+        cells of the previous round. Points outside the bounds of a parameter are
+        dropped. Categorical and boolean parameters are fixed to their values in
+        the cell.
+
+        Args:
+            params: a dictionary with the parameters of the grid cell
+            spacing: a dictionary with the half-width of the box for each numerical
+                parameter
+
+        Returns:
+            a LazyGrid
+        """
+        grid_dict = []
+        for param_name in self.grid.param_names:
+            param = self.param_dict[param_name]
+            value = params[param_name]
+            if param.param_type in ['continuous', 'integer']:
+                k = max(1, (self.grid_sizes[param_name] - 1) // 2)
+                values = value + spacing[param_name] * np.arange(-k, k + 1) / float(k)
+                values = values[(values >= param.lower) & (values <= param.upper)]
+                if param.param_type == 'integer':
+                    values = np.unique(np.round(values).astype(int))
+                grid_dict.append((param_name, values))
+            else:
+                grid_dict.append((param_name, [value]))
+        return LazyGrid(grid_dict)
 
-    def fit(self, X_train, y_train, X_test=None, y_test=None, n_folds=None):
+    def propose(self):
         """
+        Returns the next cell of the grid, in the order of the grid. Refinement
+        rounds are only run by fit.
+
+        Args:
+            None
+
+        Returns:
+            a dictionary with parameter names as keys and parameter values as values
+
+        Raises:
+            StopIteration: if every cell of the grid has been proposed
+        """
+        if self._next_cell >= len(self.grid):
+            raise StopIteration("all {} cells of the grid have been proposed".format(len(self.grid)))
+        params = self.grid[self._next_cell]
+        self._next_cell += 1
+        return params
+
+    def observe(self, score, hyperparams, duration=None):
+        """
+        Records the result of a cell that was proposed by self.propose(). The duration
+        is passed to the cost model of the 'longest_first' scheduling.
+
+        Args:
+            score: the score of the cell
+            hyperparams: a dictionary with the evaluated hyperparameters
+            duration: the time in seconds it took to evaluate the cell. default is None
+
+        Returns:
+            None
+        """
+        self.hyperparam_history.append((score, hyperparams))
+        if duration is not None:
+            self.cost_model.observe(hyperparams, duration)
+
+    def get_chunksize(self, n_cells):
+        if self.chunksize is not None:
+            return self.chunksize
+        return max(1, min(100, n_cells // (4 * self.n_jobs)))
+
+    def fit(self, X_train, y_train, X_test=None, y_test=None, n_folds=None, callback=None,
+            cancel_margin=None, n_refinements=0, top_k=3, checkpoint_path=None):
+        """
+        Evaluates every cell of the grid. Cells are streamed to the worker processes
+        and results are appended to self.hyperparam_history as soon as they arrive,
+        so the memory footprint does not depend on the size of the grid and partial
+        results can be read while the search is running.
+
+        With cross-validation every (cell, fold) pair is a separate task so that all
+        workers stay busy even if some cells are much slower than others. The fold
+        scores are averaged once all folds of a cell have come back.
+
+        If n_refinements > 0 the search continues coarse-to-fine: in each round the
+        boxes around the top_k cells found so far are re-gridded (see refine_grid).
+        The half-width of the boxes starts at half the spacing of the initial grid
+        and is halved in every round, so each round adds points between the ones
+        evaluated before. Points that have already been evaluated are not evaluated
+        again.
+
+        Args:
+            X_train: a numpy array with training data. each row corresponds to a data point
+            y_train: a numpy array containing the target variable for the training data
+            X_test: a numpy array with validation data. each row corresponds to a data point
+            y_test: a numpy array containing the target variable for the validation data
+            n_folds: number of folds for cross-validation. default is None
+            callback: a function that is called with (score, params) after each cell
+            cancel_margin: if given, the remaining folds of a cell are skipped once the mean
+                score of its evaluated folds is more than cancel_margin below the best
+                fully evaluated cell. Only applies to cross-validation. default is None
+            n_refinements: number of refinement rounds after the initial grid. default is 0
+            top_k: number of best cells that are refined in each round. default is 3
+            checkpoint_path: path of a file to which the result of every finished cell is
+                appended. If the file already exists, the cells recorded in it are not
+                evaluated again and their results are merged into self.hyperparam_history,
+                which allows restarting an interrupted search. default is None
+
+        Returns:
+            best_params: a dictionary with optimized hyperparameters
+            best_model: an untrained model with the optimized hyperparameters
         """
         if (X_test is None) and (y_test is None):
             X_test = X_train
@@ -79,13 +619,177 @@ class GridSearchOptimizer(Optimizer):
         elif (X_test is not None) and (y_test is not None) and (n_folds is not None):
             raise Exception("Provide either 'X_test' and 'y_test' or 'n_folds'")
 
-        fun = partial(objective, deepcopy(self.model), 
-                                 deepcopy(self.model_module), 
-                                 deepcopy(self.eval_func),
-                                 X_train, y_train, X_test, y_test)
-        pool = Pool(self.n_jobs)
-        scores = pool.map(fun, deepcopy(self.grid))
-        self.hyperparam_history = scores
+        self.hyperparam_history = []
+        self.cancelled_cells = []
+        folds = None
+        if n_folds is not None:
+            # computed once here so that the workers share the folds
+            folds = self.get_cross_validation(n_folds).materialize(X_train, y_train)
+        data = (X_train, y_train, X_test, y_test, folds)
+
+        completed = set()
+        if (checkpoint_path is not None) and os.path.exists(checkpoint_path):
+            completed = self.restore_checkpoint(checkpoint_path)
+        self._checkpoint = None if checkpoint_path is None else open(checkpoint_path, 'a')
+        try:
+            cells = (cell_idx for cell_idx in range(len(self.grid)) if cell_idx not in completed)
+            self._evaluate_grid(self.grid, cells, data, callback, cancel_margin, round_idx=0)
+            spacing = {name: step / 2. for name, step in self.grid_spacing.items()}
+            for round_idx in range(1, n_refinements + 1):
+                ranked = sorted(self.hyperparam_history, key=lambda score_params: -score_params[0])
+                grid = GridUnion([self.refine_grid(params, spacing) for score, params in ranked[:top_k]])
+                evaluated = set(_cell_key(params) for score, params in self.hyperparam_history + self.cancelled_cells)
+                self._evaluate_grid(grid, self._new_cells(grid, evaluated), data, callback, cancel_margin,
+                                    round_idx=round_idx)
+                spacing = {name: step / 2. for name, step in spacing.items()}
+        finally:
+            if self._checkpoint is not None:
+                self._checkpoint.close()
+            self._checkpoint = None
 
         best_params, best_model = self.get_best_params_and_model()
         return best_params, best_model
+
+    def restore_checkpoint(self, checkpoint_path):
+        """
+        Reads the results of a previous run from a checkpoint file and adds them to
+        self.hyperparam_history and self.cancelled_cells. An incomplete last line,
+        e.g. from a crash while writing, is removed from the file.
+
+        Args:
+            checkpoint_path: path of the checkpoint file
+
+        Returns:
+            a set with the indices of the cells of the initial grid that are completed
+        """
+        completed = set()
+        with open(checkpoint_path, 'rb+') as checkpoint:
+            content = checkpoint.read()
+            if not content.endswith(b'\n'):
+                # every record ends with a newline, anything after the last one is incomplete
+                content = content[:content.rfind(b'\n') + 1]
+                checkpoint.truncate(len(content))
+        for line in content.decode('utf-8').splitlines():
+            if line.strip() == '':
+                continue
+            record = json.loads(line)
+            if record['cancelled']:
+                self.cancelled_cells.append((record['score'], record['params']))
+            else:
+                self.hyperparam_history.append((record['score'], record['params']))
+            if record['round'] == 0:
+                if (record['index'] >= len(self.grid)) or \
+                        (_cell_key(self.grid[record['index']]) != _cell_key(record['params'])):
+                    raise ValueError("The checkpoint '{}' was written for a different grid".format(checkpoint_path))
+                completed.add(record['index'])
+        return completed
+
+    def _write_checkpoint(self, round_idx, cell_idx, score, params, cancelled=False):
+        if self._checkpoint is None:
+            return
+        record = {'round': round_idx, 'index': cell_idx, 'score': score,
+                  'params': params, 'cancelled': cancelled}
+        self._checkpoint.write(json.dumps(record, default=_to_json) + '\n')
+        self._checkpoint.flush()
+
+    def _new_cells(self, grid, evaluated):
+        """
+        Yields the indices of the cells of a grid that have not been evaluated yet.
+        """
+        for cell_idx, params in enumerate(grid):
+            key = _cell_key(params)
+            if key not in evaluated:
+                evaluated.add(key)
+                yield cell_idx
+
+    def _evaluate_grid(self, grid, cells, data, callback=None, cancel_margin=None, round_idx=0):
+        """
+        Evaluates the given cells of a grid in a pool of worker processes and
+        appends the results to self.hyperparam_history.
+
+        Args:
+            grid: a LazyGrid or GridUnion
+            cells: an iterable with the indices of the cells to evaluate
+            data: a tuple (X_train, y_train, X_test, y_test, folds) where folds is
+                an optml.folds.CrossValidation or None
+            callback: a function that is called with (score, params) after each cell
+            cancel_margin: see fit
+            round_idx: the refinement round; 0 for the initial grid
+
+        Returns:
+            None
+        """
+        X_train, y_train, X_test, y_test, folds = data
+        n_folds = None if folds is None else len(folds)
+        n_tasks_per_cell = n_folds or 1
+        chunksize = self.get_chunksize(len(grid) * n_tasks_per_cell)
+        if self.scheduling == 'longest_first':
+            # guided by cost: expensive cells are sent on their own, cheap cells in batches
+            schedule = _LongestFirstSchedule(grid, cells, self.cost_model, min_observations=self.n_jobs)
+            batch_cost = lambda: n_tasks_per_cell * schedule.remaining_cost / (4. * self.n_jobs)
+            block_size = 2 * self.n_jobs
+        else:
+            schedule = ((cell_idx, 1.) for cell_idx in cells)
+            batch_cost = lambda: chunksize
+            block_size = max(2 * self.n_jobs, chunksize)
+        feed = _TaskFeed(schedule, n_folds, block_size=block_size, max_pending=2 * self.n_jobs,
+                         batch_cost=batch_cost, max_batch_size=chunksize)
+        fold_scores = {}
+        self._best_score = max([score for score, params in self.hyperparam_history] + [-np.inf])
+        trial_limits = None
+        if self.isolates_trials:
+            trial_limits = (self.trial_timeout, self.trial_memory_limit)
+        initargs = (self.model, self.model_module, self.eval_func, grid) + \
+            share((X_train, y_train, X_test, y_test)) + \
+            (folds, self.early_stopping_rounds, self.prediction_chunk_size, trial_limits)
+        # pool processes cannot start processes of their own, so with trial limits
+        # threads of this process wait for the isolated trials instead
+        pool_class = Pool if trial_limits is None else ThreadPool
+        pool = pool_class(self.n_jobs, initializer=_init_worker, initargs=initargs)
+        try:
+            for batch_results in pool.imap_unordered(_evaluate_batch, feed):
+                feed.task_done()
+                for cell_idx, fold_idx, score, duration, status in batch_results:
+                    if status is not None:
+                        self.trial_statuses.append({'params': grid[cell_idx], 'status': status[0],
+                                                    'duration': duration, 'error': status[1]})
+                    if score is None:
+                        score = self.get_penalty_score()
+                    self.cost_model.observe(grid[cell_idx], duration)
+                    self._add_result(grid, cell_idx, fold_idx, score, fold_scores, feed,
+                                     n_folds, callback, cancel_margin, round_idx)
+            pool.close()
+        finally:
+            feed.stop()
+            pool.terminate()
+            pool.join()
+            if trial_limits is not None:
+                # the threads have set the state of this process
+                _worker_state.clear()
+
+    def _add_result(self, grid, cell_idx, fold_idx, score, fold_scores, feed, n_folds,
+                    callback, cancel_margin, round_idx):
+        """
+        Records the score of a (cell, fold) task. Fold scores are collected in
+        fold_scores until all folds of a cell are available and their mean is appended
+        to self.hyperparam_history and the checkpoint.
+        """
+        if cell_idx in feed.cancelled:
+            return
+        if fold_idx is not None:
+            scores = fold_scores.setdefault(cell_idx, [])
+            scores.append(score)
+            if len(scores) < n_folds:
+                if (cancel_margin is not None) and (np.mean(scores) + cancel_margin < self._best_score):
+                    feed.cancelled.add(cell_idx)
+                    self.cancelled_cells.append((np.mean(scores), grid[cell_idx]))
+                    self._write_checkpoint(round_idx, cell_idx, np.mean(scores), grid[cell_idx], cancelled=True)
+                    del fold_scores[cell_idx]
+                return
+            score = np.mean(fold_scores.pop(cell_idx))
+        params = grid[cell_idx]
+        self._best_score = max(self._best_score, score)
+        self.hyperparam_history.append((score, params))
+        self._write_checkpoint(round_idx, cell_idx, score, params)
+        if callback is not None:
+            callback(score, params)
@@ -1,22 +1,327 @@
+import os
+import time
+import errno
+import pickle
+import datetime
+import sqlite3
+import tempfile
 import numpy as np
 import warnings
 
 import sklearn.gaussian_process as gp
 from scipy.optimize import minimize
 from scipy.stats import norm
-from hyperopt import hp, fmin, tpe, Trials
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from hyperopt import hp, fmin, tpe, Trials, space_eval, STATUS_OK, STATUS_FAIL
+from hyperopt.base import Domain, JOB_STATE_NEW, JOB_STATE_RUNNING, JOB_STATE_DONE, JOB_STATE_ERROR
+from hyperopt.fmin import FMinIter
 
 from optml.optimizer_base import Optimizer, MissingValueException
+from optml.data import share, unshare
+
+
+class HyperoptObjective(object):
+    """
+    The loss that hyperopt minimizes: the negative score of a new model trained
+    with the given hyperparameters. Each call builds its own model so that trials
+    can run concurrently, and instances can be pickled to worker processes.
+    """
+    def __init__(self, optimizer, X_train, y_train, X_test=None, y_test=None, n_folds=None):
+        self.optimizer = optimizer
+        self.data = (X_train, y_train, X_test, y_test, n_folds)
+
+    @property
+    def isolates_trials(self):
+        return self.optimizer.isolates_trials
+
+    def __getstate__(self):
+        # memory-mapped data is reopened from its file in the worker process
+        return {'optimizer': self.optimizer, 'data': share(self.data)}
+
+    def __setstate__(self, state):
+        self.optimizer = state['optimizer']
+        self.data = unshare(state['data'])
+
+    def __call__(self, params):
+        X_train, y_train, X_test, y_test, n_folds = self.data
+        return -self.optimizer.evaluate_hyperparams(params, X_train, y_train, X_test, y_test, n_folds)
+
+
+def _not_evaluated(params):
+    raise RuntimeError("trials proposed by HyperoptOptimizer.propose are evaluated by the caller")
+
+
+# state of a worker process of LocalProcessTrials, set once by _init_trial_worker
+_worker_state = {}
+
+def _init_trial_worker(fn, space, db_path):
+    _worker_state['fn'] = fn
+    _worker_state['space'] = space
+    _worker_state['db_path'] = db_path
+
+def _utc_datetime(timestamp):
+    # hyperopt stores naive UTC datetimes in the trial documents
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).replace(tzinfo=None)
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+def _fail_trial(db_path, tid, failure, states):
+    """
+    Records a trial as failed unless it has already left the given states. Opens its
+    own connection, so it can be called from any thread.
+    """
+    connection = sqlite3.connect(db_path, timeout=60)
+    try:
+        with connection:
+            connection.execute("UPDATE trials SET state=?, result=?, refresh_time=? WHERE tid=? AND state IN ({})"
+                               .format(', '.join('?' * len(states))),
+                               (JOB_STATE_ERROR, pickle.dumps({'status': STATUS_FAIL, 'failure': failure}),
+                                time.time(), tid) + tuple(states))
+    finally:
+        connection.close()
+
+def _run_trial(tid, vals):
+    """
+    Evaluates one trial in a worker process and records its state and result in
+    the SQLite database. Exceptions of the objective are recorded as failed trials.
+    """
+    connection = sqlite3.connect(_worker_state['db_path'], timeout=60)
+    try:
+        with connection:
+            connection.execute("UPDATE trials SET state=?, book_time=?, worker=? WHERE tid=?",
+                               (JOB_STATE_RUNNING, time.time(), os.getpid(), tid))
+        try:
+            result = _worker_state['fn'](space_eval(_worker_state['space'], vals))
+            if not isinstance(result, dict):
+                result = {'loss': float(result), 'status': STATUS_OK}
+        except Exception as e:
+            result = {'status': STATUS_FAIL, 'failure': '{}: {}'.format(type(e).__name__, e)}
+        with connection:
+            connection.execute("UPDATE trials SET state=?, result=?, refresh_time=? WHERE tid=? AND state=?",
+                               (JOB_STATE_DONE, pickle.dumps(result), time.time(), tid, JOB_STATE_RUNNING))
+    finally:
+        connection.close()
+
+
+def _get_context():
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        # workers are forked from a server that has already imported optml
+        context.set_forkserver_preload(['optml.hyperopt_optimizer'])
+        return context
+    return multiprocessing.get_context()
+
+
+class LocalProcessTrials(Trials):
+    """
+    An asynchronous stand-in for hyperopt's MongoTrials that needs neither MongoDB
+    nor separate worker scripts. New trials proposed by hyperopt.fmin are evaluated
+    concurrently on a local pool of n_jobs processes; states and results are kept in
+    a SQLite database that the workers write to and fmin polls.
+
+    If db_path points to the database of an earlier run, its finished trials are
+    loaded so that the search continues where it stopped.
+
+    Trials whose worker process dies (e.g. killed for running out of memory) are
+    recorded as failed when fmin next polls the database, so that the search
+    continues without them.
+
+    Args:
+        n_jobs: number of worker processes. default is 2
+        db_path: path of the SQLite database. default is None which uses a temporary
+            file that is removed by close()
+        poll_interval_secs: time fmin waits between checking for finished trials.
+            default is 0.05
+        exp_key: see hyperopt.Trials
+    """
+    asynchronous = True
+
+    def __init__(self, n_jobs=2, db_path=None, poll_interval_secs=0.05, exp_key=None, refresh=True):
+        self.n_jobs = n_jobs
+        self.poll_interval_secs = poll_interval_secs
+        self._temporary_db = db_path is None
+        if db_path is None:
+            handle, db_path = tempfile.mkstemp(suffix='.sqlite')
+            os.close(handle)
+        self.db_path = db_path
+        self._pool = None
+        self._connection = sqlite3.connect(db_path, timeout=60)
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS trials (tid INTEGER PRIMARY KEY, "
+                                     "state INTEGER, doc BLOB, result BLOB, book_time REAL, refresh_time REAL, "
+                                     "worker INTEGER)")
+            columns = [row[1] for row in self._connection.execute("PRAGMA table_info(trials)")]
+            if 'worker' not in columns:
+                self._connection.execute("ALTER TABLE trials ADD COLUMN worker INTEGER")
+            # trials of an interrupted run are proposed again by fmin
+            self._connection.execute("DELETE FROM trials WHERE state != ?", (JOB_STATE_DONE,))
+        super(LocalProcessTrials, self).__init__(exp_key=exp_key, refresh=False)
+        docs = []
+        for doc, result in self._connection.execute("SELECT doc, result FROM trials ORDER BY tid"):
+            doc = pickle.loads(doc)
+            doc['state'] = JOB_STATE_DONE
+            doc['result'] = pickle.loads(result)
+            docs.append(doc)
+        self._ids.update(doc['tid'] for doc in docs)
+        self._insert_trial_docs_locally(docs)
+        if refresh:
+            self.refresh()
+
+    def _insert_trial_docs_locally(self, docs):
+        return super(LocalProcessTrials, self)._insert_trial_docs(docs)
+
+    def _insert_trial_docs(self, docs):
+        """
+        Stores new trials in the database and submits them to the worker pool.
+        """
+        with self._connection:
+            self._connection.executemany("INSERT INTO trials (tid, state, doc) VALUES (?, ?, ?)",
+                                         [(doc['tid'], JOB_STATE_NEW, pickle.dumps(doc)) for doc in docs])
+        tids = self._insert_trial_docs_locally(docs)
+        if self._pool is not None:
+            for doc in docs:
+                vals = {k: v[0] for k, v in doc['misc']['vals'].items() if len(v) > 0}
+                self._pool.apply_async(_run_trial, (doc['tid'], vals),
+                                       error_callback=self._make_error_callback(doc['tid']))
+        return tids
+
+    def _make_error_callback(self, tid):
+        # runs on the result handler thread of the pool, which cannot use self._connection
+        db_path = self.db_path
+        def error_callback(exception):
+            _fail_trial(db_path, tid, '{}: {}'.format(type(exception).__name__, exception),
+                        [JOB_STATE_NEW, JOB_STATE_RUNNING])
+        return error_callback
+
+    def _sweep(self):
+        """
+        Records running trials whose worker process has died as failed.
+        """
+        rows = self._connection.execute("SELECT tid, worker FROM trials WHERE state=?", (JOB_STATE_RUNNING,))
+        for tid, pid in rows.fetchall():
+            if (pid is not None) and not _is_alive(pid):
+                _fail_trial(self.db_path, tid, 'worker process {} died'.format(pid), [JOB_STATE_RUNNING])
+
+    def _sync(self):
+        """
+        Copies states and results written by the workers into the trial documents.
+        """
+        docs = {doc['tid']: doc for doc in self._dynamic_trials if doc['state'] != JOB_STATE_DONE}
+        if len(docs) == 0:
+            return
+        self._sweep()
+        rows = self._connection.execute("SELECT tid, state, result, book_time, refresh_time FROM trials "
+                                        "WHERE state != ?", (JOB_STATE_NEW,))
+        for tid, state, result, book_time, refresh_time in rows:
+            doc = docs.get(tid)
+            if (doc is None) or (doc['state'] == state):
+                continue
+            doc['state'] = state
+            if book_time is not None:
+                doc['book_time'] = _utc_datetime(book_time)
+            if result is not None:
+                doc['result'] = pickle.loads(result)
+                doc['refresh_time'] = _utc_datetime(refresh_time)
+
+    def refresh(self):
+        if hasattr(self, '_connection'):
+            self._sync()
+        super(LocalProcessTrials, self).refresh()
+
+    def count_by_state_unsynced(self, arg):
+        self._sync()
+        return super(LocalProcessTrials, self).count_by_state_unsynced(arg)
+
+    def fmin(self, fn, space, algo=None, max_evals=None, timeout=None, loss_threshold=None,
+             max_queue_len=None, rstate=None, verbose=False, return_argmin=True,
+             early_stop_fn=None, **kwargs):
+        """
+        Minimizes fn over space while evaluating up to max_queue_len trials at a time
+        on the worker pool. fn and space need to be picklable. See hyperopt.fmin for
+        the arguments; max_queue_len defaults to n_jobs.
+        """
+        if max_queue_len is None:
+            max_queue_len = self.n_jobs
+        if rstate is None:
+            rstate = np.random.default_rng()
+        domain = Domain(fn, space)
+        # objectives that start a process per trial cannot run in daemonic pool processes
+        if getattr(fn, 'isolates_trials', False):
+            pool_class = ThreadPool
+        else:
+            # a worker that dies is replaced while fmin and the pool threads are running;
+            # forking the replacement from this process could copy a held lock into it
+            pool_class = _get_context().Pool
+        self._pool = pool_class(processes=self.n_jobs, initializer=_init_trial_worker,
+                                initargs=(fn, space, self.db_path))
+        try:
+            iterator = FMinIter(algo, domain, self, rstate, max_queue_len=max_queue_len,
+                                poll_interval_secs=self.poll_interval_secs, max_evals=max_evals,
+                                timeout=timeout, loss_threshold=loss_threshold, verbose=verbose,
+                                show_progressbar=False, early_stop_fn=early_stop_fn)
+            iterator.exhaust()
+        finally:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        self.refresh()
+        if return_argmin:
+            return self.argmin
+        return space_eval(space, self.argmin)
+
+    def close(self):
+        """
+        Closes the database and removes it if it was a temporary file.
+        """
+        self._connection.close()
+        if self._temporary_db and os.path.exists(self.db_path):
+            os.remove(self.db_path)
 
 
 class HyperoptOptimizer(Optimizer):
-    """    
     """
-    def __init__(self, model, hyperparams, eval_func):
+    Tree-structured Parzen Estimator optimization with hyperopt.
+
+    Args:
+        model: a model (currently supports scikit-learn, xgboost, or a class
+               derived from optml.models.Model)
+        hyperparams: a list of Parameter instances of type 'integer', 'categorical',
+            'boolean' or 'continuous'
+        eval_func: scoring function to be maximized. Takes input (y_true, y_predicted) where
+            y_true and y_predicted are numpy arrays
+        n_jobs: number of trials that are evaluated concurrently. With n_jobs > 1 the
+            trials run on a LocalProcessTrials pool. default is 1
+        max_queue_len: number of suggestions TPE makes ahead of the finished trials.
+            Smaller values keep TPE better informed, values below n_jobs leave workers
+            idle. default is None which uses n_jobs
+        trials_db_path: path of the SQLite database of the LocalProcessTrials. A search
+            continues from the finished trials in an existing database. default is None
+    """
+    def __init__(self, model, hyperparams, eval_func, n_jobs=1, max_queue_len=None, trials_db_path=None):
         super(HyperoptOptimizer, self).__init__(model, hyperparams, eval_func)
         self.eval_func = eval_func
         self.bounds_arr = np.array([[param.lower, param.upper] for param in self.hyperparams])
         self.param_space = self.list_to_param_space(hyperparams)
+        self.n_jobs = n_jobs
+        self.max_queue_len = n_jobs if max_queue_len is None else max_queue_len
+        self.trials_db_path = trials_db_path
+        # trials and domain of the TPE steps made by propose
+        self._tpe_trials = None
+        self._tpe_domain = None
+        self._proposed = []
+
+    def __getstate__(self):
+        # the trials own the worker pool and database connection and stay in this process
+        state = self.__dict__.copy()
+        state.pop('trials', None)
+        state.update({'_tpe_trials': None, '_tpe_domain': None, '_proposed': []})
+        return state
 
     def list_to_param_space(self, params):
         param_space = {}
@@ -33,6 +338,52 @@ class HyperoptOptimizer(Optimizer):
                 raise ValueError("HyperOpt only takes parameters of type 'integer', 'categorical', 'boolean' and 'continuous'")
         return param_space
 
+    def propose(self):
+        """
+        Runs one step of TPE on the trials recorded by self.observe() and returns
+        the suggested hyperparameters.
+
+        Args:
+            None
+
+        Returns:
+            a dictionary with parameter names as keys and parameter values as values
+        """
+        if self._tpe_trials is None:
+            self._tpe_trials = Trials()
+            self._tpe_domain = Domain(_not_evaluated, self.param_space)
+        tid = self._tpe_trials.new_trial_ids(1)
+        docs = tpe.suggest(tid, self._tpe_domain, self._tpe_trials, np.random.randint(2 ** 31 - 1))
+        self._tpe_trials.insert_trial_docs(docs)
+        self._tpe_trials.refresh()
+        vals = {k: v[0] for k, v in docs[0]['misc']['vals'].items() if len(v) > 0}
+        params = space_eval(self.param_space, vals)
+        self._proposed.append((tid[0], params))
+        return params
+
+    def observe(self, score, hyperparams, duration=None):
+        """
+        Records the result of a trial that was proposed by self.propose(). The oldest
+        unobserved proposal with these hyperparameters is completed with the negative
+        score as its loss, so that the next TPE step takes it into account.
+
+        Args:
+            score: the score of the trial
+            hyperparams: a dictionary with the evaluated hyperparameters
+            duration: the time in seconds it took to evaluate the trial. default is None
+
+        Returns:
+            None
+        """
+        self.hyperparam_history.append((score, hyperparams))
+        for idx, (tid, params) in enumerate(self._proposed):
+            if params == hyperparams:
+                del self._proposed[idx]
+                doc = [doc for doc in self._tpe_trials._dynamic_trials if doc['tid'] == tid][0]
+                doc['state'] = JOB_STATE_DONE
+                doc['result'] = {'loss': -score, 'status': STATUS_OK}
+                self._tpe_trials.refresh()
+                break
 
     def fit(self, X_train, y_train, X_test=None, y_test=None, n_iters=10, start_vals=None, n_folds=None):
         """
@@ -45,36 +396,28 @@ class HyperoptOptimizer(Optimizer):
         elif (X_test is not None) and (y_test is not None) and (n_folds is not None):
             raise Exception("Provide either 'X_test' and 'y_test' or 'n_folds'")
 
-        def objective(params):
-            model_params = self.model.get_params()
-            model_params.update(params)
-            if n_folds is not None:
-                splits = self.get_kfold_split(n_folds, X_train)
-                scores = []
-                for train_idxs, test_idxs in splits:
-                    self.model = self.build_new_model(model_params)
-                    self.model.fit(X_train[train_idxs], y_train[train_idxs])
-                    y_pred = self.model.predict(X_train[test_idxs])
-                    scores.append(-self.eval_func(y_train[test_idxs], y_pred))
-                score = np.mean(scores)
-            else:
-                self.model = self.build_new_model(model_params)
-                self.model.fit(X_train, y_train)
-                y_pred = self.model.predict(X_test)
-                score = -self.eval_func(y_test, y_pred)
-            return score
-        
-        self.trials = Trials()
-        best_params = fmin(objective,
-                    self.param_space,
-                    algo=tpe.suggest,
-                    max_evals=n_iters,
-                    trials=self.trials)
+        objective = HyperoptObjective(self, X_train, y_train, X_test, y_test, n_folds)
+        if self.n_jobs > 1:
+            self.trials = LocalProcessTrials(n_jobs=self.n_jobs, db_path=self.trials_db_path)
+        else:
+            self.trials = Trials()
+        try:
+            best_params = fmin(objective,
+                        self.param_space,
+                        algo=tpe.suggest,
+                        max_evals=n_iters,
+                        trials=self.trials,
+                        max_queue_len=self.max_queue_len)
+        finally:
+            if isinstance(self.trials, LocalProcessTrials):
+                self.trials.close()
 
         self.hyperparam_history = []
-        for i, loss in enumerate(self.trials.losses()):
-            param_vals = {k:v[i] for k,v in self.trials.vals.items()}
-            self.hyperparam_history.append((-loss, param_vals))
+        for trial in self.trials.trials:
+            if trial['result'].get('status') != STATUS_OK:
+                continue
+            param_vals = {k:v[0] for k,v in trial['misc']['vals'].items() if len(v) > 0}
+            self.hyperparam_history.append((-trial['result']['loss'], param_vals))
 
         model_params = self.model.get_params()
         model_params.update(best_params)
@@ -0,0 +1,86 @@
+import os
+import warnings
+import traceback
+from multiprocessing import Process, Pipe
+
+try:
+    import resource
+except ImportError:
+    # not available on windows, memory limits are ignored there
+    resource = None
+
+OK = 'ok'
+TIMEOUT = 'timeout'
+MEMORY = 'memory'
+ERROR = 'error'
+CRASHED = 'crashed'
+
+
+def _address_space_size():
+    """
+    Returns the size of the virtual address space of this process in bytes, or 0
+    if it cannot be determined.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        return 0
+
+def _run(connection, func, args, memory_limit):
+    if memory_limit is not None:
+        limit = _address_space_size() + int(memory_limit)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    try:
+        result = (OK, func(*args))
+    except MemoryError:
+        result = (MEMORY, traceback.format_exc())
+    except Exception:
+        result = (ERROR, traceback.format_exc())
+    connection.send(result)
+    connection.close()
+
+
+def run_isolated(func, args=(), timeout=None, memory_limit=None):
+    """
+    Calls func(*args) in a new process that is killed if it exceeds the time or
+    memory limit. The result of func needs to be picklable.
+
+    Args:
+        func: the function to call
+        args: a tuple with the arguments of func
+        timeout: maximum wall-clock time in seconds. default is None which waits indefinitely
+        memory_limit: maximum number of bytes the process may allocate on top of the
+            memory it inherits from its parent. default is None which means no limit
+
+    Returns:
+        status: 'ok', 'timeout', 'memory' (an allocation failed), 'error' (func raised
+            an exception) or 'crashed' (the process died, e.g. it was killed by the system)
+        value: the return value of func if status is 'ok', otherwise a description of the failure
+    """
+    if (memory_limit is not None) and (resource is None):
+        warnings.warn("Memory limits are not supported on this platform and are ignored")
+        memory_limit = None
+    receiver, sender = Pipe(duplex=False)
+    process = Process(target=_run, args=(sender, func, args, memory_limit))
+    process.start()
+    sender.close()
+    try:
+        # poll returns early with an EOF if the process dies
+        if receiver.poll(timeout):
+            try:
+                status, value = receiver.recv()
+            except EOFError:
+                process.join()
+                status, value = CRASHED, 'trial process exited with code {}'.format(process.exitcode)
+        else:
+            status, value = TIMEOUT, 'trial exceeded the time limit of {} seconds'.format(timeout)
+    finally:
+        receiver.close()
+        if process.is_alive():
+            process.terminate()
+            process.join(1.)
+        if process.is_alive():
+            process.kill()
+        process.join()
+    return status, value
@@ -1,5 +1,7 @@
+import gc
 import abc
 from sklearn.base import BaseEstimator
+from optml.pruning import current_reporter
 
 class Model(BaseEstimator):
     def __init__(self):
@@ -9,14 +11,122 @@ class Model(BaseEstimator):
     def get_params(self):
         raise NotImplementedError("You need to implement the 'get_params' function for this model!")
 
+def _reporting_callback(model, reporter):
+    from keras.callbacks import Callback
+
+    class ReportingCallback(Callback):
+        def on_epoch_end(self, epoch, logs=None):
+            reporter.report(epoch + 1, reporter.evaluate(model))
+
+    return ReportingCallback()
+
+def _clear_session():
+    from keras import backend
+    backend.clear_session()
+    gc.collect()
+
+class KerasSession(object):
+    """
+    Keeps the compiled network of the most recent architecture alive across trials.
+    A trial with the same structural parameters as the previous one gets the same
+    network back with its initial weights restored and a freshly compiled optimizer,
+    instead of building new layers. When the architecture changes the old network is
+    dropped and the backend session is cleared, so that the memory held by the
+    backend does not grow with the number of trials.
+
+    Networks are shared: fitting a model with the same architecture resets the
+    weights of the previously fitted one.
+    """
+    def __init__(self):
+        self.key = None
+        self.network = None
+        self.initial_weights = None
+        self.owner = None
+        self.n_builds = 0
+        self.n_reuses = 0
+
+    def acquire(self, model):
+        """
+        Returns a compiled network with initial weights for a KerasModel.
+
+        Args:
+            model: an instance of KerasModel that implements build_model
+
+        Returns:
+            a compiled keras model
+        """
+        key = model.structure_key()
+        if (self.network is not None) and (key == self.key):
+            self.network.set_weights(self.initial_weights)
+            self.n_reuses += 1
+        else:
+            self.release()
+            self.network = model.build_model()
+            self.initial_weights = self.network.get_weights()
+            self.key = key
+            self.n_builds += 1
+        model.compile_model(self.network)
+        self.owner = model
+        return self.network
+
+    def release(self):
+        """
+        Drops the current network and clears the backend session.
+        """
+        if self.network is not None:
+            self.network = None
+            self.initial_weights = None
+            self.key = None
+            self.owner = None
+            _clear_session()
+
+# one session per process
+keras_session = KerasSession()
+
 class KerasModel(Model):
+    """
+    Base class for Keras models. There are two ways to implement a subclass:
+
+    - build and compile the network in __init__ and store it as self.model. Every
+      trial then builds a new network.
+    - only store the parameters in __init__ and implement build_model (returning an
+      uncompiled network) and compile_model. The network is then created when the
+      model is fitted and reused by later trials with the same architecture (see
+      KerasSession). Parameters in training_params (e.g. the number of epochs) do not
+      change the architecture; all other parameters from get_params do.
+
+    While a trial is evaluated with a stopping rule (see
+    Optimizer.set_stopping_rule) fit reports the validation score after every epoch.
+    """
     __model_module__ = 'keras'
+    training_params = ['batch_size', 'epochs', 'train_epochs']
+
     def __init__(self):
-        raise NotImplementedError("You need to implement the initialisation function for this model! " + 
+        raise NotImplementedError("You need to implement the initialisation function for this model! " +
                                   "It should at least specify 'batch_size' and the number of epochs.")
 
+    def build_model(self):
+        raise NotImplementedError("You need to implement 'build_model' or set 'self.model' in __init__!")
+
+    def compile_model(self, model):
+        raise NotImplementedError("You need to implement 'compile_model' to use 'build_model'!")
+
+    def structure_key(self):
+        params = self.get_params()
+        return (type(self).__name__,) + tuple(sorted((name, repr(value)) for name, value in params.items()
+                                                     if name not in self.training_params))
+
     def fit(self, X, y, verbose=0):
+        if getattr(self, '_uses_session', False) or not hasattr(self, 'model'):
+            self._uses_session = True
+            self.model = keras_session.acquire(self)
+        reporter = current_reporter()
+        if reporter is not None:
+            return self.model.fit(X,y, epochs=self.epochs, batch_size=self.batch_size, verbose=verbose,
+                                  callbacks=[_reporting_callback(self, reporter)])
         return self.model.fit(X,y, epochs=self.epochs, batch_size=self.batch_size, verbose=verbose)
 
     def predict(self, X):
+        if getattr(self, '_uses_session', False) and (keras_session.owner is not self):
+            raise RuntimeError("The network of this model has been reset by a later trial. Fit it again.")
         return self.model.predict(X)
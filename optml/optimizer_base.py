@@ -1,8 +1,15 @@
+import time
 import numpy as np
 import abc
 from sklearn.pipeline import Pipeline
 from sklearn.linear_model import LogisticRegression
-from sklearn.model_selection import KFold
+from optml.isolation import run_isolated, OK
+from optml.staged import get_shared_fit, group_by_rounds
+from optml.pipeline_cache import TransformerCache, clone_pipeline, fit_pipeline
+from optml.folds import CrossValidation
+from optml.pruning import TrialPruned, TrialReporter, reporting, average_curves, get_iteration_param, \
+    fit_iteratively
+from optml.validation import SubsampledValidation, score_model
 
 class Optimizer(object):
 
@@ -20,6 +27,19 @@ class Optimizer(object):
         self.eval_func = eval_func
         self.model_module = self.infer_model_type(model)
         self.param_dict = {p.name:p for p in hyperparams}
+        self.trial_timeout = None
+        self.trial_memory_limit = None
+        self.penalty_score = None
+        self.trial_statuses = []
+        self.early_stopping_rounds = None
+        self.pipeline_cache = TransformerCache() if self.model_module == 'pipeline' else None
+        self.stopping_rule = None
+        self.n_reports = 10
+        self.cv_options = {}
+        self.cv = None
+        self.subsampled_validation = None
+        self.validation_history = []
+        self.prediction_chunk_size = None
         
     def infer_model_type(self, model):
         if 'xgboost' in model.__module__.lower():
@@ -34,32 +54,102 @@ class Optimizer(object):
             raise NotImplementedError("{} not implemented for module '{}'".format(
                     str(type(self))[:-2].split('.')[-1], model.__module__))
 
-    def get_kfold_split(self, n_folds, X):
+    def set_cross_validation(self, strategy='kfold', shuffle=False, random_state=None, groups=None,
+                             cache=None, max_cache_bytes=1024 ** 3, cache_dir=None):
+        """
+        Sets how the training data is split when an optimizer is fitted with n_folds
+        (see optml.folds.CrossValidation). The folds are computed once per dataset
+        and reused by all trials.
+
+        Args:
+            strategy: 'kfold', 'stratified', 'group' or 'timeseries'. default is 'kfold'
+            shuffle: shuffle the rows before splitting. default is False
+            random_state: seed for shuffling. default is None
+            groups: an array with the group of each row, required for 'group'
+            cache: None, 'memory' or 'mmap' to keep contiguous copies of the fold
+                matrices. default is None
+            max_cache_bytes: maximum size of the cached fold matrices. default is 1 GB
+            cache_dir: directory for memory-mapped folds. default is None which uses a
+                temporary directory
+
+        Returns:
+            None
+        """
+        self.cv_options = {'strategy': strategy, 'shuffle': shuffle, 'random_state': random_state,
+                           'groups': groups, 'cache': cache, 'max_cache_bytes': max_cache_bytes,
+                           'cache_dir': cache_dir}
+        if self.cv is not None:
+            self.cv.clear()
+        self.cv = None
+
+    def get_cross_validation(self, n_folds):
+        """
+        Returns the CrossValidation instance for n_folds folds, creating it on first use.
+        """
+        if (self.cv is None) or (self.cv.n_folds != n_folds):
+            if self.cv is not None:
+                self.cv.clear()
+            self.cv = CrossValidation(n_folds, **self.cv_options)
+        return self.cv
+
+    def get_kfold_split(self, n_folds, X, y=None):
         """
         Splits X into n_folds folds
 
         Args:
             n_folds: integer specifying number of folds
             X: data to be split
+            y: the target variable, required for stratified folds
 
         Returns:
-            a generator with tuples of form (train_idxs, test_idxs)
+            a list with tuples of form (train_idxs, test_idxs)
         """
-        kf = KFold(n_splits=n_folds)
-        return kf.split(X)
+        return self.get_cross_validation(n_folds).split(X, y)
 
 
     @abc.abstractmethod
     def get_next_hyperparameters(self):
         raise NotImplementedError("This class needs a get_next_hyperparameters(...) function")
 
+    def propose(self):
+        """
+        Returns the next hyperparameters to evaluate given the results in
+        self.hyperparam_history. Used to drive an optimizer from outside of its
+        fit method, e.g. by optml.distributed.Coordinator.
+
+        Args:
+            None
+
+        Returns:
+            a dictionary with parameter names as keys and parameter values as values
+        """
+        hyperparams = self.get_next_hyperparameters()
+        if hyperparams is None:
+            raise NotImplementedError("{} does not support proposing single trials".format(
+                    type(self).__name__))
+        return hyperparams
+
+    def observe(self, score, hyperparams, duration=None):
+        """
+        Records the result of a trial that was proposed by self.propose().
+
+        Args:
+            score: the score of the trial
+            hyperparams: a dictionary with the evaluated hyperparameters
+            duration: the time in seconds it took to evaluate the trial. default is None
+
+        Returns:
+            None
+        """
+        self.hyperparam_history.append((score, hyperparams))
+
     @abc.abstractmethod
     def fit(self, X, y, params):
         raise NotImplementedError("This class needs a self.fit(X, y, params) function")
 
     def build_new_model(self, new_hyperparams):
         if self.model_module == 'pipeline':
-                new_model = self.model.set_params(**new_hyperparams)
+            new_model = clone_pipeline(self.model, new_hyperparams)
         elif (self.model_module == 'sklearn') or (self.model_module == 'xgboost'):
             new_model = self.model.__class__(**new_hyperparams)
         elif self.model_module == 'statsmodels':
@@ -73,6 +163,330 @@ class Optimizer(object):
                     str(type(self))[:-2].split('.')[-1], self.model_module))
         return new_model
 
+    def fit_new_model(self, new_hyperparams, X_train, y_train):
+        """
+        Builds a new model with the given hyperparameters and fits it. Pipelines
+        reuse fitted upstream transformers from self.pipeline_cache.
+
+        Args:
+            new_hyperparams: a dictionary with all parameters of the new model
+            X_train: a numpy array with training data. each row corresponds to a data point
+            y_train: a numpy array containing the target variable for the training data
+
+        Returns:
+            the fitted model
+        """
+        new_model = self.build_new_model(new_hyperparams)
+        if (self.model_module == 'pipeline') and (self.pipeline_cache is not None):
+            return fit_pipeline(new_model, X_train, y_train, self.pipeline_cache)
+        new_model.fit(X_train, y_train)
+        return new_model
+
+    def set_pipeline_cache(self, max_bytes=256 * 1024 ** 2, max_entries=None):
+        """
+        Sets the size of the cache of fitted pipeline transformers (see
+        optml.pipeline_cache). Only used if the model is a Pipeline.
+
+        Args:
+            max_bytes: maximum summed size of the cached transformer outputs, or None
+                to disable the cache. default is 256 MB
+            max_entries: maximum number of cached transformers. default is None
+
+        Returns:
+            None
+        """
+        if max_bytes is None:
+            self.pipeline_cache = None
+        else:
+            self.pipeline_cache = TransformerCache(max_bytes, max_entries)
+
+    def set_stopping_rule(self, rule, n_reports=10):
+        """
+        Ends trials early whose learning curve is dominated by earlier trials (see
+        optml.pruning). Models report their validation score during training:
+        KerasModel after every epoch, boosted and bagged models with warm_start and
+        xgboost models after each of n_reports chunks of rounds, custom models by
+        calling optml.pruning.report. A stopped trial is scored with its last
+        reported value. With cross-validation a trial adds the average curve of its
+        folds to the rule, and once a fold is stopped the remaining folds are
+        skipped and the trial is scored with the mean of the evaluated folds. The
+        rule keeps the curves of the trials evaluated in the current process, so
+        trials that run in worker processes or with trial limits do not contribute
+        to it.
+
+        Args:
+            rule: a stopping rule such as optml.pruning.MedianStoppingRule, or None
+                to evaluate every trial to the end
+            n_reports: number of chunks in which iterative scikit-learn and xgboost
+                models are trained. default is 10
+
+        Returns:
+            None
+        """
+        self.stopping_rule = rule
+        self.n_reports = n_reports
+
+    def set_subsampled_validation(self, subsample_size=10000, n_bootstrap=100, confidence=0.95,
+                                  random_state=None):
+        """
+        Scores trained models on a random subsample of the validation data first and
+        on the full validation data only if the upper end of a bootstrap confidence
+        interval of the subsample score reaches the best full score so far (see
+        optml.validation). With n_folds either all folds of a trial are scored in
+        full or none, depending on the mean of their intervals. For every trial
+        evaluated in the current process a dictionary with the keys 'params',
+        'score', 'subsample_score', 'full_score' and 'folds' is appended to
+        self.validation_history; with several folds the scores are fold means and
+        'full_score' is None unless every fold was scored in full.
+
+        Args:
+            subsample_size: number of validation rows in the subsample, or None to
+                always score on the full validation data. default is 10000
+            n_bootstrap: number of bootstrap resamples. default is 100
+            confidence: confidence level of the interval. default is 0.95
+            random_state: seed for the subsample and the bootstrap. default is None
+
+        Returns:
+            None
+        """
+        if subsample_size is None:
+            self.subsampled_validation = None
+        else:
+            self.subsampled_validation = SubsampledValidation(subsample_size, n_bootstrap, confidence,
+                                                              random_state)
+
+    def set_chunked_prediction(self, chunk_size=10000):
+        """
+        Lets trained models predict the validation data chunk_size rows at a time
+        (see optml.validation.score_model). If eval_func is an
+        optml.validation.StreamingMetric the score is accumulated chunk by chunk,
+        so that memory does not grow with the size of the validation set; other
+        evaluation functions receive the concatenated predictions.
+
+        Args:
+            chunk_size: number of rows per prediction, or None to predict all rows
+                at once. default is 10000
+
+        Returns:
+            None
+        """
+        self.prediction_chunk_size = chunk_size
+
+    def set_trial_limits(self, timeout=None, memory_limit=None, penalty_score=None):
+        """
+        Limits the resources of each trial evaluated by self.evaluate_hyperparams. With
+        a limit set every trial runs in its own process that is killed when it exceeds
+        the limit. Failed trials are scored with penalty_score so that the optimizer
+        continues and learns to avoid the region.
+
+        Args:
+            timeout: maximum wall-clock time of a trial in seconds. default is None
+            memory_limit: maximum number of bytes a trial may allocate. default is None
+            penalty_score: score of failed trials. default is None which uses the lowest
+                score in self.hyperparam_history (or 0 if there is none)
+
+        Returns:
+            None
+        """
+        self.trial_timeout = timeout
+        self.trial_memory_limit = memory_limit
+        self.penalty_score = penalty_score
+
+    @property
+    def isolates_trials(self):
+        return (self.trial_timeout is not None) or (self.trial_memory_limit is not None)
+
+    def get_penalty_score(self):
+        if self.penalty_score is not None:
+            return self.penalty_score
+        scores = [score for score, params in self.hyperparam_history if np.isfinite(score)]
+        return min(scores) if len(scores) > 0 else 0.
+
+    def evaluate_hyperparams(self, hyperparams, X_train, y_train, X_test=None, y_test=None, n_folds=None):
+        """
+        Trains a new model with the given hyperparameters and scores it. If n_folds
+        is given the score is the mean over a k-fold cross-validation on the
+        training data, otherwise the model is scored on X_test (or X_train if no
+        validation data is given).
+
+        If trial limits are set (see set_trial_limits) the model is trained in a
+        separate process. The outcome of each such trial is appended to
+        self.trial_statuses as a dictionary with the keys 'params', 'status',
+        'duration' and 'error', and failed trials return the penalty score.
+
+        Args:
+            hyperparams: a dictionary with parameter names as keys and parameter values as values
+            X_train: a numpy array with training data. each row corresponds to a data point
+            y_train: a numpy array containing the target variable for the training data
+            X_test: a numpy array with validation data. each row corresponds to a data point
+            y_test: a numpy array containing the target variable for the validation data
+            n_folds: number of folds for cross-validation. default is None
+
+        Returns:
+            a float with the score of the model
+        """
+        if not self.isolates_trials:
+            return self._evaluate_hyperparams(hyperparams, X_train, y_train, X_test, y_test, n_folds)
+        start = time.time()
+        status, value = run_isolated(self._evaluate_hyperparams,
+                                     (hyperparams, X_train, y_train, X_test, y_test, n_folds),
+                                     timeout=self.trial_timeout, memory_limit=self.trial_memory_limit)
+        self.trial_statuses.append({'params': hyperparams, 'status': status,
+                                    'duration': time.time() - start,
+                                    'error': None if status == OK else value})
+        if status == OK:
+            return value
+        return self.get_penalty_score()
+
+    def _evaluate_hyperparams(self, hyperparams, X_train, y_train, X_test=None, y_test=None, n_folds=None):
+        model_params = self._merge_params(hyperparams)
+        records = []
+        if n_folds is not None:
+            scores = []
+            # with a stopping rule the folds of a trial add a single, averaged curve
+            curves = None if self.stopping_rule is None else []
+            try:
+                for fold_idx, fold in enumerate(self.get_cross_validation(n_folds).folds(X_train, y_train)):
+                    scores.append(self._fit_and_score(model_params, *fold, fold_idx=fold_idx, records=records,
+                                                      curves=curves))
+            except TrialPruned as pruned:
+                # the remaining folds of a stopped trial are skipped
+                scores.append(pruned.value)
+            else:
+                if curves and all(len(curve) > 0 for curve in curves):
+                    self.stopping_rule.complete(average_curves(curves))
+            score = np.mean(scores)
+        else:
+            if (X_test is None) or (y_test is None):
+                X_test = X_train
+                y_test = y_train
+            score = self._fit_and_score(model_params, X_train, y_train, X_test, y_test, records=records)
+        if self.subsampled_validation is not None:
+            if len(records) == (n_folds or 1):
+                # all folds of the trial are escalated to the full validation data, or none
+                score = self.subsampled_validation.escalate(records, self.eval_func, self.prediction_chunk_size)
+            else:
+                # a stopped trial keeps its scores
+                for record in records:
+                    record.pop('_pending', None)
+            self.validation_history.append({'params': hyperparams, 'score': score,
+                                            'subsample_score': _mean_of(records, 'subsample_score'),
+                                            'full_score': _mean_of(records, 'full_score'),
+                                            'folds': records})
+        return score
+
+    def _score_model(self, model, X_test, y_test, fold_idx=0, records=None):
+        if self.subsampled_validation is None:
+            return score_model(model, X_test, y_test, self.eval_func, self.prediction_chunk_size)
+        record = self.subsampled_validation.score_subsample(model, X_test, y_test, self.eval_func, fold_idx,
+                                                            self.prediction_chunk_size)
+        if records is None:
+            return self.subsampled_validation.escalate([record], self.eval_func, self.prediction_chunk_size)
+        records.append(record)
+        return record['score']
+
+    def _fit_and_score(self, model_params, X_train, y_train, X_test, y_test, fold_idx=0, records=None,
+                       curves=None):
+        """
+        Trains and scores a model on one split of the data. With a stopping rule the
+        learning curve is added to the rule, or to curves if it is a list (used for
+        the folds of a cross-validation, which then also re-raise TrialPruned).
+        """
+        if self.stopping_rule is None:
+            new_model = self.fit_new_model(model_params, X_train, y_train)
+            return self._score_model(new_model, X_test, y_test, fold_idx, records)
+        reporter = TrialReporter(self.stopping_rule, X_test, y_test, self.eval_func, self.prediction_chunk_size)
+        try:
+            with reporting(reporter, complete=curves is None):
+                if get_iteration_param(self.model, self.model_module) is not None:
+                    new_model = fit_iteratively(self.build_new_model(model_params), self.model_module,
+                                                X_train, y_train, reporter, self.n_reports)
+                else:
+                    new_model = self.fit_new_model(model_params, X_train, y_train)
+                score = self._score_model(new_model, X_test, y_test, fold_idx, records)
+        except TrialPruned as pruned:
+            if curves is not None:
+                raise
+            return pruned.value
+        if curves is not None:
+            curves.append(reporter.curve)
+        return score
+
+    def set_early_stopping(self, rounds):
+        """
+        Lets boosted models (xgboost and scikit-learn models with staged_predict) in
+        evaluate_hyperparams_batch stop once the validation score has not improved
+        for the given number of rounds. A trial then uses the smaller of its own
+        number of rounds and the best round before stopping. scikit-learn models
+        are still trained with all rounds, the stopping round is found with their
+        staged predictions on the validation data.
+
+        Args:
+            rounds: number of rounds without improvement, or None to disable early stopping
+
+        Returns:
+            None
+        """
+        self.early_stopping_rounds = rounds
+
+    def _merge_params(self, hyperparams):
+        if self.model_module == 'pipeline':
+            return dict(hyperparams)
+        model_params = self.model.get_params()
+        model_params.update(hyperparams)
+        return model_params
+
+    def evaluate_hyperparams_batch(self, hyperparams_list, X_train, y_train, X_test=None, y_test=None,
+                                   n_folds=None):
+        """
+        Scores a list of hyperparameters like evaluate_hyperparams. For boosted models
+        trials that only differ in the number of boosting rounds share a single fit
+        with the largest number of rounds; the smaller numbers of rounds are scored
+        with staged predictions of the same model. For estimators that support warm
+        starts (see optml.warm_start) trials that only differ in the path parameter
+        are fitted one after another with the same estimator. With a stopping rule
+        or subsampled validation every trial is evaluated on its own.
+
+        Args:
+            hyperparams_list: a list of dictionaries with hyperparameters
+            X_train: a numpy array with training data. each row corresponds to a data point
+            y_train: a numpy array containing the target variable for the training data
+            X_test: a numpy array with validation data. each row corresponds to a data point
+            y_test: a numpy array containing the target variable for the validation data
+            n_folds: number of folds for cross-validation. default is None
+
+        Returns:
+            a list of floats with the scores in the same order as hyperparams_list
+        """
+        shared_param, score_group = get_shared_fit(self.model, self.model_module)
+        if (shared_param is None) or self.isolates_trials or (self.stopping_rule is not None) or \
+                (self.subsampled_validation is not None):
+            return [self.evaluate_hyperparams(hyperparams, X_train, y_train, X_test, y_test, n_folds)
+                    for hyperparams in hyperparams_list]
+        if (X_test is None) or (y_test is None):
+            X_test = X_train
+            y_test = y_train
+        if n_folds is not None:
+            splits = list(self.get_cross_validation(n_folds).folds(X_train, y_train))
+        else:
+            splits = [(X_train, y_train, X_test, y_test)]
+        scores = [None] * len(hyperparams_list)
+        for group in group_by_rounds(hyperparams_list, shared_param):
+            if (len(group) == 1) and (self.early_stopping_rounds is None):
+                scores[group[0]] = self.evaluate_hyperparams(hyperparams_list[group[0]], X_train, y_train,
+                                                             X_test, y_test, n_folds)
+                continue
+            model_params = self._merge_params(hyperparams_list[group[0]])
+            values = [hyperparams_list[idx].get(shared_param, model_params[shared_param]) for idx in group]
+            fold_scores = [score_group(self.model, self.model_module, model_params, shared_param, values,
+                                       self.eval_func, *split,
+                                       early_stopping_rounds=self.early_stopping_rounds,
+                                       chunk_size=self.prediction_chunk_size)
+                           for split in splits]
+            for idx, score in zip(group, np.mean(fold_scores, axis=0)):
+                scores[idx] = score
+        return scores
+
     def get_best_params_and_model(self):
         """
         Returns the best parameters and model after optimization.
@@ -82,13 +496,20 @@ class Optimizer(object):
         best_params_idx = np.argmax([score for score, params in self.hyperparam_history])
         best_params = self.hyperparam_history[best_params_idx][1]
         if isinstance(self.model, Pipeline):
-            all_params = self.model.get_params()
-            all_params.update(best_params)
-            best_model = self.model.set_params(**all_params)
+            best_model = clone_pipeline(self.model, best_params)
         else:
             best_model = self.model.__class__(**dict(self.model.get_params(), **best_params))
         return best_params, best_model
 
+def _mean_of(records, key):
+    """
+    Returns the mean of a score over the folds of a trial, or None if a fold lacks it.
+    """
+    values = [record[key] for record in records]
+    if (len(values) == 0) or any(value is None for value in values):
+        return None
+    return np.mean(values)
+
 class MissingValueException(Exception):
     pass
 
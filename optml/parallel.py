@@ -0,0 +1,98 @@
+import numpy as np
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from optml.staged import get_shared_fit, group_by_rounds
+from optml.data import share, unshare
+
+# state of a worker process, set once by _init_worker so that the optimizer and the
+# data are only sent to each worker once instead of with every trial
+_worker_state = {}
+
+def _init_worker(optimizer, data):
+    _worker_state['optimizer'] = optimizer
+    _worker_state['data'] = unshare(data)
+
+def _evaluate_group(hyperparams_list):
+    X_train, y_train, X_test, y_test, n_folds = _worker_state['data']
+    return _worker_state['optimizer'].evaluate_hyperparams_batch(hyperparams_list, X_train, y_train,
+                                                                 X_test, y_test, n_folds)
+
+
+class TrialPool(object):
+    """
+    Evaluates batches of hyperparameters with Optimizer.evaluate_hyperparams_batch. With
+    n_jobs=1 trials are evaluated in the current process, otherwise on a pool of
+    worker processes that is kept alive between batches. If the optimizer runs each
+    trial in its own process (see Optimizer.set_trial_limits) a pool of threads
+    waits for these processes instead, since pool processes cannot start processes
+    of their own.
+
+    Args:
+        optimizer: an instance of optml.optimizer_base.Optimizer
+        X_train: a numpy array with training data. each row corresponds to a data point
+        y_train: a numpy array containing the target variable for the training data
+        X_test: a numpy array with validation data. each row corresponds to a data point
+        y_test: a numpy array containing the target variable for the validation data
+        n_folds: number of folds for cross-validation. default is None
+        n_jobs: number of worker processes. default is 1
+    """
+    def __init__(self, optimizer, X_train, y_train, X_test=None, y_test=None, n_folds=None, n_jobs=1):
+        self.optimizer = optimizer
+        self.data = (X_train, y_train, X_test, y_test, n_folds)
+        self.n_jobs = n_jobs
+        self.pool = None
+        if (n_jobs > 1) and (n_folds is not None):
+            # the workers receive the fold indices (and memory-mapped folds) with the optimizer
+            optimizer.get_cross_validation(n_folds).materialize(X_train, y_train)
+        if (n_jobs > 1) and optimizer.isolates_trials:
+            self.pool = ThreadPool(processes=n_jobs, initializer=_init_worker,
+                                   initargs=(optimizer, share(self.data)))
+        elif n_jobs > 1:
+            self.pool = Pool(processes=n_jobs, initializer=_init_worker,
+                             initargs=(optimizer, share(self.data)))
+
+    def map(self, hyperparams_list):
+        """
+        Evaluates a list of hyperparameter dictionaries.
+
+        Args:
+            hyperparams_list: a list of dictionaries with parameter names as keys and
+                parameter values as values
+
+        Returns:
+            a list of floats with the scores in the same order as hyperparams_list
+        """
+        X_train, y_train, X_test, y_test, n_folds = self.data
+        if self.pool is None:
+            return self.optimizer.evaluate_hyperparams_batch(hyperparams_list, X_train, y_train,
+                                                             X_test, y_test, n_folds)
+        # trials that can share fits (boosting rounds, warm-start paths) go to the same worker
+        shared_param, _ = get_shared_fit(self.optimizer.model, self.optimizer.model_module)
+        if shared_param is None:
+            groups = [[idx] for idx in range(len(hyperparams_list))]
+        else:
+            groups = group_by_rounds(hyperparams_list, shared_param)
+        chunksize = max(1, int(np.ceil(len(groups) / (4. * self.n_jobs))))
+        group_scores = self.pool.map(_evaluate_group, [[hyperparams_list[idx] for idx in group] for group in groups],
+                                     chunksize=chunksize)
+        scores = [None] * len(hyperparams_list)
+        for group, group_score in zip(groups, group_scores):
+            for idx, score in zip(group, group_score):
+                scores[idx] = score
+        return scores
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None and self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+        self.close()
+        return False
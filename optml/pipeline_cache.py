@@ -0,0 +1,129 @@
+"""
+Caching the fitted transformers of scikit-learn pipelines across trials.
+
+When only the parameters of downstream steps are tuned, every trial would refit the
+same upstream transformers (TF-IDF, PCA, scalers) on the same data. fit_pipeline
+looks up each transformer by its position, the parameters of all steps up to and
+including it and a fingerprint of the training data, so only the steps from the
+first changed parameter onwards are fitted again.
+"""
+import joblib
+from collections import OrderedDict
+from sklearn.base import clone
+from optml.data import nbytes
+
+
+class TransformerCache(object):
+    """
+    A least recently used cache of fitted transformers and their outputs on the
+    training data. Entries are evicted once the outputs take up more than
+    max_bytes or there are more than max_entries of them. The cache is process
+    local: pickled copies (e.g. for worker processes) start out empty.
+
+    Args:
+        max_bytes: maximum summed size of the cached outputs. default is 256 MB
+        max_entries: maximum number of cached transformers. default is None
+    """
+    def __init__(self, max_bytes=256 * 1024 ** 2, max_entries=None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getstate__(self):
+        return {'max_bytes': self.max_bytes, 'max_entries': self.max_entries}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def get(self, key):
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key][0]
+
+    def put(self, key, value, n_bytes):
+        if n_bytes > self.max_bytes:
+            return
+        if key in self.entries:
+            self.n_bytes -= self.entries.pop(key)[1]
+        self.entries[key] = (value, n_bytes)
+        self.n_bytes += n_bytes
+        while (self.n_bytes > self.max_bytes) or \
+                ((self.max_entries is not None) and (len(self.entries) > self.max_entries)):
+            _, (_, evicted_bytes) = self.entries.popitem(last=False)
+            self.n_bytes -= evicted_bytes
+
+    def clear(self):
+        self.entries.clear()
+        self.n_bytes = 0
+
+
+def _is_passthrough(step):
+    return (step is None) or (isinstance(step, str) and (step == 'passthrough'))
+
+
+def clone_pipeline(pipeline, params):
+    """
+    Returns an unfitted copy of a pipeline with the given parameters, leaving the
+    original pipeline untouched. Parameters that are identical to those of the
+    original (e.g. its steps, when params comes from pipeline.get_params()) are
+    skipped so that the copy does not share step instances with the original.
+
+    Args:
+        pipeline: a sklearn.pipeline.Pipeline
+        params: a dictionary with (nested) parameter names as keys
+
+    Returns:
+        a new Pipeline
+    """
+    current = pipeline.get_params()
+    changed = dict((name, value) for name, value in params.items()
+                   if not ((name in current) and (current[name] is value)))
+    return clone(pipeline).set_params(**changed)
+
+
+def fit_pipeline(pipeline, X, y, cache):
+    """
+    Fits an unfitted pipeline, taking fitted transformers from the cache where the
+    same prefix of the pipeline has been fitted on the same data before. The
+    pipeline's steps are replaced by the cached transformers, which are shared
+    between pipelines and must not be refitted.
+
+    Args:
+        pipeline: an unfitted sklearn.pipeline.Pipeline, e.g. from clone_pipeline
+        X: the training data
+        y: the target variable for the training data
+        cache: a TransformerCache
+
+    Returns:
+        the fitted pipeline
+    """
+    data_key = joblib.hash((X, y))
+    steps = pipeline.steps
+    # the keys are computed before any step is replaced by a fitted transformer
+    prefix_keys = [joblib.hash(steps[:idx + 1]) for idx in range(len(steps) - 1)]
+    Xt = X
+    for idx in range(len(steps) - 1):
+        name, transformer = steps[idx]
+        if _is_passthrough(transformer):
+            continue
+        key = (idx, prefix_keys[idx], data_key)
+        cached = cache.get(key)
+        if cached is None:
+            Xt = transformer.fit_transform(Xt, y)
+            cache.put(key, (transformer, Xt), nbytes(Xt))
+        else:
+            transformer, Xt = cached
+        steps[idx] = (name, transformer)
+    final_estimator = steps[-1][1]
+    if not _is_passthrough(final_estimator):
+        final_estimator.fit(Xt, y)
+    return pipeline
@@ -0,0 +1,226 @@
+"""
+Reporting learning curves during training and stopping unpromising trials early.
+
+While a trial is evaluated with a stopping rule (see Optimizer.set_stopping_rule)
+the model reports its validation score after every epoch or every few boosting
+rounds through report(step, value). Once the partial learning curve is dominated by
+the curves of earlier trials, report raises TrialPruned and the trial ends with the
+last reported score.
+
+KerasModel reports after every epoch. Boosted and bagged scikit-learn models with
+warm_start and xgboost models are trained in chunks of rounds (fit_iteratively).
+Custom models can call report themselves.
+"""
+import threading
+import numpy as np
+from optml.staged import get_round_param
+from optml.warm_start import get_warm_start_path
+from optml.validation import score_model
+
+_local = threading.local()
+
+
+class TrialPruned(Exception):
+    """
+    Raised by report when the stopping rule ends a trial.
+
+    Args:
+        step: the step at which the trial was stopped
+        value: the last reported value
+    """
+    def __init__(self, step, value):
+        super(TrialPruned, self).__init__("trial stopped at step {} with value {}".format(step, value))
+        self.step = step
+        self.value = value
+
+
+class MedianStoppingRule(object):
+    """ Median stopping rule
+    Stops a trial at step s if the best value it has reported so far is worse than
+    the median of the running averages of all completed learning curves up to step s
+    (see 'Google Vizier: A Service for Black-Box Optimization' by Golovin et al.).
+    Values are maximized, like the scores of the optimizers.
+
+    Args:
+        n_startup_trials: number of completed trials before any trial is stopped. default is 5
+        min_steps: number of reports of a trial before it can be stopped. default is 1
+    """
+    def __init__(self, n_startup_trials=5, min_steps=1):
+        self.n_startup_trials = n_startup_trials
+        self.min_steps = min_steps
+        self.curves = []
+        self.n_pruned = 0
+
+    def should_stop(self, curve):
+        """
+        Args:
+            curve: a list of tuples (step, value) reported by the current trial
+
+        Returns:
+            True if the trial should be stopped
+        """
+        if (len(self.curves) < self.n_startup_trials) or (len(curve) < self.min_steps):
+            return False
+        step = curve[-1][0]
+        averages = [np.mean([v for s, v in completed if s <= step]) for completed in self.curves
+                    if (len(completed) > 0) and (completed[0][0] <= step)]
+        if len(averages) == 0:
+            return False
+        return max(v for s, v in curve) < np.median(averages)
+
+    def complete(self, curve):
+        """
+        Adds the learning curve of a trial that ran to completion.
+        """
+        self.curves.append(list(curve))
+
+
+class TrialReporter(object):
+    """
+    Collects the learning curve of one trial and asks the stopping rule whether
+    to continue.
+
+    Args:
+        rule: a stopping rule such as MedianStoppingRule
+        X_val: a numpy array with the validation data of the trial
+        y_val: a numpy array containing the target variable for the validation data
+        eval_func: scoring function. Takes input (y_true, y_predicted)
+        chunk_size: number of rows per prediction (see optml.validation.score_model). default is None
+    """
+    def __init__(self, rule, X_val, y_val, eval_func, chunk_size=None):
+        self.rule = rule
+        self.X_val = X_val
+        self.y_val = y_val
+        self.eval_func = eval_func
+        self.chunk_size = chunk_size
+        self.curve = []
+
+    def evaluate(self, model):
+        """
+        Scores a partially trained model on the validation data.
+        """
+        return score_model(model, self.X_val, self.y_val, self.eval_func, self.chunk_size)
+
+    def report(self, step, value):
+        self.curve.append((step, value))
+        if self.rule.should_stop(self.curve):
+            self.rule.n_pruned += 1
+            raise TrialPruned(step, value)
+
+
+def current_reporter():
+    """
+    Returns the TrialReporter of the trial that is evaluated in this thread, or None.
+    """
+    return getattr(_local, 'reporter', None)
+
+
+def report(step, value):
+    """
+    Reports an intermediate score of the current trial. Does nothing outside of a
+    trial that is evaluated with a stopping rule.
+
+    Args:
+        step: the epoch or number of rounds
+        value: the validation score after step, where higher is better
+
+    Raises:
+        TrialPruned: if the stopping rule ends the trial
+    """
+    reporter = current_reporter()
+    if reporter is not None:
+        reporter.report(step, value)
+
+
+class reporting(object):
+    """
+    Context manager that makes reporter the current reporter of this thread. If
+    the block finishes without being pruned and complete is True the curve is
+    added to the rule.
+    """
+    def __init__(self, reporter, complete=True):
+        self.reporter = reporter
+        self.complete = complete
+
+    def __enter__(self):
+        self.previous = current_reporter()
+        _local.reporter = self.reporter
+        return self.reporter
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.reporter = self.previous
+        if self.complete and (exc_type is None) and (len(self.reporter.curve) > 0):
+            self.reporter.rule.complete(self.reporter.curve)
+        return False
+
+
+def average_curves(curves):
+    """
+    Averages the learning curves of the cross-validation folds of a trial step by
+    step. Curves of different lengths are cut to the shortest one.
+
+    Args:
+        curves: a list of learning curves, i.e. lists of tuples (step, value)
+
+    Returns:
+        a list of tuples (step, mean value)
+    """
+    length = min(len(curve) for curve in curves)
+    return [(curves[0][i][0], np.mean([curve[i][1] for curve in curves])) for i in range(length)]
+
+
+def get_iteration_param(model, model_module):
+    """
+    Returns the parameter with the number of rounds if the model can be trained in
+    chunks of rounds, or None.
+    """
+    if model_module == 'xgboost':
+        return 'n_estimators'
+    if (model_module != 'sklearn') or ('warm_start' not in model.get_params()):
+        return None
+    round_param = get_round_param(model, model_module)
+    if round_param is not None:
+        return round_param
+    path = get_warm_start_path(model, model_module)
+    if (path is not None) and (path[0] == 'n_estimators'):
+        return 'n_estimators'
+    return None
+
+
+def fit_iteratively(model, model_module, X, y, reporter, n_reports=10):
+    """
+    Trains an unfitted model in n_reports chunks of rounds and reports the
+    validation score after each chunk. scikit-learn models continue with
+    warm_start, xgboost models continue training their booster.
+
+    Args:
+        model: an unfitted model for which get_iteration_param is not None
+        model_module: 'sklearn' or 'xgboost'
+        X: a numpy array with training data
+        y: a numpy array containing the target variable for the training data
+        reporter: a TrialReporter
+        n_reports: number of chunks. default is 10
+
+    Returns:
+        the fitted model
+    """
+    param = get_iteration_param(model, model_module)
+    n_rounds = int(model.get_params()[param])
+    # with fewer rounds than reports every round is reported once
+    steps = np.unique(np.maximum(1, np.linspace(0, n_rounds, n_reports + 1).astype(int)[1:]))
+    if model_module == 'xgboost':
+        booster = None
+        done = 0
+        for step in steps:
+            chunk = model.__class__(**dict(model.get_params(), n_estimators=int(step - done)))
+            chunk.fit(X, y, xgb_model=booster)
+            booster = chunk.get_booster()
+            done = step
+            reporter.report(int(step), reporter.evaluate(chunk))
+        return chunk
+    model.set_params(warm_start=True)
+    for step in steps:
+        model.set_params(**{param: int(step)})
+        model.fit(X, y)
+        reporter.report(int(step), reporter.evaluate(model))
+    return model
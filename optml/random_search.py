@@ -1,4 +1,3 @@
-import numpy as np
 from optml.optimizer_base import Optimizer, MissingValueException
 from .models import Model
 
@@ -13,40 +12,31 @@ class RandomSearchOptimizer(Optimizer):
         return new_hyperparams
 
     def fit(self, X_train, y_train, X_test=None, y_test=None, n_iters=10, n_folds=None):
-        # get the hyperparameters of the base model
-        if (X_test is None) and (y_test is None):
-            X_test = X_train
-            y_test = y_train
-        elif (X_test is None) or (y_test is None):
+        """
+        Samples n_iters random hyperparameter configurations and scores them. Since
+        the samples do not depend on earlier scores they are evaluated as one batch
+        with evaluate_hyperparams_batch, so that trials can share fits.
+
+        Args:
+            X_train: a numpy array with training data. each row corresponds to a data point
+            y_train: a numpy array containing the target variable for the training data
+            X_test: a numpy array with validation data. each row corresponds to a data point
+            y_test: a numpy array containing the target variable for the validation data
+            n_iters: number of random samples. default is 10.
+            n_folds: number of folds for cross-validation. default is None
+
+        Returns:
+            best_params: a dictionary with optimized hyperparameters
+            best_model: an untrained model with the optimized hyperparameters
+        """
+        if (X_test is None) != (y_test is None):
             raise MissingValueException("Need to provide 'X_test' and 'y_test'")
-        elif (X_test is not None) and (y_test is not None) and (n_folds is not None):
+        elif (X_test is not None) and (n_folds is not None):
             raise Exception("Provide either 'X_test' and 'y_test' or 'n_folds'")
 
-        hyperparams = self.model.get_params()
-        # and update them with the new hyperparameters
-        for i in range(n_iters):
-            new_hyperparams = self.get_next_hyperparameters()
-            hyperparams.update(new_hyperparams)
-            if self.model_module == 'statsmodels':                
-                hyperparams.update({'endog': X_train})
-
-            new_model = self.build_new_model(hyperparams)
-            if n_folds is not None:
-                splits = self.get_kfold_split(n_folds, X_train)
-                scores = []
-                for train_idxs, test_idxs in splits:
-                    new_model.fit(X_train[train_idxs], y_train[train_idxs])
-                    scores.append(self.eval_func(y_train[test_idxs], new_model.predict(X_train[test_idxs])))
-                score = np.mean(scores)
-                del scores
-            else:
-                new_model.fit(X_train, y_train)                        
-                score = self.eval_func(y_test, new_model.predict(X_train))
-            self.hyperparam_history.append((score, new_hyperparams))
-        best_params_idx = np.argmax([score for score, params in self.hyperparam_history])
-
-        #best_params = self.hyperparam_history[best_params_idx][1]        
-        #best_model = self.model.__class__(**dict(self.model.get_params(), **best_params))
+        hyperparams_list = [self.get_next_hyperparameters() for i in range(n_iters)]
+        scores = self.evaluate_hyperparams_batch(hyperparams_list, X_train, y_train, X_test, y_test, n_folds)
+        self.hyperparam_history += list(zip(scores, hyperparams_list))
         best_params, best_model = self.get_best_params_and_model()
         return best_params, best_model
 
@@ -0,0 +1,196 @@
+"""
+Scoring several boosting round counts from a single fit.
+
+Boosted ensembles can predict with only their first k rounds after being trained
+with n rounds (staged_predict in scikit-learn, iteration_range in xgboost). Trials
+that only differ in the number of rounds can therefore share one fit at the
+largest number of rounds. get_shared_fit also covers estimators that are
+warm-started along a path (see optml.warm_start).
+"""
+from optml.warm_start import get_warm_start_path, warm_start_scores
+from optml.validation import score_predictions
+
+
+def get_round_param(model, model_module):
+    """
+    Returns the name of the parameter that sets the number of boosting rounds if
+    the model can predict with fewer rounds than it was trained with.
+
+    Args:
+        model: a model instance
+        model_module: 'sklearn', 'xgboost', 'pipeline' or 'keras'
+
+    Returns:
+        'n_estimators', 'max_iter' or None
+    """
+    if model_module == 'xgboost':
+        return 'n_estimators'
+    if (model_module == 'sklearn') and hasattr(model, 'staged_predict'):
+        params = model.get_params()
+        for name in ['n_estimators', 'max_iter']:
+            if name in params:
+                return name
+    return None
+
+
+def get_shared_fit(model, model_module):
+    """
+    Returns the parameter along which trials can share fits and the function that
+    scores such a group of trials: staged_scores for boosted models, otherwise
+    optml.warm_start.warm_start_scores for estimators that support warm starts.
+
+    Args:
+        model: a model instance
+        model_module: 'sklearn', 'xgboost', 'pipeline' or 'keras'
+
+    Returns:
+        a tuple (parameter name, scoring function) or (None, None)
+    """
+    round_param = get_round_param(model, model_module)
+    if round_param is not None:
+        return round_param, staged_scores
+    path = get_warm_start_path(model, model_module)
+    if path is not None:
+        return path[0], warm_start_scores
+    return None, None
+
+
+def _key(params, exclude):
+    return tuple(sorted((name, repr(value)) for name, value in params.items() if name != exclude))
+
+
+def group_by_rounds(hyperparams_list, round_param):
+    """
+    Groups trials that only differ in the number of boosting rounds (or in any
+    other single parameter).
+
+    Args:
+        hyperparams_list: a list of dictionaries with hyperparameters
+        round_param: name of the parameter that may differ within a group
+
+    Returns:
+        a list of lists with indices into hyperparams_list
+    """
+    groups = {}
+    for idx, params in enumerate(hyperparams_list):
+        groups.setdefault(_key(params, round_param), []).append(idx)
+    return list(groups.values())
+
+
+def fit_model(model, model_module, X_train, y_train, X_val=None, y_val=None, early_stopping_rounds=None):
+    """
+    Fits a model, with the native early stopping of xgboost on (X_val, y_val) if
+    early_stopping_rounds is given. scikit-learn models always train all rounds:
+    their own early stopping would hold out part of X_train instead of using
+    X_val, so the stopping round is determined afterwards (see stopping_round).
+    """
+    if (early_stopping_rounds is None) or (model_module != 'xgboost'):
+        return model.fit(X_train, y_train)
+    fit_kwargs = {'eval_set': [(X_val, y_val)], 'verbose': False}
+    if 'early_stopping_rounds' in model.get_params():
+        model.set_params(early_stopping_rounds=early_stopping_rounds)
+    else:
+        fit_kwargs['early_stopping_rounds'] = early_stopping_rounds
+    return model.fit(X_train, y_train, **fit_kwargs)
+
+
+def stopping_round(model, X_val, y_val, eval_func, early_stopping_rounds):
+    """
+    Finds the round at which early stopping on (X_val, y_val) would have stopped
+    a fitted scikit-learn model, i.e. the best round before the validation score
+    did not improve for early_stopping_rounds rounds.
+
+    Args:
+        model: a fitted model with a staged_predict method
+        X_val: a numpy array with validation data
+        y_val: a numpy array containing the target variable for the validation data
+        eval_func: scoring function. Takes input (y_true, y_predicted)
+        early_stopping_rounds: number of rounds without improvement
+
+    Returns:
+        the number of rounds with the best validation score
+    """
+    best_score, best_round = None, 0
+    for n_rounds, prediction in enumerate(model.staged_predict(X_val), 1):
+        score = eval_func(y_val, prediction)
+        if (best_score is None) or (score > best_score):
+            best_score, best_round = score, n_rounds
+        elif n_rounds - best_round >= early_stopping_rounds:
+            break
+    return best_round
+
+
+def staged_predictions(model, model_module, X, counts):
+    """
+    Predicts with the first k rounds of a fitted model for each k in counts. If
+    training stopped early, counts beyond the last round use all rounds.
+
+    Args:
+        model: a fitted model
+        model_module: 'sklearn' or 'xgboost'
+        X: a numpy array with the data to predict
+        counts: a list of numbers of rounds
+
+    Returns:
+        a list with one numpy array of predictions per entry of counts
+    """
+    if model_module == 'xgboost':
+        best_iteration = getattr(model, 'best_iteration', None)
+        if best_iteration is not None:
+            # do not use the rounds after the best round when training stopped early
+            counts = [min(count, best_iteration + 1) for count in counts]
+        predictions = []
+        for count in counts:
+            try:
+                predictions.append(model.predict(X, iteration_range=(0, int(count))))
+            except TypeError:
+                # xgboost < 1.4
+                predictions.append(model.predict(X, ntree_limit=int(count)))
+        return predictions
+    wanted = set(int(count) for count in counts)
+    by_count = {}
+    last = None
+    for n_rounds, prediction in enumerate(model.staged_predict(X), 1):
+        if n_rounds in wanted:
+            by_count[n_rounds] = prediction
+        last = prediction
+        if n_rounds >= max(wanted):
+            break
+    return [by_count.get(int(count), last) for count in counts]
+
+
+def staged_scores(model, model_module, model_params, round_param, counts, eval_func,
+                  X_train, y_train, X_test, y_test, early_stopping_rounds=None, chunk_size=None):
+    """
+    Trains one model with the largest number of rounds in counts and scores the
+    predictions on X_test for every number of rounds in counts.
+
+    Args:
+        model: the base model, used to build the new model
+        model_module: 'sklearn' or 'xgboost'
+        model_params: a dictionary with all parameters of the new model
+        round_param: name of the parameter with the number of rounds
+        counts: a list of numbers of rounds
+        eval_func: scoring function. Takes input (y_true, y_predicted)
+        X_train: a numpy array with training data
+        y_train: a numpy array containing the target variable for the training data
+        X_test: a numpy array with validation data
+        y_test: a numpy array containing the target variable for the validation data
+        early_stopping_rounds: stop training once the score on X_test has not improved
+            for this many rounds. default is None
+        chunk_size: number of rows of X_test per prediction (see
+            optml.validation.score_model). default is None
+
+    Returns:
+        a list with one score per entry of counts
+    """
+    model_params = dict(model_params)
+    model_params[round_param] = int(max(counts))
+    new_model = model.__class__(**model_params)
+    fit_model(new_model, model_module, X_train, y_train, X_test, y_test, early_stopping_rounds)
+    if (early_stopping_rounds is not None) and (model_module != 'xgboost'):
+        # do not use the rounds after the stopping round, like xgboost's best_iteration
+        best_round = stopping_round(new_model, X_test, y_test, eval_func, early_stopping_rounds)
+        counts = [min(count, best_round) for count in counts]
+    return score_predictions(lambda X: staged_predictions(new_model, model_module, X, counts),
+                             X_test, y_test, eval_func, chunk_size)
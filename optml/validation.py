@@ -0,0 +1,324 @@
+"""
+Scoring trials on a subsample of large validation sets.
+
+Predicting and scoring millions of validation rows can cost as much as training a
+fast model. With subsampled validation (see Optimizer.set_subsampled_validation) a
+trained model is first scored on a fixed random subsample of the validation set and
+a bootstrap confidence interval of that score is estimated. Only if the upper end of
+the interval reaches the best full score so far (the incumbent) is the model also
+scored on the full validation set. Trials that cannot plausibly beat the incumbent
+keep their subsample score. With cross-validation the decision is made once per
+trial: either all folds of a trial are scored in full or none, so the incumbent is
+always a trial whose every fold was scored in full.
+
+Models can also be scored in chunks of rows (see Optimizer.set_chunked_prediction)
+so that predictions for the whole validation set never have to be held in memory.
+Evaluation functions that are StreamingMetric instances accumulate their score
+chunk by chunk; plain functions eval_func(y_true, y_pred) still receive all
+predictions at once, but the model only ever predicts one chunk at a time.
+"""
+import copy
+import numpy as np
+from optml.data import n_rows, take
+
+
+class StreamingMetric(object):
+    """
+    An evaluation function that is accumulated over chunks of predictions.
+    Subclasses implement reset, update and finalize; reset has to assign new state
+    instead of modifying it in place, since every evaluation works on a fresh copy
+    (see new). A StreamingMetric can be called like any other evaluation function.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        raise NotImplementedError("This class needs a reset() function")
+
+    def update(self, y_true, y_pred):
+        """
+        Adds the predictions for a chunk of rows.
+        """
+        raise NotImplementedError("This class needs an update(y_true, y_pred) function")
+
+    def finalize(self):
+        """
+        Returns the score of all rows added since the last reset.
+        """
+        raise NotImplementedError("This class needs a finalize() function")
+
+    def new(self):
+        """
+        Returns an empty copy of the metric for a single evaluation.
+        """
+        metric = copy.copy(self)
+        metric.reset()
+        return metric
+
+    def __call__(self, y_true, y_pred):
+        metric = self.new()
+        metric.update(y_true, y_pred)
+        return metric.finalize()
+
+
+def _align(y_true, y_pred):
+    y_true = np.asarray(y_true)
+    y_pred = np.asarray(y_pred)
+    if (y_pred.shape != y_true.shape) and (y_pred.size == y_true.size):
+        # e.g. predictions of shape (n, 1) for targets of shape (n,)
+        y_pred = y_pred.reshape(y_true.shape)
+    return y_true, y_pred
+
+
+class Accuracy(StreamingMetric):
+    """
+    The fraction of correct predictions (of all outputs for multi-output models).
+    """
+    def reset(self):
+        self.n_correct = 0
+        self.n_total = 0
+
+    def update(self, y_true, y_pred):
+        y_true, y_pred = _align(y_true, y_pred)
+        self.n_correct += int(np.sum(y_true == y_pred))
+        self.n_total += y_true.size
+
+    def finalize(self):
+        return self.n_correct / float(self.n_total) if self.n_total > 0 else 0.
+
+
+class NegMeanSquaredError(StreamingMetric):
+    """
+    The negative mean squared error, so that larger scores are better.
+    """
+    def reset(self):
+        self.sum_squares = 0.
+        self.n_total = 0
+
+    def update(self, y_true, y_pred):
+        y_true, y_pred = _align(y_true, y_pred)
+        self.sum_squares += float(np.sum((y_pred - y_true) ** 2))
+        self.n_total += y_true.size
+
+    def finalize(self):
+        return -self.sum_squares / self.n_total if self.n_total > 0 else 0.
+
+
+def score_model(model, X, y, eval_func, chunk_size=None):
+    """
+    Scores a trained model, predicting chunk_size rows at a time.
+
+    Args:
+        model: a trained model with a predict method
+        X: the validation data
+        y: the target variable for the validation data
+        eval_func: scoring function. Takes input (y_true, y_predicted); a StreamingMetric
+            is updated chunk by chunk
+        chunk_size: number of rows per prediction, or None to predict all rows at once.
+            default is None
+
+    Returns:
+        the score of the model
+    """
+    return score_predictions(lambda X_chunk: [model.predict(X_chunk)], X, y, eval_func, chunk_size)[0]
+
+
+def score_predictions(predict, X, y, eval_func, chunk_size=None):
+    """
+    Scores several predictions for the same rows, e.g. of every number of boosting
+    rounds of one model, predicting chunk_size rows at a time.
+
+    Args:
+        predict: a function that takes rows of X and returns a list of predictions
+            for these rows
+        X: the validation data
+        y: the target variable for the validation data
+        eval_func: scoring function. Takes input (y_true, y_predicted); a StreamingMetric
+            is updated chunk by chunk
+        chunk_size: number of rows per prediction, or None to predict all rows at once.
+            default is None
+
+    Returns:
+        a list with the score of each of the predictions
+    """
+    n = n_rows(X)
+    if (chunk_size is None) or (n <= chunk_size):
+        return [eval_func(y, y_pred) for y_pred in predict(X)]
+    metrics, predictions = None, None
+    for start in range(0, n, chunk_size):
+        rows = np.arange(start, min(start + chunk_size, n))
+        chunk = predict(take(X, rows))
+        if isinstance(eval_func, StreamingMetric):
+            if metrics is None:
+                metrics = [eval_func.new() for _ in chunk]
+            y_chunk = take(y, rows)
+            for metric, y_pred in zip(metrics, chunk):
+                metric.update(y_chunk, y_pred)
+        else:
+            if predictions is None:
+                predictions = [[] for _ in chunk]
+            for chunks, y_pred in zip(predictions, chunk):
+                chunks.append(np.asarray(y_pred))
+    if metrics is not None:
+        return [metric.finalize() for metric in metrics]
+    return [eval_func(y, np.concatenate(chunks)) for chunks in predictions]
+
+
+class SubsampledValidation(object):
+    """
+    Subsample scoring with escalation to the full validation set.
+
+    Scores are maximized, like the scores of the optimizers. A trial consists of one
+    model per validation set (key), e.g. one per cross-validation fold. The
+    incumbent is the best mean full score of the trials that were scored in full.
+
+    Args:
+        subsample_size: number of validation rows in the subsample. Validation sets
+            with at most this many rows are always scored in full. default is 10000
+        n_bootstrap: number of bootstrap resamples of the subsample. default is 100
+        confidence: confidence level of the bootstrap interval. default is 0.95
+        random_state: seed for the subsample and the bootstrap. default is None which
+            draws a seed once, so that all trials use the same subsample
+
+    Attributes:
+        incumbent: the best mean full score of a trial so far, or None
+        n_subsampled: number of trials that were scored on a subsample
+        n_escalated: number of those trials that were also scored in full
+    """
+    def __init__(self, subsample_size=10000, n_bootstrap=100, confidence=0.95, random_state=None):
+        if not 0 < confidence < 1:
+            raise ValueError("confidence needs to be between 0 and 1")
+        if random_state is None:
+            random_state = np.random.randint(2 ** 31 - 1)
+        self.subsample_size = subsample_size
+        self.n_bootstrap = n_bootstrap
+        self.confidence = confidence
+        self.random_state = random_state
+        self.random = np.random.RandomState(random_state)
+        self.incumbent = None
+        self.subsamples = {}
+        self.n_subsampled = 0
+        self.n_escalated = 0
+
+    def get_subsample(self, key, n):
+        """
+        Returns the sorted indices of the subsample of a validation set with n rows.
+        """
+        if (key not in self.subsamples) or (self.subsamples[key][0] != n):
+            random = np.random.RandomState((self.random_state + hash(key)) % (2 ** 31 - 1))
+            idxs = np.sort(random.choice(n, self.subsample_size, replace=False))
+            self.subsamples[key] = (n, idxs)
+        return self.subsamples[key][1]
+
+    def bootstrap_interval(self, eval_func, y_true, y_pred):
+        """
+        Estimates a percentile bootstrap confidence interval of a score.
+
+        Args:
+            eval_func: scoring function. Takes input (y_true, y_predicted)
+            y_true: the target variable
+            y_pred: the predictions of the model
+
+        Returns:
+            a tuple (lower, upper)
+        """
+        y_pred = np.asarray(y_pred)
+        n = n_rows(y_true)
+        scores = []
+        for _ in range(self.n_bootstrap):
+            # the order of the rows does not matter, sorting lets take read ranges
+            idxs = np.sort(self.random.randint(n, size=n))
+            scores.append(eval_func(take(y_true, idxs), y_pred[idxs]))
+        alpha = 100 * (1 - self.confidence) / 2.
+        return float(np.percentile(scores, alpha)), float(np.percentile(scores, 100 - alpha))
+
+    def score_subsample(self, model, X_val, y_val, eval_func, key=0, chunk_size=None):
+        """
+        Scores a trained model on the subsample of a validation set, or on the whole
+        set if it is not larger than the subsample. Whether the model is also scored
+        on the full validation set is decided by escalate, once for all models of
+        a trial.
+
+        Args:
+            model: a trained model with a predict method
+            X_val: the validation data
+            y_val: the target variable for the validation data
+            eval_func: scoring function. Takes input (y_true, y_predicted)
+            key: identifies the validation set, e.g. the index of a fold. default is 0
+            chunk_size: number of rows per prediction on the full validation set
+                (see score_model). default is None
+
+        Returns:
+            a dictionary with the keys 'score', 'subsample_score', 'interval' and
+            'full_score' (None until the model is scored in full)
+        """
+        if n_rows(X_val) <= self.subsample_size:
+            full_score = score_model(model, X_val, y_val, eval_func, chunk_size)
+            return {'score': full_score, 'subsample_score': None, 'interval': None, 'full_score': full_score}
+        idxs = self.get_subsample(key, n_rows(X_val))
+        y_sub = take(y_val, idxs)
+        y_pred = model.predict(take(X_val, idxs))
+        subsample_score = eval_func(y_sub, y_pred)
+        return {'score': subsample_score, 'subsample_score': subsample_score,
+                'interval': self.bootstrap_interval(eval_func, y_sub, y_pred), 'full_score': None,
+                # removed by escalate
+                '_pending': (model, X_val, y_val)}
+
+    def escalate(self, records, eval_func, chunk_size=None):
+        """
+        Decides for a trial whether the models that were only scored on a subsample
+        are also scored in full: either all of them or none. They are if the mean
+        over the validation sets of the upper ends of the intervals (the full score
+        for sets that were scored in full) reaches the incumbent. The records are
+        updated in place.
+
+        Args:
+            records: a list with the dictionaries returned by score_subsample for
+                every model of the trial
+            eval_func: scoring function. Takes input (y_true, y_predicted)
+            chunk_size: number of rows per prediction (see score_model). default is None
+
+        Returns:
+            the mean score of the trial
+        """
+        pending = [record for record in records if '_pending' in record]
+        if len(pending) > 0:
+            self.n_subsampled += 1
+            upper = np.mean([record['full_score'] if record['interval'] is None else record['interval'][1]
+                             for record in records])
+            if (self.incumbent is None) or (upper >= self.incumbent):
+                self.n_escalated += 1
+                for record in pending:
+                    model, X_val, y_val = record['_pending']
+                    record['full_score'] = score_model(model, X_val, y_val, eval_func, chunk_size)
+                    record['score'] = record['full_score']
+            for record in pending:
+                del record['_pending']
+        if all(record['full_score'] is not None for record in records):
+            full_score = np.mean([record['full_score'] for record in records])
+            if (self.incumbent is None) or (full_score > self.incumbent):
+                self.incumbent = full_score
+        return np.mean([record['score'] for record in records])
+
+    def score(self, model, X_val, y_val, eval_func, key=0, chunk_size=None):
+        """
+        Scores a trained model, on the full validation set only if it could beat the
+        incumbent. The model is a trial of its own.
+
+        Args:
+            model: a trained model with a predict method
+            X_val: the validation data
+            y_val: the target variable for the validation data
+            eval_func: scoring function. Takes input (y_true, y_predicted)
+            key: identifies the validation set. default is 0
+            chunk_size: number of rows per prediction on the full validation set
+                (see score_model). default is None
+
+        Returns:
+            a dictionary with the keys 'score' (the full score if the model was
+            escalated, otherwise the subsample score), 'subsample_score', 'interval'
+            and 'full_score' (None if the model was not escalated)
+        """
+        record = self.score_subsample(model, X_val, y_val, eval_func, key, chunk_size)
+        self.escalate([record], eval_func, chunk_size)
+        return record
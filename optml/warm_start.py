@@ -0,0 +1,102 @@
+"""
+Continuing fitted scikit-learn estimators along a path of hyperparameters.
+
+Estimators with warm_start=True reuse their fitted state when fit is called again
+after set_params. For the paths below this gives the same model as training from
+scratch: forests and bagging ensembles draw the seeds of their first estimators in
+the same order and only grow the additional ones, and the convex linear models start
+their solver at the previous solution, which converges to the same optimum. Trials
+that only differ in the path parameter are therefore evaluated one after another
+with a single estimator, ordered from the cheapest end of the path.
+"""
+from optml.validation import score_model
+
+# class name: (path parameter, True if the path runs towards increasing values)
+WARM_START_PATHS = {
+    'RandomForestClassifier': ('n_estimators', True),
+    'RandomForestRegressor': ('n_estimators', True),
+    'ExtraTreesClassifier': ('n_estimators', True),
+    'ExtraTreesRegressor': ('n_estimators', True),
+    'BaggingClassifier': ('n_estimators', True),
+    'BaggingRegressor': ('n_estimators', True),
+    # from strong to weak regularization
+    'LogisticRegression': ('C', True),
+    'ElasticNet': ('alpha', False),
+    'Lasso': ('alpha', False),
+    'MultiTaskElasticNet': ('alpha', False),
+    'MultiTaskLasso': ('alpha', False),
+}
+
+
+def get_warm_start_path(model, model_module):
+    """
+    Returns the path along which the model can be warm-started.
+
+    Args:
+        model: a model instance
+        model_module: 'sklearn', 'xgboost', 'pipeline' or 'keras'
+
+    Returns:
+        a tuple (parameter name, True if the path runs towards increasing values)
+        or None if the model does not support warm starts
+    """
+    if (model_module != 'sklearn') or ('warm_start' not in model.get_params()):
+        return None
+    for cls in type(model).__mro__:
+        if cls.__name__ in WARM_START_PATHS:
+            return WARM_START_PATHS[cls.__name__]
+    return None
+
+
+def warm_start_order(values, increasing):
+    """
+    Returns the indices of values in the order in which they are visited on the path.
+    """
+    return sorted(range(len(values)), key=lambda idx: values[idx], reverse=not increasing)
+
+
+def warm_start_scores(model, model_module, model_params, path_param, values, eval_func,
+                      X_train, y_train, X_test, y_test, early_stopping_rounds=None, chunk_size=None):
+    """
+    Fits one warm-started estimator for every value in values, visiting them along
+    the path, and scores the predictions on X_test after each fit. Takes the same
+    arguments as optml.staged.staged_scores.
+
+    Args:
+        model: the base model, used to build the new model
+        model_module: 'sklearn'
+        model_params: a dictionary with all parameters of the new model
+        path_param: name of the path parameter
+        values: a list of values of the path parameter
+        eval_func: scoring function. Takes input (y_true, y_predicted)
+        X_train: a numpy array with training data
+        y_train: a numpy array containing the target variable for the training data
+        X_test: a numpy array with validation data
+        y_test: a numpy array containing the target variable for the validation data
+        early_stopping_rounds: ignored, only boosted models stop early
+        chunk_size: number of rows of X_test per prediction (see
+            optml.validation.score_model). default is None
+
+    Returns:
+        a list with one score per entry of values
+    """
+    path = get_warm_start_path(model, model_module)
+    increasing = True if path is None else path[1]
+    model_params = dict(model_params)
+    model_params['warm_start'] = True
+    scores = [None] * len(values)
+    new_model = None
+    previous = None
+    for idx in warm_start_order(values, increasing):
+        if (new_model is not None) and (values[idx] == values[previous]):
+            scores[idx] = scores[previous]
+            continue
+        if new_model is None:
+            model_params[path_param] = values[idx]
+            new_model = model.__class__(**model_params)
+        else:
+            new_model.set_params(**{path_param: values[idx]})
+        new_model.fit(X_train, y_train)
+        scores[idx] = score_model(new_model, X_test, y_test, eval_func, chunk_size)
+        previous = idx
+    return scores
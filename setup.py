@@ -90,6 +90,12 @@ setup(
         'dev': ['check-manifest'],
         'test': ['coverage'],
     },
+    # console scripts that are installed together with the package
+    entry_points={
+        'console_scripts': [
+            'optml-worker=optml.distributed:main',
+        ],
+    },
     test_suite='nose.collector',
     tests_require=['nose'],
 )
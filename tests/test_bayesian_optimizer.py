@@ -1,6 +1,13 @@
+import os
+import shutil
+import tempfile
 import numpy as np
 import unittest
-from optml.bayesian_optimizer import BayesianOptimizer
+from unittest import mock
+from optml.data import fingerprint
+from optml.bayesian_optimizer import BayesianOptimizer, TrustRegionBayesianOptimizer, MultiFidelityBayesianOptimizer
+from optml.bayesian_optimizer.trust_region import TrustRegion
+from optml.bayesian_optimizer.gp_categorical import GaussianProcessRegressorWithCategorical
 from optml import Parameter
 from sklearn.linear_model import LogisticRegression
 from  sklearn.ensemble import RandomForestClassifier
@@ -82,4 +89,172 @@ class TestBayesianOptimizer(unittest.TestCase):
         self.assertTrue(bayesOpt.success)
         best_model.fit(data, target)
         final_score = clf_score(target, best_model.predict(data))
-        self.assertTrue(final_score>start_score)
\ No newline at end of file
+        self.assertTrue(final_score>start_score)
+
+    def test_expected_improvement_per_second(self):
+        np.random.seed(5)
+        data, target = make_classification(n_samples=100,
+                                   n_features=10,
+                                   n_informative=5,
+                                   flip_y=0.2)
+        p1 = Parameter('n_estimators', 'integer', lower=1, upper=50)
+        model = RandomForestClassifier()
+        bayesOpt = BayesianOptimizer(model, [p1], clf_score,
+                                     acquisition_function='expected_improvement_per_second',
+                                     n_restarts_optimizer=2)
+        bayesOpt.fit(X_train=data, y_train=target, n_iters=5)
+        self.assertEqual(len(bayesOpt.cost_history), 5)
+        self.assertTrue(all(c > 0 for c in bayesOpt.cost_history))
+        self.assertIsNotNone(bayesOpt.cost_optimizer)
+
+        xs = np.array([[params['n_estimators']] for score, params in bayesOpt.hyperparam_history], dtype=float)
+        ys = np.array([score for score, params in bayesOpt.hyperparam_history])
+        optimizer = GaussianProcessRegressorWithCategorical(kernel=bayesOpt.kernel, alpha=1e-4, normalize_y=True)
+        optimizer.fit(xs, ys)
+        x = [25]
+        cost = bayesOpt.expected_cost(x)
+        self.assertTrue(cost > 0)
+        self.assertAlmostEqual(bayesOpt.expected_improvement_per_second(optimizer, x),
+                               bayesOpt.expected_improvement(optimizer, x) / cost)
+        # the same expected improvement is worth less if training is more expensive
+        bayesOpt.cost_history = [10 * c for c in bayesOpt.cost_history]
+        bayesOpt.fit_cost_model(xs)
+        self.assertTrue(bayesOpt.expected_cost(x) > 5 * cost)
+
+    def test_cost_model_without_durations(self):
+        p1 = Parameter('n_estimators', 'integer', lower=1, upper=50)
+        bayesOpt = BayesianOptimizer(RandomForestClassifier(), [p1], clf_score,
+                                     acquisition_function='expected_improvement_per_second',
+                                     n_restarts_optimizer=2)
+        bayesOpt.observe(0.5, {'n_estimators': 10})
+        bayesOpt.observe(0.7, {'n_estimators': 40})
+        # no durations: the cost model is skipped and plain expected improvement is used
+        params = bayesOpt.propose()
+        self.assertTrue(1 <= params['n_estimators'] <= 50)
+        self.assertIsNone(bayesOpt.cost_optimizer)
+        self.assertEqual(bayesOpt.expected_cost([25]), 1.)
+        # the cost model is fitted on the trials with a duration only
+        bayesOpt.observe(0.6, {'n_estimators': 25}, duration=2.)
+        bayesOpt.propose()
+        self.assertIsNotNone(bayesOpt.cost_optimizer)
+        self.assertTrue(np.isfinite(bayesOpt.expected_cost([25])))
+
+class TestTrustRegionBayesianOptimizer(unittest.TestCase):
+    def test_only_numerical_parameters(self):
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=10)
+        p2 = Parameter('criterion', 'categorical', possible_values=['gini', 'entropy'])
+        with self.assertRaises(ValueError):
+            TrustRegionBayesianOptimizer(RandomForestClassifier(), [p1, p2], clf_score)
+
+    def test_trust_region_expand_and_shrink(self):
+        region = TrustRegion(2, length_init=0.8, success_tolerance=2, failure_tolerance=2)
+        region.observe([0.5, 0.5], 1.0, update_length=False)
+        region.observe([0.6, 0.5], 2.0)
+        region.observe([0.7, 0.5], 3.0)
+        self.assertAlmostEqual(region.length, 1.6)
+        np.testing.assert_array_equal(region.center, [0.7, 0.5])
+        region.observe([0.1, 0.1], 0.0)
+        region.observe([0.2, 0.1], 0.0)
+        self.assertAlmostEqual(region.length, 0.8)
+        lower, upper = region.get_bounds()
+        self.assertTrue(np.all(lower >= 0) and np.all(upper <= 1))
+
+    def test_trust_region_first_observation(self):
+        region = TrustRegion(2, success_tolerance=1)
+        with np.errstate(invalid='raise'):
+            region.observe([0.5, 0.5], 1.0)
+        self.assertEqual(region.best_score, 1.0)
+        # the first observation counts as a success
+        self.assertAlmostEqual(region.length, 1.6)
+
+    def test_improvement(self):
+        np.random.seed(5)
+        data, target = make_classification(n_samples=100,
+                                   n_features=45,
+                                   n_informative=15,
+                                   n_redundant=5,
+                                   class_sep=1,
+                                   n_clusters_per_class=4,
+                                   flip_y=0.4)
+        model = RandomForestClassifier(max_depth=1, n_estimators=10)
+        model.fit(data, target)
+        start_score = clf_score(target, model.predict(data))
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=10)
+        p2 = Parameter('min_weight_fraction_leaf', 'continuous', lower=0., upper=0.2)
+        turbo = TrustRegionBayesianOptimizer(model, [p1, p2], clf_score, n_trust_regions=2)
+        best_params, best_model = turbo.fit(X_train=data, y_train=target, n_iters=12)
+        self.assertEqual(len(turbo.hyperparam_history), 12)
+        self.assertTrue(best_params['max_depth'] in range(1, 11))
+        best_model.fit(data, target)
+        final_score = clf_score(target, best_model.predict(data))
+        self.assertTrue(final_score>start_score)
+
+    def test_fit_restarts_collapsed_regions(self):
+        np.random.seed(5)
+        data, target = make_classification(n_samples=60, n_features=5)
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=10)
+        p2 = Parameter('min_weight_fraction_leaf', 'continuous', lower=0., upper=0.2)
+        # a single failure shrinks the region below length_min
+        turbo = TrustRegionBayesianOptimizer(RandomForestClassifier(n_estimators=5), [p1, p2], clf_score,
+                                             n_trust_regions=1, n_init_samples=2, length_min=0.5,
+                                             failure_tolerance=1, success_tolerance=100)
+        turbo.fit(X_train=data, y_train=target, n_iters=10)
+        self.assertEqual(len(turbo.hyperparam_history), 10)
+        self.assertEqual(len(turbo.cost_history), 10)
+        self.assertEqual(turbo._asked, [])
+        self.assertTrue(turbo.n_restarts >= 1)
+
+
+class TestMultiFidelityBayesianOptimizer(unittest.TestCase):
+    def test_nested_subsamples(self):
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=10)
+        mfbo = MultiFidelityBayesianOptimizer(RandomForestClassifier(), [p1], clf_score,
+                                              fidelities=[0.1, 0.5, 1.0])
+        subsamples = mfbo.get_subsample_indices(100)
+        self.assertEqual(len(subsamples[0.1]), 10)
+        self.assertEqual(len(subsamples[0.5]), 50)
+        self.assertEqual(len(subsamples[1.0]), 100)
+        self.assertTrue(set(subsamples[0.1]).issubset(subsamples[0.5]))
+
+    def test_folds_per_fidelity(self):
+        np.random.seed(5)
+        data, target = make_classification(n_samples=100, n_features=5)
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=10)
+        mfbo = MultiFidelityBayesianOptimizer(RandomForestClassifier(n_estimators=5), [p1], clf_score,
+                                              n_candidates=50)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            mfbo.set_cross_validation(cache='mmap', cache_dir=tmp_dir)
+            with mock.patch('optml.folds.fingerprint', side_effect=fingerprint) as hashed:
+                mfbo.fit(data, target, n_iters=8, n_folds=2)
+            # the folds of every subsample are computed once
+            fidelities = set(fidelity for score, params, fidelity, duration in mfbo.fidelity_history)
+            self.assertEqual(hashed.call_count, len(fidelities))
+            # only the memory-mapped folds of the full training data are kept
+            self.assertEqual(len(os.listdir(tmp_dir)), 2 * 4)
+            self.assertEqual(len(mfbo.cv.indices[0][0]) + len(mfbo.cv.indices[0][1]), 100)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_improvement(self):
+        np.random.seed(5)
+        data, target = make_classification(n_samples=200,
+                                   n_features=45,
+                                   n_informative=15,
+                                   n_redundant=5,
+                                   class_sep=1,
+                                   n_clusters_per_class=4,
+                                   flip_y=0.4)
+        model = RandomForestClassifier(max_depth=1, n_estimators=10)
+        model.fit(data, target)
+        start_score = clf_score(target, model.predict(data))
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=10)
+        mfbo = MultiFidelityBayesianOptimizer(model, [p1], clf_score)
+        best_params, best_model = mfbo.fit(X_train=data, y_train=target, n_iters=10)
+        self.assertEqual(len(mfbo.fidelity_history), 10)
+        self.assertTrue(len(mfbo.hyperparam_history) >= 1)
+        for score, params, fidelity, duration in mfbo.fidelity_history:
+            self.assertIn(fidelity, mfbo.fidelities)
+        best_model.fit(data, target)
+        final_score = clf_score(target, best_model.predict(data))
+        self.assertTrue(final_score>start_score)
@@ -0,0 +1,62 @@
+import numpy as np
+import unittest
+from optml.cmaes_optimizer import CMAESOptimizer
+from optml import Parameter
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.datasets import make_classification
+
+def clf_score(y_true,y_pred):
+    return np.sum(y_true==y_pred)/float(len(y_true))
+
+class TestCMAESOptimizer(unittest.TestCase):
+    def test_converges_on_quadratic(self):
+        np.random.seed(0)
+        params = [Parameter('x{}'.format(i), 'continuous', lower=-5, upper=5) for i in range(4)]
+        optimizer = CMAESOptimizer(RandomForestClassifier(), params, clf_score)
+        optimizer.start(optimizer.initial_population_size)
+        target = np.array([0.2, 0.4, 0.6, 0.8])
+        for generation in range(150):
+            xs, hyperparams = optimizer.get_next_hyperparameters()
+            optimizer.update(xs, -np.sum((xs - target)**2, axis=1))
+        np.testing.assert_allclose(optimizer.mean, target, atol=1e-3)
+
+    def test_integer_margin(self):
+        np.random.seed(0)
+        p1 = Parameter('A', 'integer', lower=1, upper=10)
+        p2 = Parameter('B', 'continuous', lower=0, upper=1)
+        optimizer = CMAESOptimizer(RandomForestClassifier(), [p1, p2], clf_score, integer_margin=0.2)
+        optimizer.start(8)
+        for generation in range(100):
+            xs, hyperparams = optimizer.get_next_hyperparameters()
+            self.assertTrue(all(isinstance(p['A'], int) for p in hyperparams))
+            # a flat objective in A makes its variance collapse without the margin
+            optimizer.update(xs, -(xs[:, 1] - 0.3)**2)
+        std = optimizer.sigma * np.sqrt(optimizer.C[0, 0])
+        self.assertGreaterEqual(std, optimizer.std_floor[0] * (1 - 1e-9))
+        self.assertGreater(optimizer.std_floor[0], 0)
+        self.assertEqual(optimizer.std_floor[1], 0)
+
+    def test_fit(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=60, n_features=5)
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=10)
+        p2 = Parameter('min_samples_split', 'continuous', lower=0.01, upper=0.5)
+        optimizer = CMAESOptimizer(RandomForestClassifier(n_estimators=5), [p1, p2], clf_score,
+                                   population_size=6, n_jobs=2)
+        best_params, best_model = optimizer.fit(X_train=data, y_train=target, n_iters=20)
+        self.assertEqual(len(optimizer.hyperparam_history), 20)
+        self.assertEqual(sum(n_evals for size, n_evals in optimizer.restarts), 20)
+        self.assertEqual(best_params, max(optimizer.hyperparam_history, key=lambda sp: sp[0])[1])
+        best_model.fit(data, target)
+
+    def test_restart_increases_population(self):
+        np.random.seed(1)
+        data, target = make_classification(n_samples=30, n_features=5)
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=2)
+        # a constant objective stagnates and triggers restarts
+        optimizer = CMAESOptimizer(RandomForestClassifier(n_estimators=2), [p1],
+                                   lambda y_true, y_pred: 1., population_size=4, n_jobs=1)
+        optimizer.fit(X_train=data, y_train=target, n_iters=200)
+        sizes = [size for size, n_evals in optimizer.restarts]
+        self.assertGreater(len(sizes), 1)
+        self.assertEqual(sizes[:2], [4, 8])
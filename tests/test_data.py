@@ -0,0 +1,124 @@
+import os
+import pickle
+import shutil
+import tempfile
+import numpy as np
+import unittest
+import scipy.sparse
+from optml.data import open_array, is_mapped, fingerprint, index_ranges, take, share, unshare, save, load
+from optml.folds import CrossValidation
+from optml.random_search import RandomSearchOptimizer
+from optml.differential_evolution_optimizer import DifferentialEvolutionOptimizer
+from optml.distributed import Coordinator
+from optml import Parameter
+from sklearn.linear_model import LogisticRegression
+from sklearn.datasets import make_classification
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+def clf_score(y_true,y_pred):
+    return np.sum(y_true==y_pred)/float(len(y_true))
+
+class TestData(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(4)
+        self.data, self.target = make_classification(n_samples=60, n_features=5)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data_path = os.path.join(self.tmp_dir, 'X.npy')
+        self.target_path = os.path.join(self.tmp_dir, 'y.npy')
+        np.save(self.data_path, self.data)
+        np.save(self.target_path, self.target)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_take(self):
+        self.assertEqual(index_ranges(np.array([0, 1, 2, 5, 6, 9])), [(0, 3), (5, 7), (9, 10)])
+        X = open_array(self.data_path)
+        self.assertTrue(is_mapped(X))
+        self.assertIs(take(X, np.arange(60)), X)
+        view = take(X, np.arange(20, 40))
+        # a view of the file, nothing is copied
+        self.assertIs(view.base, X)
+        idxs = np.array([0, 1, 2, 30, 31, 59])
+        np.testing.assert_array_equal(take(X, idxs), self.data[idxs])
+        np.testing.assert_array_equal(take(X, idxs, max_ranges=2), self.data[idxs])
+
+    def test_share(self):
+        X = open_array(self.data_path)
+        self.assertEqual(fingerprint(X), fingerprint(open_array(self.data_path)))
+        self.assertNotEqual(fingerprint(X), fingerprint(open_array(self.target_path)))
+        shared = pickle.dumps(share((X, self.target, None)))
+        # the pickle holds a reference to the file, not the data
+        self.assertLess(len(shared), X.nbytes)
+        X_copy, y_copy, nothing = unshare(pickle.loads(shared))
+        self.assertTrue(is_mapped(X_copy))
+        np.testing.assert_array_equal(X_copy, self.data)
+        np.testing.assert_array_equal(y_copy, self.target)
+        self.assertIsNone(nothing)
+
+    def test_optimizer(self):
+        p1 = Parameter('C', 'continuous', lower=0.01, upper=10.)
+        results = []
+        for X, y in [(self.data, self.target), (open_array(self.data_path), open_array(self.target_path))]:
+            np.random.seed(1)
+            optimizer = DifferentialEvolutionOptimizer(LogisticRegression(), [p1], clf_score,
+                                                       population_size=4, n_jobs=2)
+            optimizer.set_cross_validation(shuffle=True, random_state=0)
+            optimizer.fit(X, y, n_iters=1, n_folds=3)
+            results.append([score for score, params in optimizer.hyperparam_history])
+        np.testing.assert_allclose(results[0], results[1])
+
+    def test_distributed_data(self):
+        coordinator = Coordinator(None, os.path.join(self.tmp_dir, 'study.db'))
+        coordinator.share_data(open_array(self.data_path), self.target)
+        row = coordinator.connection.execute("SELECT value FROM study WHERE key='data'").fetchone()
+        paths = pickle.loads(row[0])
+        self.assertEqual(paths['X_train'], os.path.abspath(self.data_path))
+        self.assertNotEqual(paths['y_train'], os.path.abspath(self.target_path))
+
+    def test_sparse(self):
+        self.data[self.data < 0.5] = 0.
+        X = scipy.sparse.csr_matrix(self.data)
+        idxs = np.array([0, 1, 2, 30, 31, 59])
+        subset = take(X, idxs)
+        self.assertTrue(scipy.sparse.isspmatrix_csr(subset))
+        np.testing.assert_array_equal(subset.toarray(), self.data[idxs])
+        self.assertTrue(scipy.sparse.issparse(take(X, np.arange(20, 40))))
+        cv = CrossValidation(3, cache='mmap', cache_dir=self.tmp_dir)
+        X_train, y_train, X_test, y_test = cv.fold(0, X, self.target)
+        # sparse folds are kept in memory as they are
+        self.assertTrue(scipy.sparse.issparse(X_train))
+        self.assertEqual(os.listdir(self.tmp_dir), ['X.npy', 'y.npy'])
+        self.assertIs(cv.fold(0, X, self.target)[0], X_train)
+        path = save(os.path.join(self.tmp_dir, 'sparse'), X)
+        self.assertEqual((load(path) != X).nnz, 0)
+
+        p1 = Parameter('C', 'continuous', lower=0.01, upper=10.)
+        results = []
+        for data in [self.data, X]:
+            np.random.seed(1)
+            rand_search = RandomSearchOptimizer(LogisticRegression(), [p1], clf_score)
+            rand_search.fit(data, self.target, n_iters=3, n_folds=3)
+            results.append([score for score, params in rand_search.hyperparam_history])
+        np.testing.assert_allclose(results[0], results[1], atol=1e-2)
+
+    @unittest.skipIf(pd is None, 'pandas is not installed')
+    def test_frame(self):
+        X = pd.DataFrame(self.data, columns=['f{}'.format(i) for i in range(5)], index=np.arange(60) * 2)
+        y = pd.Series(self.target, index=X.index)
+        idxs = np.array([0, 1, 2, 30, 31, 59])
+        subset = take(X, idxs)
+        self.assertIsInstance(subset, pd.DataFrame)
+        np.testing.assert_array_equal(subset.values, self.data[idxs])
+        np.testing.assert_array_equal(take(y, np.arange(10, 20)).values, self.target[10:20])
+        path = save(os.path.join(self.tmp_dir, 'frame'), X)
+        self.assertTrue(load(path).equals(X))
+
+        p1 = Parameter('C', 'continuous', lower=0.01, upper=10.)
+        rand_search = RandomSearchOptimizer(LogisticRegression(), [p1], clf_score)
+        rand_search.fit(X, y, n_iters=3, n_folds=3)
+        self.assertEqual(len(rand_search.hyperparam_history), 3)
@@ -0,0 +1,64 @@
+import numpy as np
+import unittest
+from optml.differential_evolution_optimizer import DifferentialEvolutionOptimizer
+from optml import Parameter
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.datasets import make_classification
+
+def clf_score(y_true,y_pred):
+    return np.sum(y_true==y_pred)/float(len(y_true))
+
+class TestDifferentialEvolutionOptimizer(unittest.TestCase):
+    def test_decode(self):
+        p1 = Parameter('A', 'integer', lower=1, upper=10)
+        p2 = Parameter('B', 'continuous', lower=-1, upper=1)
+        p3 = Parameter('C', 'categorical', possible_values=['a', 'b', 'c'])
+        p4 = Parameter('D', 'boolean')
+        optimizer = DifferentialEvolutionOptimizer(RandomForestClassifier(), [p1, p2, p3, p4], clf_score)
+        self.assertEqual(optimizer.decode(np.array([0., 0.5, 0., 0.])), {'A': 1, 'B': 0., 'C': 'a', 'D': True})
+        self.assertEqual(optimizer.decode(np.array([1., 1., 1., 1.])), {'A': 10, 'B': 1., 'C': 'c', 'D': False})
+        self.assertEqual(optimizer.decode(np.array([0.5, 0., 0.5, 0.4]))['C'], 'b')
+
+    def test_trial_vectors(self):
+        np.random.seed(0)
+        params = [Parameter('x{}'.format(i), 'continuous', lower=0, upper=1) for i in range(3)]
+        for strategy in ['rand1bin', 'currenttobest1bin']:
+            optimizer = DifferentialEvolutionOptimizer(RandomForestClassifier(), params, clf_score,
+                                                       population_size=10, strategy=strategy)
+            population = np.random.uniform(size=(10, 3))
+            trials = optimizer.get_trial_vectors(population, np.arange(10.))
+            self.assertEqual(trials.shape, (10, 3))
+            self.assertTrue(np.all((trials >= 0) & (trials <= 1)))
+            # binomial crossover changes at least one coordinate of each individual
+            self.assertTrue(np.all(np.any(trials != population, axis=1)))
+
+    def test_converges_on_quadratic(self):
+        np.random.seed(1)
+        params = [Parameter('x{}'.format(i), 'continuous', lower=0, upper=1) for i in range(3)]
+        optimizer = DifferentialEvolutionOptimizer(RandomForestClassifier(), params, clf_score,
+                                                   population_size=20, strategy='currenttobest1bin',
+                                                   mutation=0.5)
+        target = np.array([0.25, 0.5, 0.75])
+        population = np.random.uniform(size=(20, 3))
+        fitness = -np.sum((population - target)**2, axis=1)
+        for generation in range(100):
+            trials = optimizer.get_trial_vectors(population, fitness)
+            trial_fitness = -np.sum((trials - target)**2, axis=1)
+            improved = trial_fitness >= fitness
+            population[improved], fitness[improved] = trials[improved], trial_fitness[improved]
+        np.testing.assert_allclose(population[np.argmax(fitness)], target, atol=1e-3)
+
+    def test_fit(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=60, n_features=5)
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=10)
+        p2 = Parameter('criterion', 'categorical', possible_values=['gini', 'entropy'])
+        p3 = Parameter('bootstrap', 'boolean')
+        optimizer = DifferentialEvolutionOptimizer(RandomForestClassifier(n_estimators=5), [p1, p2, p3],
+                                                   clf_score, population_size=6, n_jobs=2)
+        best_params, best_model = optimizer.fit(X_train=data, y_train=target, n_iters=3)
+        self.assertEqual(len(optimizer.hyperparam_history), 6 * 4)
+        # selection never makes an individual worse
+        self.assertEqual(np.max(optimizer.fitness), max(s for s, p in optimizer.hyperparam_history))
+        self.assertIn(best_params['criterion'], ['gini', 'entropy'])
+        best_model.fit(data, target)
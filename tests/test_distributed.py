@@ -0,0 +1,209 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+import numpy as np
+import unittest
+from optml.distributed import Coordinator, Worker, connect, claim_trial, finish_trial, CANCELLED
+from optml.random_search import RandomSearchOptimizer
+from optml.cmaes_optimizer import CMAESOptimizer
+from optml.differential_evolution_optimizer import DifferentialEvolutionOptimizer
+from optml.genetic_optimizer import GeneticOptimizer
+from optml.gridsearch_optimizer import GridSearchOptimizer
+from optml.hyperopt_optimizer import HyperoptOptimizer
+from optml.bayesian_optimizer.trust_region import TrustRegionBayesianOptimizer
+from optml.bayesian_optimizer.multi_fidelity import MultiFidelityBayesianOptimizer
+from optml import Parameter
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.datasets import make_classification
+from sklearn.metrics import accuracy_score
+
+class TestDistributed(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, 'study.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _fit_with_worker(self, optimizer, n_iters, n_trials=None):
+        np.random.seed(5)
+        data, target = make_classification(n_samples=60, n_features=5)
+
+        def run_worker():
+            # sqlite connections can only be used by the thread that opened them
+            Worker(self.db_path, poll_interval=0.01, max_idle=60).run()
+        worker = threading.Thread(target=run_worker)
+        worker.daemon = True
+        worker.start()
+        coordinator = Coordinator(optimizer, self.db_path, poll_interval=0.01)
+        best_params, best_model = coordinator.fit(data, target, n_iters=n_iters, max_pending=2)
+        worker.join(60)
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(coordinator.failed_trials, [])
+        self.assertEqual(len(optimizer.hyperparam_history), n_iters if n_trials is None else n_trials)
+        best_model.fit(data, target)
+        return best_params
+
+    def _hyperparams(self):
+        return [Parameter('max_depth', 'integer', lower=1, upper=10),
+                Parameter('max_features', 'continuous', lower=0.1, upper=1.0)]
+
+    def test_cmaes(self):
+        optimizer = CMAESOptimizer(RandomForestClassifier(n_estimators=5), self._hyperparams(), accuracy_score)
+        self._fit_with_worker(optimizer, 8)
+        # a population of 6 has been observed and adapted to
+        self.assertEqual(optimizer.generation, 1)
+
+    def test_differential_evolution(self):
+        optimizer = DifferentialEvolutionOptimizer(RandomForestClassifier(n_estimators=5), self._hyperparams(),
+                                                   accuracy_score, population_size=4)
+        self._fit_with_worker(optimizer, 7)
+        self.assertTrue(np.all(np.isfinite(optimizer.fitness)))
+        self.assertEqual(np.max(optimizer.fitness), max(score for score, params in optimizer.hyperparam_history))
+
+    def test_trust_region(self):
+        optimizer = TrustRegionBayesianOptimizer(RandomForestClassifier(n_estimators=5), self._hyperparams(),
+                                                 accuracy_score, n_trust_regions=1, n_init_samples=2)
+        self._fit_with_worker(optimizer, 5)
+        self.assertIsNotNone(optimizer.trust_regions[0].center)
+
+    def test_multi_fidelity(self):
+        optimizer = MultiFidelityBayesianOptimizer(RandomForestClassifier(n_estimators=5), self._hyperparams(),
+                                                   accuracy_score, n_candidates=50)
+        self._fit_with_worker(optimizer, 5)
+        self.assertEqual([f for score, params, f, d in optimizer.fidelity_history], [1.0] * 5)
+
+    def test_genetic(self):
+        optimizer = GeneticOptimizer(RandomForestClassifier(n_estimators=5), self._hyperparams(), accuracy_score,
+                                     n_init_samples=3, parent_selection_method='RouletteWheel',
+                                     mutation_noise={'max_depth': 1, 'max_features': 0.1})
+        best_params = self._fit_with_worker(optimizer, 5)
+        self.assertIsInstance(best_params['max_depth'], int)
+
+    def test_grid_search(self):
+        optimizer = GridSearchOptimizer(RandomForestClassifier(n_estimators=5), self._hyperparams(), accuracy_score,
+                                        grid_sizes={'max_depth': 3, 'max_features': 2})
+        self._fit_with_worker(optimizer, 4)
+        self.assertEqual([params for score, params in optimizer.hyperparam_history],
+                         [optimizer.grid[idx] for idx in range(4)])
+        self.assertEqual(optimizer.cost_model.n_observations, 4)
+
+    def test_grid_search_exhausted(self):
+        p1 = Parameter('criterion', 'categorical', possible_values=['gini', 'entropy'])
+        optimizer = GridSearchOptimizer(RandomForestClassifier(n_estimators=5), [p1], accuracy_score,
+                                        grid_sizes={})
+        # the study ends once both cells have been evaluated
+        self._fit_with_worker(optimizer, 5, n_trials=2)
+
+    def test_hyperopt(self):
+        optimizer = HyperoptOptimizer(RandomForestClassifier(n_estimators=5), self._hyperparams(), accuracy_score)
+        best_params = self._fit_with_worker(optimizer, 4)
+        self.assertTrue(1 <= best_params['max_depth'] <= 10)
+        # every proposal has been completed for the next TPE step
+        self.assertEqual(optimizer._proposed, [])
+        self.assertEqual(sorted(-trial['result']['loss'] for trial in optimizer._tpe_trials.trials),
+                         sorted(score for score, params in optimizer.hyperparam_history))
+
+    def test_fit_ignores_earlier_trials(self):
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=10)
+        optimizer = RandomSearchOptimizer(RandomForestClassifier(n_estimators=5), [p1], accuracy_score)
+        # a finished trial of an earlier run on the same database
+        coordinator = Coordinator(optimizer, self.db_path)
+        trial_id = coordinator.submit({'max_depth': 3})
+        connection = connect(self.db_path)
+        claim_trial(connection, 'a', 60., 3)
+        finish_trial(connection, trial_id, 'a', score=1.5, duration=1.)
+        # unfinished trials of an earlier run are cancelled instead of evaluated
+        running = coordinator.submit({'max_depth': 4})
+        claim_trial(connection, 'a', 60., 3)
+        pending = coordinator.submit({'max_depth': 5})
+        self._fit_with_worker(optimizer, 3)
+        self.assertNotIn(1.5, [score for score, params in optimizer.hyperparam_history])
+        for trial_id, claimed_by in [(running, 'a'), (pending, None)]:
+            state, worker = connection.execute("SELECT state, worker FROM trials WHERE id=?", (trial_id,)).fetchone()
+            self.assertEqual(state, CANCELLED)
+            self.assertEqual(worker, claimed_by)
+        self.assertFalse(finish_trial(connection, running, 'a', score=0.5, duration=1.))
+
+    def test_fit_without_successful_trials(self):
+        np.random.seed(5)
+        data, target = make_classification(n_samples=60, n_features=5)
+        # negative depths are rejected by the model
+        p1 = Parameter('max_depth', 'integer', lower=-5, upper=-1)
+        optimizer = RandomSearchOptimizer(RandomForestClassifier(n_estimators=5), [p1], accuracy_score)
+        worker = threading.Thread(target=lambda: Worker(self.db_path, poll_interval=0.01, max_idle=60).run())
+        worker.daemon = True
+        worker.start()
+        coordinator = Coordinator(optimizer, self.db_path, poll_interval=0.01)
+        with self.assertRaises(RuntimeError) as context:
+            coordinator.fit(data, target, n_iters=2)
+        worker.join(60)
+        self.assertIn('none of the 2 trials succeeded', str(context.exception))
+        self.assertEqual(len(coordinator.failed_trials), 2)
+
+    def test_claim_and_reclaim(self):
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=10)
+        optimizer = RandomSearchOptimizer(RandomForestClassifier(), [p1], accuracy_score)
+        coordinator = Coordinator(optimizer, self.db_path)
+        first = coordinator.submit({'max_depth': 1})
+        second = coordinator.submit({'max_depth': 2})
+        connection = connect(self.db_path)
+        self.assertEqual(claim_trial(connection, 'a', 60., 3), (first, {'max_depth': 1}))
+        self.assertEqual(claim_trial(connection, 'b', 0., 3), (second, {'max_depth': 2}))
+        # the lease of worker 'b' has expired, so its trial is handed out again
+        time.sleep(0.01)
+        self.assertEqual(claim_trial(connection, 'c', 60., 3), (second, {'max_depth': 2}))
+        self.assertIsNone(claim_trial(connection, 'd', 60., 3))
+        # a late result of the worker that lost the trial is ignored
+        self.assertFalse(finish_trial(connection, second, 'b', score=0.1, duration=1.))
+        self.assertTrue(finish_trial(connection, second, 'c', score=0.9, duration=1.))
+        self.assertTrue(finish_trial(connection, first, 'a', error='Traceback'))
+        observed = set()
+        self.assertEqual(coordinator.collect(observed), 2)
+        self.assertEqual(optimizer.hyperparam_history, [(0.9, {'max_depth': 2})])
+        self.assertEqual(coordinator.failed_trials, [({'max_depth': 1}, 'Traceback')])
+
+    def test_max_attempts(self):
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=10)
+        coordinator = Coordinator(RandomSearchOptimizer(RandomForestClassifier(), [p1], accuracy_score),
+                                  self.db_path)
+        coordinator.submit({'max_depth': 1})
+        connection = connect(self.db_path)
+        self.assertIsNotNone(claim_trial(connection, 'a', 0., 2))
+        time.sleep(0.01)
+        self.assertIsNotNone(claim_trial(connection, 'b', 0., 2))
+        time.sleep(0.01)
+        self.assertIsNone(claim_trial(connection, 'c', 0., 2))
+        coordinator.collect(set())
+        self.assertEqual(len(coordinator.failed_trials), 1)
+
+    def test_fit_with_workers(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=60, n_features=5)
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=10)
+        optimizer = RandomSearchOptimizer(RandomForestClassifier(n_estimators=5), [p1], accuracy_score)
+        coordinator = Coordinator(optimizer, self.db_path, poll_interval=0.05)
+        env = dict(os.environ)
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env['PYTHONPATH'] = os.pathsep.join([root, env.get('PYTHONPATH', '')])
+        workers = [subprocess.Popen([sys.executable, '-m', 'optml.distributed', self.db_path,
+                                     '--poll-interval', '0.05', '--max-idle', '60'], env=env)
+                   for _ in range(2)]
+        try:
+            best_params, best_model = coordinator.fit(data, target, n_iters=6, max_pending=2)
+            for worker in workers:
+                self.assertEqual(worker.wait(timeout=60), 0)
+        finally:
+            for worker in workers:
+                if worker.poll() is None:
+                    worker.kill()
+        self.assertEqual(len(optimizer.hyperparam_history), 6)
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir, 'study_X_train.npy')))
+        best_model.fit(data, target)
+        connection = connect(self.db_path)
+        workers_used = connection.execute("SELECT COUNT(DISTINCT worker) FROM trials").fetchone()[0]
+        self.assertGreaterEqual(workers_used, 1)
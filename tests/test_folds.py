@@ -0,0 +1,100 @@
+import os
+import gc
+import pickle
+import shutil
+import tempfile
+import numpy as np
+import unittest
+from unittest import mock
+from optml.folds import CrossValidation
+from optml.random_search import RandomSearchOptimizer
+from optml.gridsearch_optimizer import GridSearchOptimizer
+from optml import Parameter
+from sklearn.linear_model import LogisticRegression
+from sklearn.datasets import make_classification
+
+def clf_score(y_true,y_pred):
+    return np.sum(y_true==y_pred)/float(len(y_true))
+
+class TestCrossValidation(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(4)
+        self.data, self.target = make_classification(n_samples=60, n_features=5, weights=[0.8])
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_strategies(self):
+        indices = CrossValidation(3, strategy='stratified').split(self.data, self.target)
+        for train_idxs, test_idxs in indices:
+            self.assertAlmostEqual(np.mean(self.target[test_idxs]), np.mean(self.target), delta=0.05)
+        groups = np.arange(60) // 10
+        for train_idxs, test_idxs in CrossValidation(3, strategy='group', groups=groups).split(self.data):
+            self.assertEqual(len(set(groups[train_idxs]) & set(groups[test_idxs])), 0)
+        for train_idxs, test_idxs in CrossValidation(3, strategy='timeseries').split(self.data):
+            self.assertLess(train_idxs.max(), test_idxs.min())
+        with self.assertRaises(ValueError):
+            CrossValidation(3, strategy='group')
+
+    def test_indices_are_computed_once(self):
+        cv = CrossValidation(3, shuffle=True)
+        first = cv.split(self.data, self.target)
+        with mock.patch('optml.folds.fingerprint') as fingerprint:
+            self.assertIs(cv.split(self.data, self.target), first)
+        self.assertEqual(fingerprint.call_count, 0)
+        # a copy of the same data, e.g. in a worker process, gets the same shuffled folds
+        copy = pickle.loads(pickle.dumps(cv))
+        for (train_a, test_a), (train_b, test_b) in zip(first, copy.split(self.data.copy(), self.target.copy())):
+            np.testing.assert_array_equal(test_a, test_b)
+
+    def test_cache(self):
+        cv = CrossValidation(3, cache='memory', max_cache_bytes=2 * 60 * 6 * 8)
+        folds = list(cv.folds(self.data, self.target))
+        # only the first two folds fit into the cache
+        self.assertEqual(sorted(cv.cached_folds), [0, 1])
+        again = list(cv.folds(self.data, self.target))
+        self.assertIs(again[0][0], folds[0][0])
+        self.assertIsNot(again[2][0], folds[2][0])
+        np.testing.assert_array_equal(again[2][0], folds[2][0])
+
+        cv = CrossValidation(3, cache='mmap', cache_dir=self.tmp_dir).materialize(self.data, self.target)
+        self.assertEqual(len(os.listdir(self.tmp_dir)), 12)
+        X_train, y_train, X_test, y_test = pickle.loads(pickle.dumps(cv)).fold(1, self.data, self.target)
+        self.assertIsInstance(X_train, np.memmap)
+        np.testing.assert_array_equal(X_test, folds[1][2])
+        cv.clear()
+        self.assertEqual(len(os.listdir(self.tmp_dir)), 0)
+
+    def test_temporary_cache_dir(self):
+        cv = CrossValidation(3, cache='mmap').materialize(self.data, self.target)
+        cache_dir = cv.get_cache_dir()
+        self.assertEqual(len(os.listdir(cache_dir)), 12)
+        # copies in worker processes do not remove the directory
+        copy = pickle.loads(pickle.dumps(cv))
+        del copy
+        gc.collect()
+        self.assertTrue(os.path.exists(cache_dir))
+        del cv
+        gc.collect()
+        self.assertFalse(os.path.exists(cache_dir))
+
+    def test_optimizers(self):
+        p1 = Parameter('C', 'continuous', lower=0.01, upper=10.)
+        rand_search = RandomSearchOptimizer(LogisticRegression(), [p1], clf_score)
+        rand_search.set_cross_validation(strategy='stratified', cache='memory')
+        with mock.patch('optml.folds.StratifiedKFold.split', autospec=True,
+                        side_effect=lambda *args: iter([(np.arange(30), np.arange(30, 60)),
+                                                        (np.arange(30, 60), np.arange(30))])) as split:
+            rand_search.fit(self.data, self.target, n_iters=5, n_folds=2)
+        self.assertEqual(split.call_count, 1)
+        self.assertEqual(len(rand_search.hyperparam_history), 5)
+
+        grid_search = GridSearchOptimizer(LogisticRegression(), [p1], clf_score, {'C': 4}, n_jobs=2)
+        grid_search.set_cross_validation(strategy='stratified', cache='mmap', cache_dir=self.tmp_dir)
+        grid_search.fit(self.data, self.target, n_folds=3)
+        expected = RandomSearchOptimizer(LogisticRegression(), [p1], clf_score)
+        expected.set_cross_validation(strategy='stratified')
+        for score, params in grid_search.hyperparam_history:
+            self.assertAlmostEqual(score, expected.evaluate_hyperparams(params, self.data, self.target, n_folds=3))
+        grid_search.cv.clear()
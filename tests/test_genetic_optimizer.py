@@ -1,3 +1,4 @@
+import os
 import numpy as np
 import unittest
 from optml.genetic_optimizer import GeneticOptimizer
@@ -46,3 +47,102 @@ class TestGeneticOptimizer(unittest.TestCase):
         best_model.fit(data, target)
         final_score = clf_score(target, best_model.predict(data))
         self.assertTrue(final_score>start_score)
+
+    def test_vectorized_operators(self):
+        np.random.seed(3)
+        p1 = Parameter('A', 'integer', lower=1, upper=10)
+        p2 = Parameter('B', 'continuous', lower=0, upper=1)
+        geneticOpt = GeneticOptimizer(RandomForestClassifier(), [p1, p2], clf_score, 20,
+                                      'Tournament', {'A': 1., 'B': 0.1}, generational=True,
+                                      population_size=10, n_elites=2)
+        population = geneticOpt.init_population_matrix(10)
+        self.assertEqual(population.shape, (10, 2))
+        fitness = np.arange(10, dtype=float)
+        parent_idxs = geneticOpt.select_parents_vectorized(fitness, 50, 3)
+        self.assertEqual(parent_idxs.shape, (50, 3))
+        # tournaments favour fit individuals
+        self.assertGreater(np.mean(parent_idxs), 4.5)
+        geneticOpt.parent_selection_method = 'RouletteWheel'
+        parent_idxs = geneticOpt.select_parents_vectorized(fitness, 1000, 3)
+        self.assertTrue(np.all((parent_idxs >= 0) & (parent_idxs < 10)))
+        self.assertGreater(np.mean(parent_idxs), 4.5)
+
+        elites, children = geneticOpt.next_generation(population, fitness)
+        np.testing.assert_array_equal(elites, population[[9, 8]])
+        self.assertEqual(children.shape, (8, 2))
+        self.assertTrue(np.all(children[:, 0] == np.round(children[:, 0])))
+        self.assertTrue(np.all((children[:, 0] >= 1) & (children[:, 0] <= 10)))
+        self.assertTrue(np.all((children[:, 1] >= 0) & (children[:, 1] <= 1)))
+
+    def test_generational(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=60, n_features=5)
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=10)
+        p2 = Parameter('min_samples_split', 'continuous', lower=0.01, upper=0.5)
+        geneticOpt = GeneticOptimizer(RandomForestClassifier(n_estimators=5), [p1, p2], clf_score, 8,
+                                      'Tournament', {'max_depth': 1., 'min_samples_split': 0.05},
+                                      generational=True, population_size=6, n_elites=2, n_jobs=2)
+        best_params, best_model = geneticOpt.fit(X_train=data, y_train=target, n_iters=3)
+        self.assertEqual(len(geneticOpt.hyperparam_history), 8 + 3 * 4)
+        self.assertEqual(geneticOpt.population.shape, (6, 2))
+        # elitism: the best score found is always part of the final population
+        self.assertEqual(np.max(geneticOpt.fitness), max(s for s, p in geneticOpt.hyperparam_history))
+        self.assertIsInstance(best_params['max_depth'], int)
+
+
+    def test_migration(self):
+        p1 = Parameter('A', 'integer', lower=1, upper=10)
+        geneticOpt = GeneticOptimizer(RandomForestClassifier(), [p1], clf_score, 4, 'Tournament',
+                                      {'A': 1.}, n_islands=4, n_migrants=2)
+        self.assertEqual(geneticOpt.migration_targets(3), [0])
+        geneticOpt.migration_topology = 'fully_connected'
+        self.assertEqual(geneticOpt.migration_targets(1), [0, 2, 3])
+        geneticOpt.migration_topology = 'random'
+        self.assertIn(geneticOpt.migration_targets(1)[0], [0, 2, 3])
+        population = np.array([[1.], [2.], [3.], [4.]])
+        fitness = np.array([0.5, 0.1, 0.9, 0.2])
+        population, fitness = geneticOpt.receive_migrants(population, fitness,
+                                                          np.array([[7.], [8.]]), np.array([0.95, 0.15]))
+        np.testing.assert_array_equal(population.ravel(), [1., 7., 3., 4.])
+        np.testing.assert_array_equal(fitness, [0.5, 0.95, 0.9, 0.2])
+
+    def test_islands(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=60, n_features=5)
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=10)
+        p2 = Parameter('min_samples_split', 'continuous', lower=0.01, upper=0.5)
+        geneticOpt = GeneticOptimizer(RandomForestClassifier(n_estimators=5), [p1, p2], clf_score, 4,
+                                      'RouletteWheel', {'max_depth': 1., 'min_samples_split': 0.05},
+                                      n_islands=3, migration_interval=1, migration_topology='fully_connected')
+        best_params, best_model = geneticOpt.fit(X_train=data, y_train=target, n_iters=3)
+        self.assertEqual(len(geneticOpt.island_histories), 3)
+        for history in geneticOpt.island_histories:
+            self.assertEqual(len(history), 4 + 3 * 3)
+        self.assertEqual(len(geneticOpt.hyperparam_history), 3 * (4 + 3 * 3))
+        best_score = max(s for s, p in geneticOpt.hyperparam_history)
+        self.assertIn((best_score, best_params), geneticOpt.hyperparam_history)
+
+    def test_island_failures(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=60, n_features=5)
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=10)
+        def failing_score(y_true, y_pred):
+            raise ValueError("broken metric")
+        def exiting_score(y_true, y_pred):
+            os._exit(3)
+        for eval_func, exception in [(failing_score, ValueError), (exiting_score, RuntimeError)]:
+            geneticOpt = GeneticOptimizer(RandomForestClassifier(n_estimators=5), [p1], eval_func, 4,
+                                          'RouletteWheel', {'max_depth': 1.}, n_islands=2)
+            with self.assertRaises(exception):
+                geneticOpt.fit(X_train=data, y_train=target, n_iters=2)
+
+    def test_island_trial_statuses(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=60, n_features=5)
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=10)
+        geneticOpt = GeneticOptimizer(RandomForestClassifier(n_estimators=5), [p1], clf_score, 4,
+                                      'RouletteWheel', {'max_depth': 1.}, n_islands=2)
+        geneticOpt.set_trial_limits(timeout=60)
+        geneticOpt.fit(X_train=data, y_train=target, n_iters=1)
+        self.assertEqual(len(geneticOpt.trial_statuses), len(geneticOpt.hyperparam_history))
+        self.assertEqual(set(status['status'] for status in geneticOpt.trial_statuses), set(['ok']))
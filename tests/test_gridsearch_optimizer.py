@@ -1,11 +1,17 @@
 import numpy as np
 import unittest
-from optml.gridsearch_optimizer import GridSearchOptimizer, objective
+from optml.gridsearch_optimizer import GridSearchOptimizer, CellCostModel, objective
 from optml import Parameter
 from copy import deepcopy
+from sklearn.linear_model import LogisticRegression
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.datasets import make_classification
+from sklearn.model_selection import KFold
 from functools import partial
+import itertools
+import os
+import shutil
+import tempfile
 
 def clf_score(y_true,y_pred):
     return np.sum(y_true==y_pred)/float(len(y_true))
@@ -73,3 +79,181 @@ class TestGridsearchOptimizer(unittest.TestCase):
         # model should fit the data perfectly
         final_score = fun(model.get_params())[0]
         self.assertEqual(final_score,1)
+
+    def test_lazy_grid(self):
+        p1 = Parameter('A', 'integer', lower=1, upper=10)
+        p2 = Parameter('B', 'continuous', lower=0, upper=1)
+        p3 = Parameter('C', 'categorical', possible_values=['Bla1', 'Bla2'])
+        p4 = Parameter('D', 'boolean')
+        grid_sizes = {'A': 3, 'B': 4}
+        grid_search = GridSearchOptimizer(RandomForestClassifier(), [p1, p2, p3, p4], clf_score, grid_sizes)
+        grid = grid_search.grid
+        names = grid.param_names
+        expected = [dict(zip(names, values)) for values in itertools.product(*grid.param_values)]
+        self.assertEqual(len(grid), len(expected))
+        self.assertEqual(list(grid), expected)
+        self.assertEqual(grid[-1], expected[-1])
+        with self.assertRaises(IndexError):
+            grid[len(grid)]
+
+    def test_partial_results(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=50, n_features=5)
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=4)
+        grid_search = GridSearchOptimizer(RandomForestClassifier(n_estimators=5), [p1], clf_score,
+                                          {'max_depth': 4}, n_jobs=2, chunksize=1)
+        seen = []
+        grid_search.fit(X_train=data, y_train=target,
+                        callback=lambda score, params: seen.append(len(grid_search.hyperparam_history)))
+        self.assertEqual(seen, list(range(1, len(grid_search.grid) + 1)))
+        self.assertEqual(sorted(p['max_depth'] for s, p in grid_search.hyperparam_history),
+                         sorted(p['max_depth'] for p in grid_search.grid))
+
+    def test_checkpoint(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=50, n_features=5)
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=4)
+        p2 = Parameter('criterion', 'categorical', possible_values=['gini', 'entropy'])
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'checkpoint.jsonl')
+            grid_search = GridSearchOptimizer(RandomForestClassifier(n_estimators=5), [p1, p2], clf_score,
+                                              {'max_depth': 4}, n_jobs=2, chunksize=1)
+            grid_search.fit(X_train=data, y_train=target, checkpoint_path=path)
+            full_history = sorted(grid_search.hyperparam_history, key=lambda sp: sorted(sp[1].items()))
+            # simulate a crash after three cells with a partially written fourth line
+            with open(path) as f:
+                lines = f.readlines()
+            with open(path, 'w') as f:
+                f.writelines(lines[:3] + [lines[3][:10]])
+
+            restarted = GridSearchOptimizer(RandomForestClassifier(n_estimators=5), [p1, p2], clf_score,
+                                            {'max_depth': 4}, n_jobs=2, chunksize=1)
+            seen = []
+            restarted.fit(X_train=data, y_train=target, checkpoint_path=path,
+                          callback=lambda score, params: seen.append(params))
+            self.assertEqual(len(seen), len(restarted.grid) - 3)
+            self.assertEqual(len(restarted.hyperparam_history), len(restarted.grid))
+            history = sorted(restarted.hyperparam_history, key=lambda sp: sorted(sp[1].items()))
+            self.assertEqual([p for s, p in history], [p for s, p in full_history])
+
+            # nothing is left to evaluate once the search has completed
+            seen = []
+            restarted.fit(X_train=data, y_train=target, checkpoint_path=path,
+                          callback=lambda score, params: seen.append(params))
+            self.assertEqual(seen, [])
+            self.assertEqual(len(restarted.hyperparam_history), len(restarted.grid))
+
+            p3 = Parameter('criterion', 'categorical', possible_values=['entropy', 'gini'])
+            other = GridSearchOptimizer(RandomForestClassifier(n_estimators=5), [p1, p3], clf_score,
+                                        {'max_depth': 4})
+            with self.assertRaises(ValueError):
+                other.fit(X_train=data, y_train=target, checkpoint_path=path)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_cross_validation(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=60, n_features=5)
+        model = RandomForestClassifier(n_estimators=5, random_state=0)
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=4)
+        grid_search = GridSearchOptimizer(model, [p1], clf_score, {'max_depth': 4}, n_jobs=2)
+        grid_search.fit(X_train=data, y_train=target, n_folds=3)
+        self.assertEqual(len(grid_search.hyperparam_history), len(grid_search.grid))
+        for score, params in grid_search.hyperparam_history:
+            expected = np.mean([objective(model, 'sklearn', clf_score, data[train], target[train],
+                                          data[test], target[test], params)[0]
+                                for train, test in KFold(n_splits=3).split(data)])
+            self.assertAlmostEqual(score, expected)
+
+    def test_cancel_beaten_cells(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=60, n_features=5)
+        model = RandomForestClassifier(n_estimators=5, random_state=0)
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=10)
+        grid_search = GridSearchOptimizer(model, [p1], clf_score, {'max_depth': 10}, chunksize=1)
+        grid_search.fit(X_train=data, y_train=target, n_folds=5, cancel_margin=0.)
+        best_score = max(score for score, params in grid_search.hyperparam_history)
+        self.assertEqual(len(grid_search.hyperparam_history) + len(grid_search.cancelled_cells),
+                         len(grid_search.grid))
+        for partial_score, params in grid_search.cancelled_cells:
+            self.assertTrue(partial_score < best_score)
+
+    def test_refinement(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=60, n_features=5)
+        model = RandomForestClassifier(n_estimators=5, random_state=0)
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=33)
+        p2 = Parameter('min_weight_fraction_leaf', 'continuous', lower=0., upper=0.4)
+        grid_sizes = {'max_depth': 4, 'min_weight_fraction_leaf': 3}
+        grid_search = GridSearchOptimizer(model, [p1, p2], clf_score, grid_sizes)
+        grid_search.fit(X_train=data, y_train=target, n_refinements=2, top_k=2)
+        evaluated = [params for score, params in grid_search.hyperparam_history]
+        self.assertTrue(len(evaluated) > len(grid_search.grid))
+        # no point is evaluated twice
+        keys = set((p['max_depth'], round(p['min_weight_fraction_leaf'], 10)) for p in evaluated)
+        self.assertEqual(len(keys), len(evaluated))
+        # refined points lie between the points of the coarse grid
+        coarse = set(p['min_weight_fraction_leaf'] for p in grid_search.grid)
+        fine = set(p['min_weight_fraction_leaf'] for p in evaluated)
+        self.assertTrue(len(fine) > len(coarse))
+        for p in evaluated:
+            self.assertTrue(1 <= p['max_depth'] <= 33)
+            self.assertTrue(0. <= p['min_weight_fraction_leaf'] <= 0.4)
+
+    def test_refinement_of_small_grids(self):
+        p1 = Parameter('C', 'continuous', lower=0., upper=10.)
+        for grid_size, expected in [(3, [2.5, 5., 7.5]), (2, [2.5, 5., 7.5]), (5, [2.5, 3.75, 5., 6.25, 7.5])]:
+            grid_search = GridSearchOptimizer(LogisticRegression(), [p1], clf_score, {'C': grid_size})
+            refined = [params['C'] for params in grid_search.refine_grid({'C': 5.}, {'C': 2.5})]
+            np.testing.assert_allclose(refined, expected)
+        # points outside of the bounds are dropped
+        self.assertEqual([params['C'] for params in grid_search.refine_grid({'C': 10.}, {'C': 2.5})],
+                         [7.5, 8.75, 10.])
+
+        np.random.seed(4)
+        data, target = make_classification(n_samples=60, n_features=5)
+        p1 = Parameter('C', 'continuous', lower=0.01, upper=2.01)
+        grid_search = GridSearchOptimizer(LogisticRegression(), [p1], clf_score, {'C': 3})
+        evaluated = []
+        grid_search.fit(X_train=data, y_train=target, n_refinements=3, top_k=1,
+                        callback=lambda score, params: evaluated.append(params['C']))
+        self.assertEqual(len(evaluated), len(set(evaluated)))
+        # every round evaluates the two new points around the best cell
+        self.assertEqual(len(evaluated), 3 + 3 * 2)
+
+    def test_cost_model(self):
+        p1 = Parameter('n_estimators', 'integer', lower=10, upper=100)
+        p2 = Parameter('criterion', 'categorical', possible_values=['gini', 'entropy'])
+        grid_search = GridSearchOptimizer(RandomForestClassifier(), [p1, p2], clf_score,
+                                          {'n_estimators': 9})
+        grid = grid_search.grid
+        cells = np.arange(len(grid))
+        cost_model = CellCostModel()
+        np.testing.assert_array_equal(cost_model.estimate(grid, cells), np.zeros(len(grid)))
+        for cell_idx in cells[::3]:
+            params = grid[cell_idx]
+            cost_model.observe(params, 0.01 * params['n_estimators'])
+        log_costs = cost_model.estimate(grid, cells)
+        n_estimators = np.array([grid[cell_idx]['n_estimators'] for cell_idx in cells])
+        self.assertTrue(np.corrcoef(log_costs, np.log(n_estimators))[0, 1] > 0.9)
+
+        cost_model = CellCostModel(cost_hint=lambda params: params['n_estimators'])
+        log_costs = cost_model.estimate(grid, cells)
+        np.testing.assert_allclose(log_costs, np.log(n_estimators))
+
+    def test_longest_first(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=60, n_features=5)
+        p1 = Parameter('n_estimators', 'integer', lower=2, upper=20)
+        grid_search = GridSearchOptimizer(RandomForestClassifier(), [p1], clf_score,
+                                          {'n_estimators': 6}, scheduling='longest_first',
+                                          cost_hint=lambda params: params['n_estimators'])
+        grid_search.fit(X_train=data, y_train=target, n_folds=2)
+        self.assertEqual(len(grid_search.hyperparam_history), len(grid_search.grid))
+        # the most expensive cell is evaluated first
+        self.assertEqual(grid_search.hyperparam_history[0][1]['n_estimators'], 20)
+        self.assertEqual(grid_search.cost_model.n_observations, 2 * len(grid_search.grid))
+        with self.assertRaises(ValueError):
+            GridSearchOptimizer(RandomForestClassifier(), [p1], clf_score, {'n_estimators': 6},
+                                scheduling='random')
@@ -1,11 +1,23 @@
 import numpy as np
 import unittest
-from optml.hyperopt_optimizer import HyperoptOptimizer
+import os
+import shutil
+import tempfile
+import threading
+from hyperopt import hp, tpe
+from hyperopt.base import JOB_STATE_RUNNING, JOB_STATE_DONE, JOB_STATE_ERROR
+from optml.hyperopt_optimizer import HyperoptOptimizer, LocalProcessTrials
 from optml import Parameter
 from sklearn.linear_model import LogisticRegression
 from  sklearn.ensemble import RandomForestClassifier
 from sklearn.datasets import make_classification
 
+def dying_objective(params):
+    # kills the worker process, like the OOM killer would
+    if params['x'] < 0.5:
+        os._exit(1)
+    return params['x']
+
 def clf_score(y_true,y_pred):
     return np.sum(y_true==y_pred)/float(len(y_true))
 
@@ -45,4 +57,70 @@ class TestHyperoptOptimizer(unittest.TestCase):
         self.assertTrue(final_score>start_score)
 
         for status in hyperopt.trials.statuses():
-            self.assertEqual(status, 'ok')
\ No newline at end of file
+            self.assertEqual(status, 'ok')
+
+    def test_parallel(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=60, n_features=5)
+        model = RandomForestClassifier(n_estimators=5, max_depth=5)
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=10)
+        p2 = Parameter('criterion', 'categorical', possible_values=['gini', 'entropy'])
+        hyperopt = HyperoptOptimizer(model, [p1, p2], clf_score, n_jobs=2)
+        self.assertEqual(hyperopt.max_queue_len, 2)
+        best_params, best_model = hyperopt.fit(X_train=data, y_train=target, n_iters=8)
+        self.assertEqual(len(hyperopt.trials.trials), 8)
+        self.assertEqual(len(hyperopt.hyperparam_history), 8)
+        for status in hyperopt.trials.statuses():
+            self.assertEqual(status, 'ok')
+        # trials build their own models instead of replacing the base model
+        self.assertIs(hyperopt.model, model)
+        self.assertEqual(model.get_params()['max_depth'], 5)
+        self.assertFalse(os.path.exists(hyperopt.trials.db_path))
+
+    def test_local_process_trials_resume(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=60, n_features=5)
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=10)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            db_path = os.path.join(tmp_dir, 'trials.sqlite')
+            hyperopt = HyperoptOptimizer(RandomForestClassifier(n_estimators=5), [p1], clf_score,
+                                         n_jobs=2, trials_db_path=db_path)
+            hyperopt.fit(X_train=data, y_train=target, n_iters=4)
+            trials = LocalProcessTrials(db_path=db_path)
+            self.assertEqual(len(trials.trials), 4)
+            trials.close()
+            self.assertTrue(os.path.exists(db_path))
+
+            hyperopt.fit(X_train=data, y_train=target, n_iters=6)
+            tids = [trial['tid'] for trial in hyperopt.trials.trials]
+            self.assertEqual(sorted(tids), list(range(6)))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+    def test_local_process_trials_failures(self):
+        np.random.seed(4)
+        trials = LocalProcessTrials(n_jobs=2)
+        try:
+            trials.fmin(dying_objective, {'x': hp.uniform('x', 0., 1.)}, algo=tpe.suggest, max_evals=6,
+                        rstate=np.random.default_rng(0))
+            # failed trials are not part of trials.trials
+            docs = trials._dynamic_trials
+            states = [doc['state'] for doc in docs]
+            self.assertEqual(len(docs), 6)
+            for doc in docs:
+                x = doc['misc']['vals']['x'][0]
+                self.assertEqual(doc['state'], JOB_STATE_ERROR if x < 0.5 else JOB_STATE_DONE)
+            self.assertIn(JOB_STATE_ERROR, states)
+
+            # the error callback of the pool runs on another thread
+            with trials._connection:
+                trials._connection.execute("INSERT INTO trials (tid, state) VALUES (?, ?)", (100, JOB_STATE_RUNNING))
+            thread = threading.Thread(target=trials._make_error_callback(100), args=(RuntimeError('lost'),))
+            thread.start()
+            thread.join()
+            state = trials._connection.execute("SELECT state FROM trials WHERE tid=100").fetchone()[0]
+            self.assertEqual(state, JOB_STATE_ERROR)
+        finally:
+            trials.close()
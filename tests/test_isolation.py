@@ -0,0 +1,84 @@
+import os
+import time
+import numpy as np
+import unittest
+from optml.isolation import run_isolated, OK, TIMEOUT, MEMORY, ERROR, CRASHED
+from optml.differential_evolution_optimizer import DifferentialEvolutionOptimizer
+from optml.random_search import RandomSearchOptimizer
+from optml.gridsearch_optimizer import GridSearchOptimizer
+from optml import Parameter
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.datasets import make_classification
+
+def clf_score(y_true,y_pred):
+    return np.sum(y_true==y_pred)/float(len(y_true))
+
+def slow_score(y_true, y_pred):
+    time.sleep(30)
+    return 1.
+
+def allocate(n_bytes):
+    return len(np.ones(n_bytes // 8))
+
+class TestIsolation(unittest.TestCase):
+    def test_run_isolated(self):
+        self.assertEqual(run_isolated(max, (1, 2)), (OK, 2))
+        start = time.time()
+        status, message = run_isolated(time.sleep, (30,), timeout=0.5)
+        self.assertEqual(status, TIMEOUT)
+        self.assertLess(time.time() - start, 10)
+        status, message = run_isolated(int, ('a',))
+        self.assertEqual(status, ERROR)
+        self.assertIn('ValueError', message)
+        status, message = run_isolated(os._exit, (3,))
+        self.assertEqual(status, CRASHED)
+        self.assertIn('3', message)
+
+    @unittest.skipUnless(os.name == 'posix', 'memory limits need the resource module')
+    def test_memory_limit(self):
+        status, message = run_isolated(allocate, (2 * 1024**3,), memory_limit=200 * 1024**2)
+        self.assertEqual(status, MEMORY)
+        self.assertEqual(run_isolated(allocate, (8 * 1024**2,), memory_limit=200 * 1024**2),
+                         (OK, 1024**2))
+
+    def test_penalty_score(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=60, n_features=5)
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=10)
+        optimizer = RandomSearchOptimizer(RandomForestClassifier(n_estimators=5), [p1], slow_score)
+        optimizer.set_trial_limits(timeout=0.5, penalty_score=-1.)
+        self.assertTrue(optimizer.isolates_trials)
+        self.assertEqual(optimizer.evaluate_hyperparams({'max_depth': 3}, data, target), -1.)
+        self.assertEqual(optimizer.trial_statuses[-1]['status'], TIMEOUT)
+        self.assertEqual(optimizer.trial_statuses[-1]['params'], {'max_depth': 3})
+        # without an explicit penalty the worst score so far is used
+        optimizer.set_trial_limits(timeout=0.5)
+        optimizer.hyperparam_history = [(0.7, {}), (0.4, {})]
+        self.assertEqual(optimizer.evaluate_hyperparams({'max_depth': 3}, data, target), 0.4)
+
+    def test_isolated_parallel_fit(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=60, n_features=5)
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=10)
+        optimizer = DifferentialEvolutionOptimizer(RandomForestClassifier(n_estimators=5), [p1], clf_score,
+                                                   population_size=4, n_jobs=2)
+        optimizer.set_trial_limits(timeout=60, memory_limit=2 * 1024**3)
+        optimizer.fit(data, target, n_iters=1)
+        self.assertEqual(len(optimizer.trial_statuses), 8)
+        self.assertTrue(all(status['status'] == OK for status in optimizer.trial_statuses))
+
+    def test_isolated_grid_search(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=60, n_features=5)
+        # min_samples_split=1 is rejected by scikit-learn
+        p1 = Parameter('min_samples_split', 'integer', lower=1, upper=3)
+        optimizer = GridSearchOptimizer(RandomForestClassifier(n_estimators=5), [p1], clf_score,
+                                        grid_sizes={'min_samples_split': 2}, n_jobs=2)
+        optimizer.set_trial_limits(timeout=60, penalty_score=-1.)
+        optimizer.fit(data, target)
+        self.assertEqual(len(optimizer.trial_statuses), 3)
+        statuses = {status['params']['min_samples_split']: status['status'] for status in optimizer.trial_statuses}
+        self.assertEqual(statuses, {1: ERROR, 2: OK, 3: OK})
+        scores = {params['min_samples_split']: score for score, params in optimizer.hyperparam_history}
+        self.assertEqual(scores[1], -1.)
+        self.assertGreater(scores[2], 0.)
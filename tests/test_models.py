@@ -0,0 +1,69 @@
+import numpy as np
+import unittest
+from unittest import mock
+from optml import models
+from optml.models import KerasModel, KerasSession
+
+class FakeNetwork(object):
+    def __init__(self, hidden_dim):
+        self.weights = [np.random.normal(size=hidden_dim)]
+        self.n_compiles = 0
+
+    def get_weights(self):
+        return [w.copy() for w in self.weights]
+
+    def set_weights(self, weights):
+        self.weights = [w.copy() for w in weights]
+
+    def fit(self, X, y, epochs, batch_size, verbose=0):
+        self.weights = [w + epochs for w in self.weights]
+
+    def predict(self, X):
+        return np.full(len(X), self.weights[0].sum())
+
+class LazyNNModel(KerasModel):
+    def __init__(self, hidden_dim, train_epochs=1, batch_size=32):
+        self.epochs = train_epochs
+        self.batch_size = batch_size
+        self.hidden_dim = hidden_dim
+
+    def build_model(self):
+        return FakeNetwork(self.hidden_dim)
+
+    def compile_model(self, model):
+        model.n_compiles += 1
+
+    def get_params(self, deep=False):
+        return {'batch_size': self.batch_size,
+                'hidden_dim': self.hidden_dim,
+                'train_epochs': self.epochs}
+
+class TestKerasSession(unittest.TestCase):
+    def test_reuse_and_clear(self):
+        session = KerasSession()
+        X = np.zeros((3, 2))
+        with mock.patch.object(models, 'keras_session', session), \
+                mock.patch.object(models, '_clear_session') as clear_session:
+            first = LazyNNModel(hidden_dim=4, train_epochs=1)
+            first.fit(X, None)
+            first_prediction = first.predict(X)
+            # only a training parameter changes: same network with its initial weights
+            second = LazyNNModel(hidden_dim=4, train_epochs=2)
+            second.fit(X, None)
+            self.assertIs(second.model, first.model)
+            np.testing.assert_allclose(second.predict(X), first_prediction + 4)
+            self.assertEqual(second.model.n_compiles, 2)
+            with self.assertRaises(RuntimeError):
+                first.predict(X)
+            self.assertEqual(clear_session.call_count, 0)
+            # a structural change builds a new network and clears the session
+            third = LazyNNModel(hidden_dim=5)
+            third.fit(X, None)
+            self.assertIsNot(third.model, first.model)
+            self.assertEqual(clear_session.call_count, 1)
+        self.assertEqual((session.n_builds, session.n_reuses), (2, 1))
+
+    def test_structure_key(self):
+        self.assertEqual(LazyNNModel(4, train_epochs=1, batch_size=8).structure_key(),
+                         LazyNNModel(4, train_epochs=5, batch_size=16).structure_key())
+        self.assertNotEqual(LazyNNModel(4).structure_key(), LazyNNModel(5).structure_key())
@@ -0,0 +1,82 @@
+import numpy as np
+import pickle
+import unittest
+from unittest import mock
+from optml.pipeline_cache import TransformerCache, clone_pipeline, fit_pipeline
+from optml.random_search import RandomSearchOptimizer
+from optml.gridsearch_optimizer import GridSearchOptimizer
+from optml import Parameter
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.decomposition import PCA
+from sklearn.linear_model import LogisticRegression
+from sklearn.datasets import make_classification
+
+def clf_score(y_true,y_pred):
+    return np.sum(y_true==y_pred)/float(len(y_true))
+
+def make_pipeline():
+    return Pipeline([('scale', StandardScaler()), ('pca', PCA(n_components=3)), ('log', LogisticRegression())])
+
+class TestPipelineCache(unittest.TestCase):
+    def test_eviction(self):
+        cache = TransformerCache(max_bytes=100, max_entries=2)
+        cache.put('a', 1, 40)
+        cache.put('b', 2, 40)
+        cache.get('a')
+        cache.put('c', 3, 40)
+        # 'b' is the least recently used entry
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('d', 4, 200)
+        self.assertIsNone(cache.get('d'))
+        cache.put('e', 5, 10)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(len(pickle.loads(pickle.dumps(cache))), 0)
+
+    def test_clone_pipeline(self):
+        pipeline = make_pipeline()
+        new_pipeline = clone_pipeline(pipeline, dict(pipeline.get_params(), log__C=0.5))
+        self.assertEqual(new_pipeline.get_params()['log__C'], 0.5)
+        self.assertEqual(pipeline.get_params()['log__C'], 1.0)
+        self.assertIsNot(new_pipeline.steps[0][1], pipeline.steps[0][1])
+
+    def test_only_downstream_steps_are_refit(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=60, n_features=5)
+        trials = [{'log__C': 1.}, {'log__C': 0.1}, {'pca__n_components': 2}, {'log__C': 0.1}]
+        expected = [clone_pipeline(make_pipeline(), params).fit(data, target).predict_proba(data)
+                    for params in trials]
+        cache = TransformerCache()
+        fitted = []
+        original_fit = PCA.fit_transform
+        def counting_fit(self, *args, **kwargs):
+            fitted.append(self.n_components)
+            return original_fit(self, *args, **kwargs)
+        with mock.patch.object(PCA, 'fit_transform', counting_fit):
+            for params, probabilities in zip(trials, expected):
+                pipeline = fit_pipeline(clone_pipeline(make_pipeline(), params), data, target, cache)
+                np.testing.assert_allclose(pipeline.predict_proba(data), probabilities)
+            # new data is a cache miss
+            fit_pipeline(make_pipeline(), data[:40], target[:40], cache)
+        self.assertEqual(fitted, [3, 2, 3])
+        # the scaler is reused by the last three trials, the PCA by the second and fourth
+        self.assertEqual(cache.hits, 5)
+
+    def test_optimizer(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=60, n_features=5)
+        pipeline = make_pipeline()
+        p1 = Parameter('log__C', 'continuous', lower=0.01, upper=10.)
+        rand_search = RandomSearchOptimizer(pipeline, [p1], clf_score)
+        best_params, best_model = rand_search.fit(data, target, n_iters=5, n_folds=2)
+        # the transformers are fitted once per fold
+        self.assertEqual(rand_search.pipeline_cache.misses, 4)
+        self.assertEqual(rand_search.pipeline_cache.hits, 16)
+        self.assertEqual(pipeline.get_params()['log__C'], 1.0)
+        self.assertEqual(best_model.get_params()['log__C'], best_params['log__C'])
+
+        grid_search = GridSearchOptimizer(pipeline, [p1], clf_score, {'log__C': 4}, n_jobs=2)
+        grid_search.fit(data, target)
+        self.assertEqual(len(grid_search.hyperparam_history), 4)
+        self.assertEqual(pipeline.get_params()['log__C'], 1.0)
@@ -0,0 +1,79 @@
+import numpy as np
+import unittest
+from optml.pruning import MedianStoppingRule, TrialReporter, TrialPruned, reporting, report, fit_iteratively
+from optml.random_search import RandomSearchOptimizer
+from optml import Parameter
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+from sklearn.datasets import make_classification
+
+def clf_score(y_true,y_pred):
+    return np.sum(y_true==y_pred)/float(len(y_true))
+
+class TestPruning(unittest.TestCase):
+    def test_median_stopping_rule(self):
+        rule = MedianStoppingRule(n_startup_trials=2)
+        self.assertFalse(rule.should_stop([(1, 0.)]))
+        rule.complete([(1, 0.5), (2, 0.7)])
+        rule.complete([(1, 0.6), (2, 0.8)])
+        # running averages at step 2 are 0.6 and 0.7
+        self.assertTrue(rule.should_stop([(1, 0.55), (2, 0.6)]))
+        self.assertFalse(rule.should_stop([(1, 0.55), (2, 0.7)]))
+        self.assertFalse(rule.should_stop([(1, 0.6)]))
+
+    def test_report(self):
+        # outside of a trial reports are ignored
+        report(1, 0.)
+        rule = MedianStoppingRule(n_startup_trials=1)
+        with reporting(TrialReporter(rule, None, None, clf_score)):
+            report(1, 0.8)
+        self.assertEqual(rule.curves, [[(1, 0.8)]])
+        with self.assertRaises(TrialPruned):
+            with reporting(TrialReporter(rule, None, None, clf_score)):
+                report(1, 0.5)
+        self.assertEqual((len(rule.curves), rule.n_pruned), (1, 1))
+
+    def test_fit_iteratively(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=80, n_features=5)
+        model = GradientBoostingClassifier(n_estimators=20, random_state=0)
+        reporter = TrialReporter(MedianStoppingRule(), data, target, clf_score)
+        fitted = fit_iteratively(model, 'sklearn', data, target, reporter, n_reports=4)
+        self.assertEqual([step for step, value in reporter.curve], [5, 10, 15, 20])
+        expected = GradientBoostingClassifier(n_estimators=20, random_state=0).fit(data, target)
+        self.assertEqual(reporter.curve[-1][1], clf_score(target, expected.predict(data)))
+        self.assertEqual(fitted.n_estimators_, 20)
+
+    def test_fewer_rounds_than_reports(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=80, n_features=5)
+        reporter = TrialReporter(MedianStoppingRule(), data, target, clf_score)
+        fitted = fit_iteratively(RandomForestClassifier(n_estimators=3, random_state=0), 'sklearn',
+                                 data, target, reporter, n_reports=10)
+        self.assertEqual([step for step, value in reporter.curve], [1, 2, 3])
+        self.assertEqual(len(fitted.estimators_), 3)
+
+    def test_optimizer_with_folds(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=100, n_features=5, flip_y=0.1)
+        model = GradientBoostingClassifier(n_estimators=20, random_state=0)
+        p1 = Parameter('learning_rate', 'continuous', lower=0.001, upper=1.)
+        rand_search = RandomSearchOptimizer(model, [p1], clf_score)
+        rule = MedianStoppingRule(n_startup_trials=3, min_steps=2)
+        rand_search.set_stopping_rule(rule, n_reports=5)
+        rand_search.fit(data, target, n_iters=10, n_folds=3)
+        # one curve per completed trial, not per fold
+        self.assertEqual(len(rule.curves) + rule.n_pruned, 10)
+        self.assertTrue(all([step for step, value in curve] == [4, 8, 12, 16, 20] for curve in rule.curves))
+
+    def test_optimizer(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=100, n_features=5, flip_y=0.1)
+        model = GradientBoostingClassifier(n_estimators=20, random_state=0)
+        p1 = Parameter('learning_rate', 'continuous', lower=0.001, upper=1.)
+        rand_search = RandomSearchOptimizer(model, [p1], clf_score)
+        rule = MedianStoppingRule(n_startup_trials=3, min_steps=2)
+        rand_search.set_stopping_rule(rule, n_reports=5)
+        rand_search.fit(data[:60], target[:60], data[60:], target[60:], n_iters=15)
+        self.assertEqual(len(rand_search.hyperparam_history), 15)
+        self.assertEqual(len(rule.curves) + rule.n_pruned, 15)
+        self.assertGreater(rule.n_pruned, 0)
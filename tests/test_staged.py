@@ -0,0 +1,83 @@
+import numpy as np
+import unittest
+from unittest import mock
+from optml.staged import get_round_param, group_by_rounds, staged_scores, stopping_round
+from optml.random_search import RandomSearchOptimizer
+from optml.gridsearch_optimizer import GridSearchOptimizer, objective
+from optml import Parameter
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+from sklearn.datasets import make_classification
+
+def clf_score(y_true,y_pred):
+    return np.sum(y_true==y_pred)/float(len(y_true))
+
+class TestStaged(unittest.TestCase):
+    def test_round_param(self):
+        self.assertEqual(get_round_param(GradientBoostingClassifier(), 'sklearn'), 'n_estimators')
+        self.assertIsNone(get_round_param(RandomForestClassifier(), 'sklearn'))
+        groups = group_by_rounds([{'n_estimators': 5, 'max_depth': 1}, {'n_estimators': 10, 'max_depth': 2},
+                                  {'n_estimators': 20, 'max_depth': 1}], 'n_estimators')
+        self.assertEqual(sorted(groups), [[0, 2], [1]])
+
+    def test_batch_matches_single_fits(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=80, n_features=5, flip_y=0.2)
+        model = GradientBoostingClassifier(random_state=0, subsample=0.8)
+        p1 = Parameter('n_estimators', 'integer', lower=1, upper=30)
+        optimizer = RandomSearchOptimizer(model, [p1], clf_score)
+        trials = [{'n_estimators': n, 'max_depth': d} for n in [3, 10, 25] for d in [1, 2]]
+        expected = [optimizer.evaluate_hyperparams(t, data, target, n_folds=2) for t in trials]
+
+        fitted_rounds = []
+        original_fit = GradientBoostingClassifier.fit
+        def counting_fit(self, *args, **kwargs):
+            fitted_rounds.append(self.n_estimators)
+            return original_fit(self, *args, **kwargs)
+        with mock.patch.object(GradientBoostingClassifier, 'fit', counting_fit):
+            scores = optimizer.evaluate_hyperparams_batch(trials, data, target, n_folds=2)
+        np.testing.assert_allclose(scores, expected)
+        # one fit per fold and max_depth, always with the largest number of rounds
+        self.assertEqual(fitted_rounds, [25] * 4)
+
+    def test_early_stopping(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=200, n_features=5, flip_y=0.3)
+        model = GradientBoostingClassifier(random_state=0)
+        scores = staged_scores(model, 'sklearn', model.get_params(), 'n_estimators', [50, 100, 200],
+                               clf_score, data, target, data, target, early_stopping_rounds=2)
+        # training stops early, so more rounds than that do not change the predictions
+        self.assertEqual(scores[1], scores[2])
+
+    def test_early_stopping_uses_validation_data(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=300, n_features=5, flip_y=0.3)
+        X_train, y_train, X_val, y_val = data[:200], target[:200], data[200:], target[200:]
+        model = GradientBoostingClassifier(random_state=0)
+        fitted = []
+        original_fit = GradientBoostingClassifier.fit
+        def recording_fit(self, *args, **kwargs):
+            fitted.append(self)
+            return original_fit(self, *args, **kwargs)
+        with mock.patch.object(GradientBoostingClassifier, 'fit', recording_fit):
+            scores = staged_scores(model, 'sklearn', model.get_params(), 'n_estimators', [5, 100],
+                                   clf_score, X_train, y_train, X_val, y_val, early_stopping_rounds=3)
+        # no internal validation split is held out of the training data
+        self.assertIsNone(fitted[0].n_iter_no_change)
+        best_round = stopping_round(fitted[0], X_val, y_val, clf_score, 3)
+        self.assertLess(best_round, 100)
+        expected = clf_score(y_val, list(fitted[0].staged_predict(X_val))[best_round - 1])
+        self.assertEqual(scores[1], expected)
+
+    def test_grid_search(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=60, n_features=5)
+        model = GradientBoostingClassifier(random_state=0)
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=2)
+        p2 = Parameter('n_estimators', 'integer', lower=5, upper=20)
+        grid_search = GridSearchOptimizer(model, [p1, p2], clf_score, {'max_depth': 2, 'n_estimators': 4},
+                                          n_jobs=2, chunksize=8)
+        grid_search.fit(data, target)
+        self.assertEqual(len(grid_search.hyperparam_history), len(grid_search.grid))
+        for score, params in grid_search.hyperparam_history:
+            self.assertAlmostEqual(score, objective(model, 'sklearn', clf_score, data, target,
+                                                    data, target, params)[0])
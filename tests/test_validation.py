@@ -0,0 +1,170 @@
+import numpy as np
+import unittest
+from unittest import mock
+from optml.validation import SubsampledValidation, StreamingMetric, Accuracy, NegMeanSquaredError, score_model
+from optml.gridsearch_optimizer import GridSearchOptimizer
+from optml.random_search import RandomSearchOptimizer
+from optml import Parameter
+from sklearn.linear_model import LogisticRegression
+from sklearn.dummy import DummyClassifier
+from sklearn.tree import DecisionTreeClassifier
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+from sklearn.datasets import make_classification
+
+def clf_score(y_true,y_pred):
+    return np.sum(y_true==y_pred)/float(len(y_true))
+
+class CountingModel(object):
+    def __init__(self, model):
+        self.model = model
+        self.n_predicted = 0
+        self.max_rows = 0
+
+    def predict(self, X):
+        self.n_predicted += len(X)
+        self.max_rows = max(self.max_rows, len(X))
+        return self.model.predict(X)
+
+class TestSubsampledValidation(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(4)
+        self.data, self.target = make_classification(n_samples=3000, n_features=5, flip_y=0.05)
+
+    def test_escalation(self):
+        validation = SubsampledValidation(subsample_size=300, random_state=0)
+        good = CountingModel(LogisticRegression().fit(self.data[:500], self.target[:500]))
+        result = validation.score(good, self.data, self.target, clf_score)
+        # without an incumbent every model is scored in full
+        self.assertEqual(good.n_predicted, 3300)
+        self.assertEqual(result['score'], result['full_score'])
+        lower, upper = result['interval']
+        self.assertLessEqual(lower, result['subsample_score'])
+        self.assertGreaterEqual(upper, result['subsample_score'])
+
+        bad = CountingModel(DummyClassifier(strategy='constant', constant=0).fit(self.data, self.target))
+        result = validation.score(bad, self.data, self.target, clf_score)
+        self.assertEqual(bad.n_predicted, 300)
+        self.assertIsNone(result['full_score'])
+        self.assertEqual(result['score'], result['subsample_score'])
+        self.assertEqual((validation.n_subsampled, validation.n_escalated), (2, 1))
+        # the same rows are used for every trial
+        np.testing.assert_array_equal(validation.get_subsample(0, 3000), validation.get_subsample(0, 3000))
+
+        small = CountingModel(good.model)
+        result = validation.score(small, self.data[:200], self.target[:200], clf_score)
+        self.assertEqual((small.n_predicted, result['subsample_score']), (200, None))
+
+    def test_optimizer(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=3000, n_features=5, flip_y=0.3)
+        np.random.seed(0)
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=30)
+        rand_search = RandomSearchOptimizer(DecisionTreeClassifier(random_state=0), [p1], clf_score)
+        rand_search.set_subsampled_validation(subsample_size=500, random_state=0)
+        rand_search.fit(data[:1000], target[:1000], data[1000:], target[1000:], n_iters=10)
+        history = rand_search.validation_history
+        self.assertEqual(len(history), 10)
+        best = max(record['full_score'] for record in history if record['full_score'] is not None)
+        n_subsampled = 0
+        for record, (score, params) in zip(history, rand_search.hyperparam_history):
+            self.assertEqual(record['score'], score)
+            self.assertIsNotNone(record['subsample_score'])
+            if record['full_score'] is None:
+                n_subsampled += 1
+                self.assertLess(record['folds'][0]['interval'][1], best)
+        # deep trees overfit and are only scored on the subsample
+        self.assertGreater(n_subsampled, 0)
+        self.assertIsNotNone(history[int(np.argmax([s for s, p in rand_search.hyperparam_history]))]['full_score'])
+
+        p1 = Parameter('C', 'continuous', lower=0.01, upper=10.)
+        rand_search = RandomSearchOptimizer(LogisticRegression(), [p1], clf_score)
+        rand_search.set_subsampled_validation(subsample_size=300, random_state=0)
+        score = rand_search.evaluate_hyperparams({'C': 1.}, self.data, self.target, n_folds=3)
+        record = rand_search.validation_history[0]
+        self.assertEqual(len(record['folds']), 3)
+        self.assertAlmostEqual(record['full_score'], score)
+
+    def test_folds_are_escalated_together(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=3000, n_features=5, flip_y=0.3)
+        np.random.seed(0)
+        p1 = Parameter('max_depth', 'integer', lower=1, upper=30)
+        rand_search = RandomSearchOptimizer(DecisionTreeClassifier(random_state=0), [p1], clf_score)
+        rand_search.set_subsampled_validation(subsample_size=300, random_state=0)
+        rand_search.fit(data, target, n_iters=10, n_folds=3)
+        history = rand_search.validation_history
+        for record in history:
+            escalated = [fold['full_score'] is not None for fold in record['folds']]
+            self.assertIn(escalated, [[True] * 3, [False] * 3])
+            self.assertEqual(record['full_score'] is not None, all(escalated))
+        self.assertLess(rand_search.subsampled_validation.n_escalated, 10)
+        # the best trial has been scored on all of the validation data
+        best = int(np.argmax([score for score, params in rand_search.hyperparam_history]))
+        self.assertIsNotNone(history[best]['full_score'])
+        self.assertEqual(rand_search.subsampled_validation.incumbent, history[best]['full_score'])
+
+class TestStreamingMetric(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(4)
+        self.data, self.target = make_classification(n_samples=1000, n_features=5, flip_y=0.1)
+        self.model = LogisticRegression().fit(self.data, self.target)
+
+    def test_metrics(self):
+        y_pred = self.model.predict(self.data)
+        self.assertAlmostEqual(Accuracy()(self.target, y_pred), clf_score(self.target, y_pred))
+        self.assertAlmostEqual(NegMeanSquaredError()(self.target, y_pred.reshape(-1, 1)),
+                               -np.mean((self.target - y_pred) ** 2))
+        metric = Accuracy()
+        metric.update(self.target[:10], y_pred[:10])
+        # evaluations work on copies of the metric
+        self.assertEqual(metric(self.target, y_pred), clf_score(self.target, y_pred))
+        self.assertEqual(metric.n_total, 10)
+        with self.assertRaises(NotImplementedError):
+            StreamingMetric()
+
+    def test_score_model(self):
+        expected = clf_score(self.target, self.model.predict(self.data))
+        for eval_func in [Accuracy(), clf_score]:
+            model = CountingModel(self.model)
+            self.assertAlmostEqual(score_model(model, self.data, self.target, eval_func, chunk_size=300), expected)
+            self.assertEqual((model.n_predicted, model.max_rows), (1000, 300))
+
+    def test_optimizers(self):
+        p1 = Parameter('C', 'continuous', lower=0.01, upper=10.)
+        results = []
+        for chunk_size in [None, 150]:
+            np.random.seed(1)
+            rand_search = RandomSearchOptimizer(LogisticRegression(), [p1], Accuracy())
+            rand_search.set_chunked_prediction(chunk_size)
+            rand_search.fit(self.data[:500], self.target[:500], self.data[500:], self.target[500:], n_iters=5)
+            results.append(rand_search.hyperparam_history)
+        self.assertEqual(results[0], results[1])
+
+        grid_search = GridSearchOptimizer(LogisticRegression(), [p1], Accuracy(), {'C': 3}, n_jobs=2)
+        grid_search.set_chunked_prediction(150)
+        grid_search.fit(self.data[:500], self.target[:500], self.data[500:], self.target[500:])
+        for score, params in grid_search.hyperparam_history:
+            model = LogisticRegression(**params).fit(self.data[:500], self.target[:500])
+            self.assertAlmostEqual(score, clf_score(self.target[500:], model.predict(self.data[500:])))
+
+    def test_shared_fits(self):
+        trials = [{'n_estimators': n} for n in [3, 6, 9]]
+        for model_class in [GradientBoostingClassifier, RandomForestClassifier]:
+            method = 'staged_predict' if model_class is GradientBoostingClassifier else 'predict'
+            original = getattr(model_class, method)
+            n_rows = []
+            def counting(model, X):
+                n_rows.append(len(X))
+                return original(model, X)
+            results = []
+            for chunk_size in [None, 150]:
+                p1 = Parameter('n_estimators', 'integer', lower=1, upper=10)
+                rand_search = RandomSearchOptimizer(model_class(random_state=0), [p1], Accuracy())
+                rand_search.set_chunked_prediction(chunk_size)
+                n_rows[:] = []
+                with mock.patch.object(model_class, method, counting):
+                    results.append(rand_search.evaluate_hyperparams_batch(trials, self.data[:500], self.target[:500],
+                                                                          self.data[500:], self.target[500:]))
+            # the shared fits predict the validation data in chunks, too
+            self.assertEqual(max(n_rows), 150)
+            np.testing.assert_allclose(results[0], results[1])
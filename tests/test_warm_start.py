@@ -0,0 +1,84 @@
+import numpy as np
+import unittest
+from unittest import mock
+from optml.warm_start import get_warm_start_path, warm_start_order, warm_start_scores
+from optml.staged import get_shared_fit, staged_scores
+from optml.random_search import RandomSearchOptimizer
+from optml.gridsearch_optimizer import GridSearchOptimizer
+from optml import Parameter
+from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
+from sklearn.linear_model import LogisticRegression, ElasticNet
+from sklearn.svm import SVC
+from sklearn.datasets import make_classification
+
+def clf_score(y_true,y_pred):
+    return np.sum(y_true==y_pred)/float(len(y_true))
+
+class TestWarmStart(unittest.TestCase):
+    def test_path(self):
+        self.assertEqual(get_warm_start_path(RandomForestClassifier(), 'sklearn'), ('n_estimators', True))
+        self.assertEqual(get_warm_start_path(LogisticRegression(), 'sklearn'), ('C', True))
+        self.assertEqual(get_warm_start_path(ElasticNet(), 'sklearn'), ('alpha', False))
+        self.assertIsNone(get_warm_start_path(SVC(), 'sklearn'))
+        self.assertEqual(warm_start_order([1.0, 0.01, 0.1], False), [0, 2, 1])
+
+    def test_forest_matches_cold_fits(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=80, n_features=5, flip_y=0.2)
+        model = RandomForestClassifier(random_state=0, max_depth=3)
+        p1 = Parameter('n_estimators', 'integer', lower=1, upper=30)
+        optimizer = RandomSearchOptimizer(model, [p1], clf_score)
+        trials = [{'n_estimators': n, 'max_features': f} for n in [20, 3, 10] for f in [1, 2]]
+        expected = [optimizer.evaluate_hyperparams(t, data, target, n_folds=2) for t in trials]
+
+        fitted = []
+        original_fit = RandomForestClassifier.fit
+        def counting_fit(self, *args, **kwargs):
+            fitted.append((self.n_estimators, len(getattr(self, 'estimators_', []))))
+            return original_fit(self, *args, **kwargs)
+        with mock.patch.object(RandomForestClassifier, 'fit', counting_fit):
+            scores = optimizer.evaluate_hyperparams_batch(trials, data, target, n_folds=2)
+        np.testing.assert_allclose(scores, expected)
+        # each fold and max_features grows one forest from 3 to 10 to 20 trees
+        self.assertEqual(fitted, [(3, 0), (10, 3), (20, 10)] * 4)
+
+    def test_regularization_path(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=100, n_features=5)
+        model = LogisticRegression()
+        values = [10., 0.01, 1.]
+        scores = warm_start_scores(model, 'sklearn', model.get_params(), 'C', values, clf_score,
+                                   data, target, data, target)
+        expected = [clf_score(target, LogisticRegression(C=c).fit(data, target).predict(data)) for c in values]
+        np.testing.assert_allclose(scores, expected)
+
+    def test_random_search(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=60, n_features=5)
+        model = RandomForestClassifier(random_state=0)
+        p1 = Parameter('n_estimators', 'integer', lower=1, upper=20)
+        rand_search = RandomSearchOptimizer(model, [p1], clf_score)
+        with mock.patch.object(RandomForestClassifier, 'fit', autospec=True,
+                               side_effect=RandomForestClassifier.fit) as fit:
+            rand_search.fit(data, target, n_iters=6)
+        self.assertEqual(len(rand_search.hyperparam_history), 6)
+        # all samples share one warm-started forest
+        self.assertEqual(fit.call_count, len(set(p['n_estimators'] for s, p in rand_search.hyperparam_history)))
+
+    def test_grid_search(self):
+        np.random.seed(4)
+        data, target = make_classification(n_samples=60, n_features=5)
+        model = LogisticRegression()
+        p1 = Parameter('C', 'continuous', lower=0.01, upper=10.)
+        grid_search = GridSearchOptimizer(model, [p1], clf_score, {'C': 5}, n_jobs=2, chunksize=5)
+        grid_search.fit(data, target)
+        expected = dict((params['C'], clf_score(target, LogisticRegression(C=params['C']).fit(data, target).predict(data)))
+                        for score, params in grid_search.hyperparam_history)
+        for score, params in grid_search.hyperparam_history:
+            self.assertAlmostEqual(score, expected[params['C']])
+
+    def test_boosting_uses_staged_predictions(self):
+        # models with staged predictions are not warm-started
+        self.assertIsNone(get_warm_start_path(GradientBoostingClassifier(), 'sklearn'))
+        self.assertIs(get_shared_fit(GradientBoostingClassifier(), 'sklearn')[1], staged_scores)
+        self.assertIs(get_shared_fit(RandomForestClassifier(), 'sklearn')[1], warm_start_scores)